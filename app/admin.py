@@ -1,11 +1,41 @@
 from django.contrib import admin
-from app.models import Shop, Product, Cart, CartItem, Order, OrderItem, Customer
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Sum
+from django.utils.functional import cached_property
+from app.models import Shop, Product, Cart, CartItem, Order, OrderItem, Customer, PickupSlot, ShopHoliday, LineNotification
+from app.order_queue import status_changed
+from app.search import search_orders
+from app.slots import release_slot
+
+
+# 絞り込みのない一覧では件数に PostgreSQL の統計情報の推定値を使うページネーター
+# （大きなテーブルで COUNT(*) の全件走査を避ける。その他のデータベースや絞り込み時は正確に数える）
+class EstimatedCountPaginator(Paginator):
+    # これより少ない推定件数の場合は正確に数える
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor == "postgresql" and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [self.object_list.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.ESTIMATE_THRESHOLD:
+                return row[0]
+        return super().count
 
 
 @admin.register(Shop)
 class ShopAdmin(admin.ModelAdmin):
-    list_display = ["name", "user", "is_active", "open_time", "close_time", "created_at"]
-    list_filter = ["is_active", "created_at"]
+    list_display = ["name", "user", "is_active", "is_open", "open_time", "close_time", "created_at"]
+    list_select_related = ["user"]
+    list_filter = ["is_active", "is_open", "created_at"]
     search_fields = ["name", "user__name", "address"]
     ordering = ["-created_at"]
 
@@ -13,6 +43,7 @@ class ShopAdmin(admin.ModelAdmin):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ["name", "shop", "category", "price", "is_available", "stock", "created_at"]
+    list_select_related = ["shop"]
     list_filter = ["category", "is_available", "shop", "created_at"]
     search_fields = ["name", "shop__name", "description"]
     ordering = ["shop", "category", "name"]
@@ -20,15 +51,36 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ["customer", "item_count", "total_price", "created_at"]
+    list_display = ["customer", "shop", "items_total_count", "items_total_price", "created_at"]
+    list_select_related = ["customer", "shop"]
     list_filter = ["created_at"]
     search_fields = ["customer__name", "customer__line_id"]
     ordering = ["-created_at"]
 
+    def get_queryset(self, request):
+        # 商品数・合計金額は一覧のクエリで集計する（カートごとに items を引かない）
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                items_count=Sum("items__quantity"),
+                items_price=Sum(F("items__quantity") * F("items__product__price")),
+            )
+        )
+
+    @admin.display(description="商品数", ordering="items_count")
+    def items_total_count(self, obj):
+        return obj.items_count or 0
+
+    @admin.display(description="合計金額", ordering="items_price")
+    def items_total_price(self, obj):
+        return obj.items_price or 0
+
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ["cart", "product", "quantity", "subtotal", "created_at"]
+    list_select_related = ["cart__customer", "product__shop"]
     list_filter = ["created_at"]
     search_fields = ["cart__customer__name", "product__name"]
     ordering = ["-created_at"]
@@ -37,23 +89,74 @@ class CartItemAdmin(admin.ModelAdmin):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ["id", "customer", "shop", "status", "total_amount", "created_at"]
+    list_select_related = ["customer", "shop"]
     list_filter = ["status", "shop", "created_at"]
-    search_fields = ["customer__name", "shop__name", "note"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # 検索は app.search で行う（注文番号・受付番号・顧客の名前・電話番号・LINE ID）
+    search_fields = ["customer__name", "customer__phone_number", "customer__line_id"]
+    search_help_text = "注文番号・受付番号・顧客の名前・電話番号・LINE IDで検索"
     ordering = ["-created_at"]
     readonly_fields = ["created_at", "updated_at"]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_orders(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # ステータスの変更をショップの待ち件数・受け取り枠に反映する（注文管理画面と同じ）
+        if not change:
+            status_changed(obj, None)
+        elif "status" in form.changed_data:
+            old_status = form.initial["status"]
+            if obj.status == "cancelled" and old_status != "cancelled":
+                release_slot(obj)
+            status_changed(obj, old_status)
+
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ["order", "product", "quantity", "price", "subtotal", "created_at"]
-    list_filter = ["created_at"]
-    search_fields = ["order__customer__name", "product__name"]
+    list_display = ["order", "product_name", "category", "quantity", "price", "subtotal", "created_at"]
+    list_select_related = ["order__customer", "order__shop"]
+    list_filter = ["category", "created_at"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_fields = ["order__customer__name", "product_name"]
     ordering = ["-created_at"]
 
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ["name", "gender", "phone_number", "line_id", "created_at"]
-    list_filter = ["gender", "created_at"]
+    list_display = ["name", "gender", "phone_number", "line_id", "is_active", "unfollowed_at", "created_at"]
+    show_full_result_count = False
+    list_filter = ["is_active", "gender", "created_at"]
     search_fields = ["name", "line_id", "phone_number"]
-    ordering = ["-created_at"]
\ No newline at end of file
+    ordering = ["-created_at"]
+
+
+@admin.register(PickupSlot)
+class PickupSlotAdmin(admin.ModelAdmin):
+    list_display = ["shop", "start", "reserved"]
+    list_select_related = ["shop"]
+    list_filter = ["shop"]
+    ordering = ["-start"]
+
+
+@admin.register(ShopHoliday)
+class ShopHolidayAdmin(admin.ModelAdmin):
+    list_display = ["shop", "date", "is_closed", "open_time", "close_time", "note"]
+    list_select_related = ["shop"]
+    list_filter = ["is_closed", "shop"]
+    ordering = ["-date"]
+
+
+@admin.register(LineNotification)
+class LineNotificationAdmin(admin.ModelAdmin):
+    list_display = ["order", "kind", "status", "attempts", "next_attempt_at", "sent_at", "created_at"]
+    list_select_related = ["order__customer", "order__shop"]
+    list_filter = ["kind", "status"]
+    search_fields = ["line_id"]
+    readonly_fields = ["retry_key"]
+    ordering = ["-created_at"]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # 休業日・担当ショップのキャッシュの破棄用シグナルを登録
+        from . import schedule, staff  # noqa: F401
@@ -14,6 +14,8 @@ class ShopRegisterForm(forms.ModelForm):
             "logo",
             "open_time",
             "close_time",
+            "slot_minutes",
+            "slot_capacity",
         ]
         widgets = {
             "name": forms.TextInput(attrs={"class": "w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"}),
@@ -24,6 +26,8 @@ class ShopRegisterForm(forms.ModelForm):
             "logo": forms.FileInput(attrs={"class": "w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"}),
             "open_time": forms.TimeInput(attrs={"type": "time", "class": "w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"}),
             "close_time": forms.TimeInput(attrs={"type": "time", "class": "w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"}),
+            "slot_minutes": forms.NumberInput(attrs={"class": "w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500", "min": 5}),
+            "slot_capacity": forms.NumberInput(attrs={"class": "w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500", "min": 1}),
         }
 
 
@@ -0,0 +1,237 @@
+"""
+スケール検証用のダミーデータ生成
+
+ショップ・商品・顧客・カート・過去の注文/注文アイテムを bulk_create でバッチ投入する。
+同じ --seed からは同じデータが生成されるため、ベンチマーク結果を比較できる。
+注文日時は実行日時ではなく --end-date（既定は固定の日付）を基準に、その前日までの期間に生成する。
+
+使い方:
+    python manage.py generate_data --customers 100000 --orders-per-customer 30 --years 3
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import UserAccount
+from app.models import Cart, CartItem, Customer, Order, OrderItem, Product, Shop
+
+# 注文時刻（時）の重み。朝と昼にピークがある
+HOUR_WEIGHTS = {
+    7: 6, 8: 10, 9: 7, 10: 4, 11: 6, 12: 10, 13: 8,
+    14: 4, 15: 4, 16: 3, 17: 3, 18: 3, 19: 2, 20: 1,
+}
+
+# 過去の注文のステータス分布
+STATUS_WEIGHTS = {"completed": 90, "cancelled": 8, "ready": 2}
+
+
+@contextmanager
+def historical_timestamps(*models):
+    """created_at/updated_at の自動設定を一時的に止め、生成した日時で保存できるようにする"""
+    fields = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+                fields.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+class Command(BaseCommand):
+    help = "スケール検証用のダミーデータを生成する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shops", type=int, default=10)
+        parser.add_argument("--products", type=int, default=100, help="ショップあたりの商品数")
+        parser.add_argument("--customers", type=int, default=10000)
+        parser.add_argument(
+            "--orders-per-customer",
+            type=float,
+            default=20,
+            help="顧客あたりの平均注文数（指数分布）",
+        )
+        parser.add_argument(
+            "--items-per-order", type=float, default=2, help="注文あたりの平均商品数"
+        )
+        parser.add_argument("--years", type=float, default=1, help="注文履歴の期間（年）")
+        parser.add_argument(
+            "--cart-ratio", type=float, default=0.2, help="カートに商品が残っている顧客の割合"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--end-date",
+            type=date.fromisoformat,
+            default=date(2026, 1, 1),
+            help="注文履歴の終了日（YYYY-MM-DD, この日の前日までの注文を生成する）",
+        )
+        parser.add_argument(
+            "--open-24h",
+            action="store_true",
+            help="ショップを24時間営業にする（実行時刻によらず注文できるようにするベンチマーク用）",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--prefix", default="gen", help="line_id・メールアドレスの接頭辞（重複回避用）"
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.options = options
+        self.batch_size = options["batch_size"]
+        self.end_date = options["end_date"]
+        started = time.perf_counter()
+
+        with historical_timestamps(Order, OrderItem):
+            shops, products_by_shop = self.create_shops()
+            self.log(f"ショップ: {len(shops)}件, 商品: {sum(map(len, products_by_shop.values()))}件")
+
+            counts = {"customers": 0, "orders": 0, "items": 0, "carts": 0}
+            for start in range(0, options["customers"], self.batch_size):
+                stop = min(start + self.batch_size, options["customers"])
+                with transaction.atomic():
+                    self.create_customer_chunk(start, stop, shops, products_by_shop, counts)
+                self.log(
+                    f"顧客 {counts['customers']}件 / 注文 {counts['orders']}件 / "
+                    f"注文アイテム {counts['items']}件 ({time.perf_counter() - started:.1f}秒)"
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"データ生成が完了しました ({time.perf_counter() - started:.1f}秒)")
+        )
+
+    def log(self, message):
+        if self.options["verbosity"] > 0:
+            self.stdout.write(message)
+
+    def exponential(self, mean):
+        """平均 mean の指数分布に従う整数"""
+        if mean <= 0:
+            return 0
+        return int(self.rng.expovariate(1 / mean))
+
+    def create_shops(self):
+        prefix = self.options["prefix"]
+        users = UserAccount.objects.bulk_create(
+            [
+                UserAccount(
+                    uid=f"{prefix}{i:08d}",
+                    email=f"{prefix}-shop{i}@example.com",
+                    name=f"ショップ{i}",
+                )
+                for i in range(self.options["shops"])
+            ]
+        )
+        # 開店時刻と閉店時刻が同じなら24時間営業
+        hours = {"open_time": dtime(0), "close_time": dtime(0)} if self.options["open_24h"] else {}
+        shops = Shop.objects.bulk_create(
+            [
+                Shop(user=user, name=f"{prefix}ショップ{i}", address=f"東京都{i}丁目", **hours)
+                for i, user in enumerate(users)
+            ]
+        )
+
+        products = []
+        for shop in shops:
+            for i in range(self.options["products"]):
+                products.append(
+                    Product(
+                        shop=shop,
+                        name=f"商品{i}",
+                        category=self.rng.choice(["drink", "drink", "food"]),
+                        price=self.rng.randrange(200, 1500, 10),
+                        is_available=self.rng.random() > 0.05,
+                    )
+                )
+        products = Product.objects.bulk_create(products, batch_size=self.batch_size)
+
+        products_by_shop = {}
+        for product in products:
+            products_by_shop.setdefault(product.shop_id, []).append(product)
+        return shops, products_by_shop
+
+    def create_customer_chunk(self, start, stop, shops, products_by_shop, counts):
+        rng = self.rng
+        prefix = self.options["prefix"]
+        customers = Customer.objects.bulk_create(
+            [
+                Customer(
+                    name=f"顧客{i}",
+                    line_id=f"U{prefix}{i:010d}",
+                    gender=rng.choice(["male", "female", "other", None]),
+                )
+                for i in range(start, stop)
+            ]
+        )
+        counts["customers"] += len(customers)
+
+        # 顧客ごとによく使うショップを決める（偏りを持たせる）
+        favorite = {c.pk: rng.choice(shops) for c in customers}
+
+        orders = []
+        order_lines = []
+        period_days = max(int(365 * self.options["years"]), 1)
+        tz = timezone.get_current_timezone()
+        hours, hour_weights = zip(*HOUR_WEIGHTS.items())
+        statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+        for customer in customers:
+            order_count = self.exponential(self.options["orders_per_customer"])
+            for _ in range(order_count):
+                shop = favorite[customer.pk] if rng.random() < 0.8 else rng.choice(shops)
+                day = self.end_date - timedelta(days=rng.randint(1, period_days))
+                created_at = timezone.make_aware(
+                    datetime.combine(day, datetime.min.time()).replace(
+                        hour=rng.choices(hours, hour_weights)[0],
+                        minute=rng.randrange(60),
+                    ),
+                    tz,
+                )
+                lines = []
+                total = 0
+                shop_products = products_by_shop.get(shop.pk, [])
+                item_count = min(1 + self.exponential(self.options["items_per_order"] - 1), 8, len(shop_products))
+                for product in rng.sample(shop_products, item_count):
+                    quantity = rng.choices([1, 2, 3], [80, 15, 5])[0]
+                    total += product.price * quantity
+                    lines.append((product, quantity))
+                orders.append(
+                    Order(
+                        customer=customer,
+                        shop=shop,
+                        status=rng.choices(statuses, status_weights)[0],
+                        total_amount=total,
+                        created_at=created_at,
+                        updated_at=created_at,
+                    )
+                )
+                order_lines.append(lines)
+
+        orders = Order.objects.bulk_create(orders, batch_size=self.batch_size)
+        items = [
+            OrderItem.for_product(product, quantity, order=order, created_at=order.created_at)
+            for order, lines in zip(orders, order_lines)
+            for product, quantity in lines
+        ]
+        OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+        counts["orders"] += len(orders)
+        counts["items"] += len(items)
+
+        # カートに商品が残っている顧客
+        cart_customers = [c for c in customers if rng.random() < self.options["cart_ratio"]]
+        carts = Cart.objects.bulk_create([Cart(customer=c, shop=favorite[c.pk]) for c in cart_customers])
+        cart_items = []
+        for cart in carts:
+            shop_products = products_by_shop.get(cart.shop_id, [])
+            for product in rng.sample(shop_products, min(rng.randint(1, 3), len(shop_products))):
+                cart_items.append(CartItem(cart=cart, product=product, quantity=rng.randint(1, 2)))
+        CartItem.objects.bulk_create(cart_items, batch_size=self.batch_size)
+        counts["carts"] += len(carts)
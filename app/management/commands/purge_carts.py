@@ -0,0 +1,65 @@
+"""
+放置されたカートの削除
+
+一定期間操作されていないカート（カート自体の更新日時・商品の追加日時がどちらも古いもの）を
+カートアイテムごと削除する。ロックを長時間保持しないよう、一定件数ずつ別トランザクションで削除する。
+cron 等で定期実行する。
+
+使い方:
+    python manage.py purge_carts --days 14 --batch-size 1000
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from app.models import Cart, CartItem
+
+
+def stale_carts(cutoff):
+    """cutoff より後に操作されていないカート"""
+    recent_items = CartItem.objects.filter(cart=OuterRef("pk"), created_at__gte=cutoff)
+    return Cart.objects.filter(updated_at__lt=cutoff).exclude(Exists(recent_items))
+
+
+class Command(BaseCommand):
+    help = "一定期間操作されていないカートを削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CART_EXPIRE_DAYS,
+            help="この日数以上操作されていないカートを削除する",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="1回の削除で処理するカート数")
+        parser.add_argument("--sleep", type=float, default=0, help="バッチ間の待機時間（秒）")
+        parser.add_argument("--dry-run", action="store_true", help="削除対象の件数のみ表示する")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        queryset = stale_carts(cutoff)
+
+        if options["dry_run"]:
+            self.stdout.write(f"削除対象: {queryset.count()}件（{cutoff:%Y-%m-%d %H:%M} 以前）")
+            return
+
+        total_carts = total_items = 0
+        while True:
+            ids = list(queryset.order_by("updated_at").values_list("id", flat=True)[: options["batch_size"]])
+            if not ids:
+                break
+            # 1バッチごとにコミットされる（CartItemはCASCADEで同時に削除）
+            # 選択後に商品が追加されたカートを消さないよう、削除時にも放置されているかを判定する
+            deleted, per_model = queryset.filter(id__in=ids).delete()
+            total_carts += per_model.get(Cart._meta.label, 0)
+            total_items += per_model.get(CartItem._meta.label, 0)
+            if options["verbosity"] >= 2:
+                self.stdout.write(f"  カート {total_carts}件 削除済み")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"カート {total_carts}件・カートアイテム {total_items}件を削除しました"))
@@ -0,0 +1,85 @@
+"""
+友達解除された顧客の匿名化
+
+友達解除（unfollow）では顧客を無効にするだけなので、保持期間を過ぎた顧客の個人情報をここで削除する。
+売上の集計に使う注文・注文アイテムは残し、顧客の名前・電話番号・LINE ID と注文の備考を消す。
+カートとLINE通知（送信先のLINE IDと本文を含むため、送信待ち・送信失敗のものも）は削除する。ロックを長時間保持しないよう、一定件数ずつ別トランザクションで処理する。
+cron 等で定期実行する。
+
+使い方:
+    python manage.py purge_customers --days 30 --batch-size 500
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+
+from app.models import Cart, Customer, LineNotification, Order
+
+ANONYMOUS_NAME = "退会済みユーザー"
+
+
+def anonymize_customers(ids, cutoff):
+    """cutoff より前に友達解除された顧客を匿名化する。戻り値: 匿名化した顧客数"""
+    with transaction.atomic():
+        # 選択した後に友達追加し直した顧客を除く。行をロックし、処理中に友達追加で有効に戻されないようにする
+        ids = list(
+            Customer.objects.select_for_update()
+            .filter(id__in=ids, is_active=False, unfollowed_at__lt=cutoff)
+            .values_list("id", flat=True)
+        )
+        if not ids:
+            return 0
+        Cart.objects.filter(customer_id__in=ids).delete()
+        # 送信待ちの通知も削除する（友達解除済みのため送信できない）
+        LineNotification.objects.filter(order__customer_id__in=ids).delete()
+        Order.objects.filter(customer_id__in=ids).exclude(note=None).update(note=None)
+        # unfollowed_at を空にして処理済みとする（LINE ID は一意制約があるため顧客IDから作る）
+        return Customer.objects.filter(id__in=ids, is_active=False, unfollowed_at__lt=cutoff).update(
+            name=ANONYMOUS_NAME,
+            gender=None,
+            phone_number=None,
+            line_id=Concat(Value("deleted-"), Cast("id", CharField())),
+            unfollowed_at=None,
+        )
+
+
+class Command(BaseCommand):
+    help = "友達解除から一定期間経過した顧客を匿名化する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CUSTOMER_RETENTION_DAYS,
+            help="友達解除からこの日数以上経過した顧客を匿名化する",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="1回の処理で匿名化する顧客数")
+        parser.add_argument("--sleep", type=float, default=0, help="バッチ間の待機時間（秒）")
+        parser.add_argument("--dry-run", action="store_true", help="対象の件数のみ表示する")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        queryset = Customer.objects.filter(is_active=False, unfollowed_at__lt=cutoff)
+
+        if options["dry_run"]:
+            self.stdout.write(f"匿名化対象: {queryset.count()}件（{cutoff:%Y-%m-%d %H:%M} 以前に友達解除）")
+            return
+
+        total = 0
+        while True:
+            ids = list(queryset.order_by("unfollowed_at").values_list("id", flat=True)[: options["batch_size"]])
+            if not ids:
+                break
+            total += anonymize_customers(ids, cutoff)
+            if options["verbosity"] >= 2:
+                self.stdout.write(f"  顧客 {total}件 匿名化済み")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"顧客 {total}件を匿名化しました"))
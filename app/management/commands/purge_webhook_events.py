@@ -0,0 +1,37 @@
+"""
+処理済みWebhookイベントの記録の削除
+
+重複排除用の WebhookEvent はLINEの再送期間を過ぎれば不要になるため、古いものを一定件数ずつ削除する。
+cron 等で定期実行する。
+
+使い方:
+    python manage.py purge_webhook_events --days 7
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import WebhookEvent
+
+
+class Command(BaseCommand):
+    help = "古いWebhookイベントの記録を削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="この日数より前に受信したイベントを削除する")
+        parser.add_argument("--batch-size", type=int, default=5000, help="1回の削除で処理する件数")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        queryset = WebhookEvent.objects.filter(created_at__lt=cutoff)
+
+        total = 0
+        while True:
+            ids = list(queryset.values_list("id", flat=True)[: options["batch_size"]])
+            if not ids:
+                break
+            deleted, _ = WebhookEvent.objects.filter(id__in=ids).delete()
+            total += deleted
+
+        self.stdout.write(self.style.SUCCESS(f"Webhookイベント {total}件を削除しました"))
@@ -0,0 +1,27 @@
+"""
+ショップの営業時間内フラグ（Shop.is_open）の更新
+
+営業時間・休業日から現在営業中かを判定し、変化したショップのみ一括で更新する。
+cron 等で毎分〜数分おきに実行する。
+
+使い方:
+    python manage.py update_shop_hours
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Shop
+from app.schedule import is_open
+
+
+class Command(BaseCommand):
+    help = "営業時間・休業日からショップの営業時間内フラグを更新する"
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        shops = Shop.objects.only("id", "is_active", "is_open", "open_time", "close_time")
+        open_ids = [shop.id for shop in shops if is_open(shop, now)]
+
+        opened = Shop.objects.filter(id__in=open_ids, is_open=False).update(is_open=True)
+        closed = Shop.objects.exclude(id__in=open_ids).filter(is_open=True).update(is_open=False)
+        self.stdout.write(f"開店: {opened}件 / 閉店: {closed}件")
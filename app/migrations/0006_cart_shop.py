@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+
+
+def backfill_cart_shop(apps, schema_editor):
+    # 既存カートのショップを最初の商品のショップで一括設定する（UPDATE 1回）
+    Cart = apps.get_model("app", "Cart")
+    CartItem = apps.get_model("app", "CartItem")
+    items = CartItem.objects.filter(cart=OuterRef("pk"))
+    Cart.objects.filter(Exists(items), shop__isnull=True).update(
+        shop_id=Subquery(items.order_by("id").values("product__shop_id")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_shop_logo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='carts', to='app.shop', verbose_name='ショップ'),
+        ),
+        migrations.RunPython(backfill_cart_shop, migrations.RunPython.noop),
+    ]
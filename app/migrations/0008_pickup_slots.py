@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:43
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_cart_updated_at_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='pickup_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='受け取り予定時刻'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='slot_capacity',
+            field=models.PositiveSmallIntegerField(default=10, validators=[django.core.validators.MinValueValidator(1)], verbose_name='受け取り枠あたりの注文数'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=15, validators=[django.core.validators.MinValueValidator(5)], verbose_name='受け取り枠の間隔（分）'),
+        ),
+        migrations.CreateModel(
+            name='PickupSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(verbose_name='開始時刻')),
+                ('reserved', models.PositiveIntegerField(default=0, verbose_name='予約数')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pickup_slots', to='app.shop', verbose_name='ショップ')),
+            ],
+            options={
+                'verbose_name': '受け取り枠',
+                'verbose_name_plural': '受け取り枠',
+                'constraints': [models.UniqueConstraint(fields=('shop', 'start'), name='unique_pickup_slot')],
+            },
+        ),
+    ]
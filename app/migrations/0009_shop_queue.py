@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def init_shop_queues(apps, schema_editor):
+    # 現在の受付中・準備中の注文数で待ち件数を初期化する
+    Order = apps.get_model("app", "Order")
+    ShopQueue = apps.get_model("app", "ShopQueue")
+    depths = (
+        Order.objects.filter(status__in=["pending", "preparing"])
+        .values("shop_id")
+        .annotate(depth=Count("id"))
+    )
+    ShopQueue.objects.bulk_create(
+        [ShopQueue(shop_id=row["shop_id"], depth=row["depth"]) for row in depths]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_pickup_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopQueue',
+            fields=[
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queue', serialize=False, to='app.shop', verbose_name='ショップ')),
+                ('depth', models.PositiveIntegerField(default=0, verbose_name='待ち件数')),
+                ('avg_prep_seconds', models.FloatField(default=300, verbose_name='平均準備時間（秒）')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日')),
+            ],
+            options={
+                'verbose_name': '待ち状況',
+                'verbose_name_plural': '待ち状況',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='queue_position',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='受付時の待ち件数'),
+        ),
+        migrations.RunPython(init_shop_queues, migrations.RunPython.noop),
+    ]
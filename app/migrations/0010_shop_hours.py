@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_shop_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='is_open',
+            field=models.BooleanField(default=True, verbose_name='営業時間内'),
+        ),
+        migrations.CreateModel(
+            name='ShopHoliday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('is_closed', models.BooleanField(default=True, verbose_name='休業')),
+                ('open_time', models.TimeField(blank=True, null=True, verbose_name='開店時間')),
+                ('close_time', models.TimeField(blank=True, null=True, verbose_name='閉店時間')),
+                ('note', models.CharField(blank=True, max_length=100, verbose_name='メモ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holidays', to='app.shop', verbose_name='ショップ')),
+            ],
+            options={
+                'verbose_name': '休業日・営業時間変更',
+                'verbose_name_plural': '休業日・営業時間変更',
+                'constraints': [models.UniqueConstraint(fields=('shop', 'date'), name='unique_shop_holiday')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_shop_hours'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'status', '-created_at'], name='order_customer_status_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_order_customer_status_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True, verbose_name='イベントID')),
+                ('event_type', models.CharField(max_length=30, verbose_name='イベント種別')),
+                ('is_redelivery', models.BooleanField(default=False, verbose_name='再送')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='受信日時')),
+            ],
+            options={
+                'verbose_name': 'Webhookイベント',
+                'verbose_name_plural': 'Webhookイベント',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:51
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_webhook_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LineNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order_confirmed', '注文確定'), ('order_cancelled', '注文キャンセル')], max_length=30, verbose_name='種別')),
+                ('line_id', models.CharField(max_length=255, verbose_name='送信先LINE ID')),
+                ('text', models.TextField(verbose_name='本文')),
+                ('retry_key', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='リトライキー')),
+                ('status', models.CharField(choices=[('pending', '送信待ち'), ('sent', '送信済み'), ('failed', '送信失敗')], default='pending', max_length=20, verbose_name='ステータス')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='送信回数')),
+                ('last_error', models.TextField(blank=True, verbose_name='最後のエラー')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='次回送信日時')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='送信日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='app.order', verbose_name='注文')),
+            ],
+            options={
+                'verbose_name': 'LINE通知',
+                'verbose_name_plural': 'LINE通知',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='notification_due_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'kind'), name='unique_order_notification')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_line_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='有効'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='unfollowed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='友達解除日時'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['unfollowed_at'], name='customer_unfollowed_at_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_customer_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='category',
+            field=models.CharField(blank=True, choices=[('food', 'フード'), ('drink', 'ドリンク')], default='', max_length=20, verbose_name='カテゴリ'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(default='', max_length=255, verbose_name='商品名'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.product', verbose_name='商品'),
+        ),
+    ]
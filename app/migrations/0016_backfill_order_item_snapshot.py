@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:54
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+# 1回の UPDATE で処理する注文アイテムのID範囲
+BATCH_SIZE = 5000
+
+
+def backfill_order_item_snapshot(apps, schema_editor):
+    # 注文アイテムに商品名・カテゴリを保存する（ID範囲ごとに UPDATE し、バッチごとにコミット）
+    OrderItem = apps.get_model("app", "OrderItem")
+    Product = apps.get_model("app", "Product")
+    products = Product.objects.filter(pk=OuterRef("product_id"))
+
+    last_id = OrderItem.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        OrderItem.objects.filter(id__gt=start, id__lte=start + BATCH_SIZE, product_name="").update(
+            product_name=Subquery(products.values("name")[:1]),
+            category=Subquery(products.values("category")[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+    # 大量の注文アイテムを1トランザクションでロックしないようにする
+    atomic = False
+
+    dependencies = [
+        ('app', '0015_order_item_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_item_snapshot, migrations.RunPython.noop),
+    ]
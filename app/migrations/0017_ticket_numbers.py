@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_backfill_order_item_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopDailyCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='最後の受付番号')),
+            ],
+            options={
+                'verbose_name': '受付番号カウンタ',
+                'verbose_name_plural': '受付番号カウンタ',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='ticket_date',
+            field=models.DateField(blank=True, null=True, verbose_name='受付日'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='ticket_number',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='受付番号'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('shop', 'ticket_date', 'ticket_number'), name='unique_order_ticket'),
+        ),
+        migrations.AddField(
+            model_name='shopdailycounter',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counters', to='app.shop', verbose_name='ショップ'),
+        ),
+        migrations.AddConstraint(
+            model_name='shopdailycounter',
+            constraint=models.UniqueConstraint(fields=('shop', 'date'), name='unique_shop_daily_counter'),
+        ),
+    ]
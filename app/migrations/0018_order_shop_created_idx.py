@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_ticket_numbers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shop', '-created_at'], name='order_shop_created_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:00
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# PostgreSQL のみ: 部分一致検索（icontains = UPPER(col::text) LIKE ...）用の trigram インデックス
+TRIGRAM_COLUMNS = ["name", "phone_number", "line_id"]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in TRIGRAM_COLUMNS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS customer_{column}_trgm_idx ON app_customer '
+            f'USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for column in TRIGRAM_COLUMNS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS customer_{column}_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_order_shop_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='customer_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(django.db.models.functions.text.Lower('line_id'), name='customer_line_id_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['phone_number'], name='customer_phone_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
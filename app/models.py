@@ -1,4 +1,10 @@
-from django.db import models
+import uuid
+
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Lower
+from django.utils import timezone
 from accounts.models import UserAccount
 
 
@@ -25,8 +31,16 @@ class Shop(models.Model):
         upload_to="shop/logos/", verbose_name="ロゴ", null=True, blank=True
     )
     is_active = models.BooleanField(verbose_name="営業中", default=True)
+    # 営業時間・休業日から定期的に更新する（update_shop_hours）
+    is_open = models.BooleanField(verbose_name="営業時間内", default=True)
     open_time = models.TimeField(verbose_name="開店時間", default="09:00:00")
     close_time = models.TimeField(verbose_name="閉店時間", default="21:00:00")
+    slot_minutes = models.PositiveSmallIntegerField(
+        verbose_name="受け取り枠の間隔（分）", default=15, validators=[MinValueValidator(5)]
+    )
+    slot_capacity = models.PositiveSmallIntegerField(
+        verbose_name="受け取り枠あたりの注文数", default=10, validators=[MinValueValidator(1)]
+    )
 
     updated_at = models.DateTimeField("更新日", auto_now=True)
     created_at = models.DateTimeField("作成日", auto_now_add=True)
@@ -39,6 +53,29 @@ class Shop(models.Model):
         return self.name
 
 
+# 休業日・営業時間の変更（特定の日付のみ）
+class ShopHoliday(models.Model):
+    shop = models.ForeignKey(
+        Shop, on_delete=models.CASCADE, verbose_name="ショップ", related_name="holidays"
+    )
+    date = models.DateField(verbose_name="日付")
+    is_closed = models.BooleanField(verbose_name="休業", default=True)
+    # 休業でない場合はこの日の営業時間
+    open_time = models.TimeField(verbose_name="開店時間", null=True, blank=True)
+    close_time = models.TimeField(verbose_name="閉店時間", null=True, blank=True)
+    note = models.CharField(verbose_name="メモ", max_length=100, blank=True)
+
+    class Meta:
+        verbose_name = "休業日・営業時間変更"
+        verbose_name_plural = "休業日・営業時間変更"
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "date"], name="unique_shop_holiday"),
+        ]
+
+    def __str__(self):
+        return f"{self.shop.name} - {self.date}"
+
+
 # 商品（ドリンク）
 class Product(models.Model):
     CATEGORY_CHOICES = (
@@ -92,6 +129,9 @@ class Customer(models.Model):
         max_length=15, verbose_name="電話番号", blank=True, null=True
     )
     line_id = models.CharField(max_length=255, unique=True, verbose_name="LINE ID")
+    # 友達解除されたら無効にし、保持期間後に purge_customers で匿名化する
+    is_active = models.BooleanField(verbose_name="有効", default=True)
+    unfollowed_at = models.DateTimeField(verbose_name="友達解除日時", blank=True, null=True)
 
     updated_at = models.DateTimeField("更新日", auto_now=True)
     created_at = models.DateTimeField("作成日", auto_now_add=True)
@@ -99,6 +139,13 @@ class Customer(models.Model):
     class Meta:
         verbose_name = "顧客"
         verbose_name_plural = "顧客"
+        indexes = [
+            models.Index(fields=["unfollowed_at"], name="customer_unfollowed_at_idx"),
+            # 注文検索の前方一致（app.search）
+            models.Index(Lower("name"), name="customer_name_lower_idx"),
+            models.Index(Lower("line_id"), name="customer_line_id_lower_idx"),
+            models.Index(fields=["phone_number"], name="customer_phone_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -109,12 +156,18 @@ class Cart(models.Model):
     customer = models.OneToOneField(
         Customer, on_delete=models.CASCADE, verbose_name="顧客", related_name="cart"
     )
+    # カートには1つのショップの商品のみ入れられる（最初に追加した商品のショップ）
+    shop = models.ForeignKey(
+        Shop, on_delete=models.SET_NULL, verbose_name="ショップ", related_name="carts", null=True, blank=True
+    )
     created_at = models.DateTimeField("作成日", auto_now_add=True)
     updated_at = models.DateTimeField("更新日", auto_now=True)
 
     class Meta:
         verbose_name = "カート"
         verbose_name_plural = "カート"
+        # 放置カートの削除（purge_carts）で使用
+        indexes = [models.Index(fields=["updated_at"], name="cart_updated_at_idx")]
 
     def __str__(self):
         return f"{self.customer.name}のカート"
@@ -127,6 +180,89 @@ class Cart(models.Model):
     def item_count(self):
         return sum(item.quantity for item in self.items.all())
 
+    @staticmethod
+    def _totals_aggregates():
+        return {
+            "total_price": Sum(F("quantity") * F("product__price")),
+            "item_count": Sum("quantity"),
+        }
+
+    def totals(self):
+        """合計金額と商品数を1クエリで集計する"""
+        result = self.items.aggregate(**self._totals_aggregates())
+        return {key: value or 0 for key, value in result.items()}
+
+    async def atotals(self):
+        result = await self.items.aaggregate(**self._totals_aggregates())
+        return {key: value or 0 for key, value in result.items()}
+
+    def touch(self):
+        """カートの更新日時を現在にする（商品の追加・数量変更・削除のたびに呼ばれ、purge_carts の判定に使う）"""
+        self.updated_at = timezone.now()
+        Cart.objects.filter(pk=self.pk).update(updated_at=self.updated_at)
+
+    def assign_shop(self, shop_id):
+        """
+        カートのショップを設定する。
+        別のショップの商品が既に入っている場合は設定せずに False を返す
+        """
+        if self.shop_id == shop_id:
+            return True
+        if self.shop_id is not None and self.items.exists():
+            return False
+        self.shop_id = shop_id
+        self.save(update_fields=["shop", "updated_at"])
+        return True
+
+    async def aassign_shop(self, shop_id):
+        if self.shop_id == shop_id:
+            return True
+        if self.shop_id is not None and await self.items.aexists():
+            return False
+        self.shop_id = shop_id
+        await self.asave(update_fields=["shop", "updated_at"])
+        return True
+
+    def add_items(self, quantities):
+        """
+        複数の商品をまとめてカートに追加する（既存の数量に加算）
+        quantities: {商品ID: 数量}
+        販売中かつカートと同じショップの商品のみ追加し、追加した商品のリストを返す。
+        カートに別のショップの商品が入っていて、同じショップの商品が1つもない場合は追加せずに None を返す
+        """
+        products = list(Product.objects.filter(id__in=quantities, is_available=True))
+        if not products:
+            return []
+
+        # カートのショップの商品を優先し、カートが空なら最初の商品のショップにする
+        shop_ids = {product.shop_id for product in products}
+        shop_id = self.shop_id if self.shop_id in shop_ids else products[0].shop_id
+        if not self.assign_shop(shop_id):
+            return None
+        products = [product for product in products if product.shop_id == shop_id]
+
+        with transaction.atomic():
+            existing = dict(
+                self.items.select_for_update()
+                .filter(product__in=products)
+                .values_list("product_id", "quantity")
+            )
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(
+                        cart=self,
+                        product=product,
+                        quantity=existing.get(product.id, 0) + quantities[product.id],
+                    )
+                    for product in products
+                ],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+            self.touch()
+        return products
+
 
 # カートアイテム
 class CartItem(models.Model):
@@ -147,6 +283,16 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.cart.customer.name} - {self.product.name} x {self.quantity}"
 
+    # 数量の変更・削除もカートの操作として更新日時に反映する（asave / adelete もここを通る）
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Cart(pk=self.cart_id).touch()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Cart(pk=self.cart_id).touch()
+        return result
+
     @property
     def subtotal(self):
         return self.product.price * self.quantity
@@ -173,6 +319,11 @@ class Order(models.Model):
     )
     total_amount = models.IntegerField(verbose_name="合計金額")
     note = models.TextField(verbose_name="備考", blank=True, null=True)
+    pickup_time = models.DateTimeField(verbose_name="受け取り予定時刻", blank=True, null=True)
+    queue_position = models.PositiveIntegerField(verbose_name="受付時の待ち件数", blank=True, null=True)
+    # ショップ・日付ごとの受付番号（店頭で呼び出す短い番号）
+    ticket_date = models.DateField(verbose_name="受付日", blank=True, null=True)
+    ticket_number = models.PositiveIntegerField(verbose_name="受付番号", blank=True, null=True)
     
     created_at = models.DateTimeField("作成日", auto_now_add=True)
     updated_at = models.DateTimeField("更新日", auto_now=True)
@@ -181,21 +332,41 @@ class Order(models.Model):
         verbose_name = "注文"
         verbose_name_plural = "注文"
         ordering = ["-created_at"]
+        # 顧客ごとの受け取り前の注文を新しい順に引く（トークでの注文確認・キャンセル）
+        indexes = [
+            models.Index(fields=["customer", "status", "-created_at"], name="order_customer_status_idx"),
+            # ショップごとの注文管理画面
+            models.Index(fields=["shop", "-created_at"], name="order_shop_created_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "ticket_date", "ticket_number"], name="unique_order_ticket")
+        ]
 
     def __str__(self):
         return f"{self.customer.name} - {self.shop.name} - {self.get_status_display()}"
 
+    @property
+    def ticket_label(self):
+        """受付番号の表示（3桁）"""
+        return f"{self.ticket_number:03d}" if self.ticket_number else ""
+
 
 # 注文アイテム
 class OrderItem(models.Model):
     order = models.ForeignKey(
         Order, on_delete=models.CASCADE, verbose_name="注文", related_name="items"
     )
+    # 商品が削除されても注文履歴は残す
     product = models.ForeignKey(
-        Product, on_delete=models.CASCADE, verbose_name="商品"
+        Product, on_delete=models.SET_NULL, verbose_name="商品", blank=True, null=True
+    )
+    # 注文時の商品名・カテゴリ・価格を保存（表示には商品を参照しない）
+    product_name = models.CharField(max_length=255, verbose_name="商品名", default="")
+    category = models.CharField(
+        max_length=20, verbose_name="カテゴリ", choices=Product.CATEGORY_CHOICES, blank=True, default=""
     )
     quantity = models.IntegerField(verbose_name="数量")
-    price = models.IntegerField(verbose_name="価格")  # 注文時の価格を保存
+    price = models.IntegerField(verbose_name="価格")
     created_at = models.DateTimeField("作成日", auto_now_add=True)
 
     class Meta:
@@ -203,8 +374,128 @@ class OrderItem(models.Model):
         verbose_name_plural = "注文アイテム"
 
     def __str__(self):
-        return f"{self.order.id} - {self.product.name} x {self.quantity}"
+        return f"{self.order_id} - {self.product_name} x {self.quantity}"
+
+    @classmethod
+    def for_product(cls, product, quantity, **kwargs):
+        """注文時点の商品の内容を保存した注文アイテム（未保存）"""
+        return cls(
+            product=product,
+            product_name=product.name,
+            category=product.category,
+            price=product.price,
+            quantity=quantity,
+            **kwargs,
+        )
 
     @property
     def subtotal(self):
         return self.price * self.quantity
+
+
+# 受け取り枠の予約数（ショップ・枠の開始時刻ごと）
+class PickupSlot(models.Model):
+    shop = models.ForeignKey(
+        Shop, on_delete=models.CASCADE, verbose_name="ショップ", related_name="pickup_slots"
+    )
+    start = models.DateTimeField(verbose_name="開始時刻")
+    reserved = models.PositiveIntegerField(verbose_name="予約数", default=0)
+
+    class Meta:
+        verbose_name = "受け取り枠"
+        verbose_name_plural = "受け取り枠"
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "start"], name="unique_pickup_slot"),
+        ]
+
+    def __str__(self):
+        return f"{self.shop.name} - {self.start:%Y-%m-%d %H:%M} ({self.reserved})"
+
+
+# ショップの待ち状況（受付中・準備中の注文数と1件あたりの平均準備時間）
+class ShopQueue(models.Model):
+    shop = models.OneToOneField(
+        Shop, on_delete=models.CASCADE, verbose_name="ショップ", related_name="queue", primary_key=True
+    )
+    depth = models.PositiveIntegerField(verbose_name="待ち件数", default=0)
+    avg_prep_seconds = models.FloatField(verbose_name="平均準備時間（秒）", default=300)
+    updated_at = models.DateTimeField("更新日", auto_now=True)
+
+    class Meta:
+        verbose_name = "待ち状況"
+        verbose_name_plural = "待ち状況"
+
+    def __str__(self):
+        return f"{self.shop.name} - {self.depth}件"
+
+
+# 処理済みのLINE Webhookイベント（再送・重複配信の排除用）
+class WebhookEvent(models.Model):
+    event_id = models.CharField(verbose_name="イベントID", max_length=64, unique=True)
+    event_type = models.CharField(verbose_name="イベント種別", max_length=30)
+    is_redelivery = models.BooleanField(verbose_name="再送", default=False)
+    created_at = models.DateTimeField("受信日時", auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Webhookイベント"
+        verbose_name_plural = "Webhookイベント"
+
+    def __str__(self):
+        return f"{self.event_type} - {self.event_id}"
+
+
+# LINEへのプッシュ通知（注文確定・キャンセルなど、1つの通知につき1行）
+class LineNotification(models.Model):
+    KIND_CHOICES = (
+        ("order_confirmed", "注文確定"),
+        ("order_cancelled", "注文キャンセル"),
+    )
+    STATUS_CHOICES = (
+        ("pending", "送信待ち"),
+        ("sent", "送信済み"),
+        ("failed", "送信失敗"),
+    )
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, verbose_name="注文", related_name="notifications"
+    )
+    kind = models.CharField(max_length=30, verbose_name="種別", choices=KIND_CHOICES)
+    line_id = models.CharField(max_length=255, verbose_name="送信先LINE ID")
+    text = models.TextField(verbose_name="本文")
+    # X-Line-Retry-Key に使う（同じキーで再送してもLINE側で重複送信されない）
+    retry_key = models.UUIDField(verbose_name="リトライキー", default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(
+        max_length=20, verbose_name="ステータス", choices=STATUS_CHOICES, default="pending"
+    )
+    attempts = models.PositiveSmallIntegerField(verbose_name="送信回数", default=0)
+    last_error = models.TextField(verbose_name="最後のエラー", blank=True)
+    next_attempt_at = models.DateTimeField(verbose_name="次回送信日時", default=timezone.now)
+    sent_at = models.DateTimeField(verbose_name="送信日時", blank=True, null=True)
+
+    created_at = models.DateTimeField("作成日", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "LINE通知"
+        verbose_name_plural = "LINE通知"
+        constraints = [models.UniqueConstraint(fields=["order", "kind"], name="unique_order_notification")]
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="notification_due_idx")]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} - 注文#{self.order_id} - {self.get_status_display()}"
+
+
+# ショップ・日付ごとの受付番号の採番用カウンタ
+class ShopDailyCounter(models.Model):
+    shop = models.ForeignKey(
+        Shop, on_delete=models.CASCADE, verbose_name="ショップ", related_name="daily_counters"
+    )
+    date = models.DateField(verbose_name="日付")
+    last_number = models.PositiveIntegerField(verbose_name="最後の受付番号", default=0)
+
+    class Meta:
+        verbose_name = "受付番号カウンタ"
+        verbose_name_plural = "受付番号カウンタ"
+        constraints = [models.UniqueConstraint(fields=["shop", "date"], name="unique_shop_daily_counter")]
+
+    def __str__(self):
+        return f"{self.shop.name} - {self.date} - {self.last_number}"
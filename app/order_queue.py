@@ -0,0 +1,79 @@
+"""
+ショップごとの待ち件数と完成予定時刻の見積もり
+
+待ち件数（受付中・準備中の注文数）は ShopQueue に保持し、注文の作成・ステータス変更のたびに
+F() で増減する。注文を数え直さないため、見積もりは1行の参照だけで済む。
+ShopQueue の行は同じショップの注文確定すべてが更新するため、加算は注文作成のトランザクションの最後に行い、
+行ロックを保持するのはコミットまでの数文の間だけにする。
+
+1件あたりの準備時間は、注文が準備完了になった時点の (受付から準備完了までの時間 ÷ 受付時の待ち件数) を
+指数移動平均（EWMA）で更新する。完成予定時刻は 受付時刻 + 受付時の待ち件数 × 平均準備時間 とする。
+
+受け取り時刻を指定した注文（pickup_time）はその時刻に合わせて準備するため、待ち件数にも平均準備時間にも含めない。
+"""
+from datetime import timedelta
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from app.models import Order, ShopQueue
+
+OPEN_STATUSES = ("pending", "preparing")
+DONE_STATUSES = ("ready", "completed")
+# 新しい実績をどの程度反映するか
+EWMA_ALPHA = 0.2
+
+
+def enqueue(shop_id):
+    """
+    注文の受付時に待ち件数を1増やす。
+    戻り値: この注文を含めた待ち件数
+    """
+    ShopQueue.objects.get_or_create(shop_id=shop_id)
+    ShopQueue.objects.filter(shop_id=shop_id).update(depth=F("depth") + 1)
+    return ShopQueue.objects.values_list("depth", flat=True).get(shop_id=shop_id)
+
+
+def enqueue_order(order):
+    """作成した注文を待ち件数に加え、受付時の待ち件数を保存する（注文作成のトランザクションの最後に呼ぶ）"""
+    if order.pickup_time:
+        return
+    order.queue_position = enqueue(order.shop_id)
+    Order.objects.filter(pk=order.pk).update(queue_position=order.queue_position)
+
+
+def status_changed(order, old_status):
+    """注文のステータス変更を待ち件数と平均準備時間に反映する"""
+    if order.pickup_time:
+        return
+    was_open = old_status in OPEN_STATUSES
+    is_open = order.status in OPEN_STATUSES
+    if was_open == is_open:
+        return
+
+    if is_open:
+        # 完了・キャンセルから戻された場合
+        ShopQueue.objects.get_or_create(shop_id=order.shop_id)
+        ShopQueue.objects.filter(shop_id=order.shop_id).update(depth=F("depth") + 1)
+        return
+
+    updates = {"depth": Greatest(F("depth") - 1, 0)}
+    if order.status in DONE_STATUSES:
+        elapsed = (timezone.now() - order.created_at).total_seconds()
+        sample = elapsed / max(order.queue_position or 1, 1)
+        updates["avg_prep_seconds"] = F("avg_prep_seconds") * (1 - EWMA_ALPHA) + sample * EWMA_ALPHA
+    ShopQueue.objects.filter(shop_id=order.shop_id).update(**updates)
+
+
+def estimated_ready_time(order, avg_prep_seconds=None):
+    """完成予定時刻（受付中・準備中の注文のみ。それ以外は None）"""
+    if order.status not in OPEN_STATUSES or not order.queue_position:
+        return None
+    if avg_prep_seconds is None:
+        avg_prep_seconds = (
+            ShopQueue.objects.filter(shop_id=order.shop_id).values_list("avg_prep_seconds", flat=True).first()
+        )
+        if avg_prep_seconds is None:
+            return None
+    return order.created_at + timedelta(seconds=order.queue_position * avg_prep_seconds)
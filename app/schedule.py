@@ -0,0 +1,79 @@
+"""
+ショップの営業時間の判定
+
+通常の営業時間は Shop.open_time / close_time（閉店時刻が開店時刻以前なら翌日閉店の深夜営業）、
+日付ごとの休業・営業時間の変更は ShopHoliday で指定する。
+ShopHoliday は全ショップ分を1つの辞書にしてキャッシュするため、ショップ一覧や注文確定で
+営業中かどうかを判定してもクエリは発生しない。
+キャッシュは ShopHoliday の保存/削除のコミット後に破棄する。複数ワーカーでは CACHE_URL の共有キャッシュで
+破棄を共有する（プロセス内メモリでは gunicorn.conf.py が1ワーカーで起動する）。
+"""
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from app.models import ShopHoliday
+
+OVERRIDES_CACHE_KEY = "shop:hours:overrides"
+OVERRIDES_CACHE_TIMEOUT = 60 * 60
+
+
+class ShopClosed(Exception):
+    """営業時間外のため注文できない"""
+
+
+def overrides():
+    """{ショップID: {日付: (休業か, 開店時刻, 閉店時刻)}}（前日以降の分のみ・キャッシュ）"""
+    data = cache.get(OVERRIDES_CACHE_KEY)
+    if data is None:
+        data = {}
+        since = timezone.localdate() - timedelta(days=1)
+        rows = ShopHoliday.objects.filter(date__gte=since).values_list(
+            "shop_id", "date", "is_closed", "open_time", "close_time"
+        )
+        for shop_id, date, is_closed, open_time, close_time in rows:
+            data.setdefault(shop_id, {})[date] = (is_closed, open_time, close_time)
+        cache.set(OVERRIDES_CACHE_KEY, data, OVERRIDES_CACHE_TIMEOUT)
+    return data
+
+
+def business_hours(shop, date):
+    """その日に開店する営業時間 (開始, 終了) の aware datetime。休業日なら None"""
+    open_time, close_time = shop.open_time, shop.close_time
+    override = overrides().get(shop.id, {}).get(date)
+    if override:
+        is_closed, override_open, override_close = override
+        if is_closed:
+            return None
+        open_time = override_open or open_time
+        close_time = override_close or close_time
+
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(date, open_time), tz)
+    end = timezone.make_aware(datetime.combine(date, close_time), tz)
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+
+def is_open(shop, now=None):
+    """現在営業時間内か（前日開店の深夜営業も含めて判定する）"""
+    if not shop.is_active:
+        return False
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    for date in (today - timedelta(days=1), today):
+        hours = business_hours(shop, date)
+        if hours and hours[0] <= now < hours[1]:
+            return True
+    return False
+
+
+@receiver([post_save, post_delete], sender=ShopHoliday)
+def holiday_changed(sender, instance, **kwargs):
+    # コミット前に破棄すると、他のリクエストが変更前の内容を再びキャッシュする場合がある
+    transaction.on_commit(lambda: cache.delete(OVERRIDES_CACHE_KEY))
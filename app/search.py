@@ -0,0 +1,67 @@
+"""
+注文の検索（店頭での呼び出し・問い合わせ用）
+
+注文番号・受付番号、または顧客の名前・電話番号・LINE ID で検索する。
+PostgreSQL では pg_trgm の GIN インデックス（マイグレーション 0019 で作成）を使った部分一致、
+それ以外のデータベースでは小文字化した式インデックスを使った前方一致（範囲検索）にする。
+顧客を先に絞り込んでから注文を引くため、どちらもインデックスのみで検索できる。
+ショップアカウントの検索では、顧客の絞り込みの時点でそのショップに注文のある顧客に限定する
+（件数の上限を他のショップの顧客で使い切らないようにするため）。
+"""
+import unicodedata
+
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from app.models import Customer, Order
+
+# 検索に一致した顧客をこの件数までに制限する
+MAX_CUSTOMERS = 100
+# 前方一致の範囲検索の上限に使う文字
+PREFIX_END = "\U0010ffff"
+
+
+def normalize(query):
+    """全角・半角を揃えて小文字にする"""
+    return unicodedata.normalize("NFKC", query or "").strip().lower()
+
+
+def matching_customer_ids(query, shop_id=None):
+    """名前・電話番号・LINE ID が一致する顧客のID（shop_id を指定した場合はそのショップに注文のある顧客のみ）"""
+    if connection.vendor == "postgresql":
+        customers = Customer.objects.filter(
+            Q(name__icontains=query) | Q(phone_number__icontains=query) | Q(line_id__icontains=query)
+        )
+    else:
+        end = query + PREFIX_END
+        customers = Customer.objects.annotate(name_lower=Lower("name"), line_id_lower=Lower("line_id")).filter(
+            Q(name_lower__gte=query, name_lower__lt=end)
+            | Q(phone_number__gte=query, phone_number__lt=end)
+            | Q(line_id_lower__gte=query, line_id_lower__lt=end)
+        )
+    if shop_id is not None:
+        customers = customers.filter(Exists(Order.objects.filter(customer=OuterRef("pk"), shop_id=shop_id)))
+    return list(customers.order_by("id").values_list("id", flat=True)[:MAX_CUSTOMERS])
+
+
+def search_orders(queryset, query, shop_id=None):
+    """
+    注文を検索する（数字のみの場合は注文番号・本日の受付番号にも一致させる）。
+    queryset を1つのショップの注文に絞り込んでいる場合は shop_id も指定する
+    """
+    query = normalize(query)
+    if not query:
+        return queryset.none()
+
+    conditions = Q()
+    number = query.lstrip("#")
+    if number.isdigit():
+        conditions |= Q(id=int(number)) | Q(ticket_date=timezone.localdate(), ticket_number=int(number))
+    customer_ids = matching_customer_ids(query, shop_id)
+    if customer_ids:
+        conditions |= Q(customer_id__in=customer_ids)
+    if not conditions:
+        return queryset.none()
+    return queryset.filter(conditions)
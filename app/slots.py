@@ -0,0 +1,156 @@
+"""
+受け取り枠（ピックアップ時刻）の管理
+
+枠はショップのその日の営業時間（app.schedule）を slot_minutes ごとに区切ったもので、1枠あたり slot_capacity 件まで予約できる。
+予約数は PickupSlot に枠ごとのカウンタとして保持し、注文確定時に条件付き UPDATE で原子的に加算する。
+日ごとの予約数は {"HH:MM": 予約数} の形でキャッシュし、枠の選択画面では注文を数えずに表示する。
+注文確定時の受け取り時刻・営業時間の確認は reserve_pickup にまとめ、LINE・アプリの両方の注文確定から呼ぶ。
+"""
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.models import PickupSlot
+from app.schedule import ShopClosed, business_hours, is_open
+
+# 何日先までの枠を選べるか
+PICKUP_DAYS = 2
+# 今からこの分数以内に始まる枠は選べない（準備時間）
+PICKUP_LEAD_MINUTES = 10
+RESERVATIONS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class SlotUnavailable(Exception):
+    """指定された受け取り枠が存在しない・満席"""
+
+
+def slot_times(shop, date):
+    """その日の枠の開始時刻（aware datetime）のリスト。休業日は空"""
+    hours = business_hours(shop, date)
+    if hours is None:
+        return []
+    start, end = hours
+    step = timedelta(minutes=shop.slot_minutes)
+    if not step:
+        return []
+
+    times = []
+    while start + step <= end:
+        times.append(start)
+        start += step
+    return times
+
+
+def _cache_key(shop_id, date):
+    return f"pickup:reserved:{shop_id}:{date:%Y-%m-%d}"
+
+
+def reservations(shop, date):
+    """その日の枠ごとの予約数 {"HH:MM": 予約数}（キャッシュ）"""
+    key = _cache_key(shop.id, date)
+    reserved = cache.get(key)
+    if reserved is None:
+        times = slot_times(shop, date)
+        if not times:
+            return {}
+        rows = PickupSlot.objects.filter(
+            shop=shop, start__gte=times[0], start__lte=times[-1], reserved__gt=0
+        ).values_list("start", "reserved")
+        reserved = {timezone.localtime(start).strftime("%H:%M"): count for start, count in rows}
+        cache.set(key, reserved, RESERVATIONS_CACHE_TIMEOUT)
+    return reserved
+
+
+def availability(shop, days=PICKUP_DAYS, now=None):
+    """
+    選択可能な枠と空き状況を返す
+    戻り値: (開店日と枠の開始日時のリスト [(date, [datetime, ...])], {"YYYY-MM-DD": {"HH:MM": 残り枠数}})
+    深夜営業の日付をまたいだ枠も開店日にまとめるため、枠の開始日時（ローカル時刻）は開店日と日付が異なる場合がある
+    """
+    now = now or timezone.now()
+    earliest = now + timedelta(minutes=PICKUP_LEAD_MINUTES)
+    today = timezone.localdate(now)
+
+    dates = []
+    remaining = {}
+    for offset in range(days):
+        date = today + timedelta(days=offset)
+        times = [start for start in slot_times(shop, date) if start >= earliest]
+        if not times:
+            continue
+        reserved = reservations(shop, date)
+        slots = {}
+        for start in times:
+            label = timezone.localtime(start).strftime("%H:%M")
+            slots[label] = max(shop.slot_capacity - reserved.get(label, 0), 0)
+        dates.append((date, [timezone.localtime(start) for start in times]))
+        remaining[date.strftime("%Y-%m-%d")] = slots
+    return dates, remaining
+
+
+def parse_pickup_time(shop, value, now=None):
+    """フォームの値（YYYY-MM-DDTHH:MM）を枠の開始時刻に変換する。選択できない枠なら SlotUnavailable"""
+    try:
+        naive = datetime.strptime(value, "%Y-%m-%dT%H:%M")
+    except (TypeError, ValueError):
+        raise SlotUnavailable("受け取り時刻の指定が正しくありません")
+
+    start = timezone.make_aware(naive, timezone.get_current_timezone())
+    now = now or timezone.now()
+    if start < now + timedelta(minutes=PICKUP_LEAD_MINUTES):
+        raise SlotUnavailable("この受け取り時刻は選択できません")
+    # 前日開店の深夜営業分も含めて枠の開始時刻か確認する
+    for date in (naive.date() - timedelta(days=1), naive.date()):
+        if start in slot_times(shop, date):
+            return start
+    raise SlotUnavailable("この受け取り時刻は選択できません")
+
+
+def _invalidate(shop_id, start):
+    date = timezone.localtime(start).date()
+    # 深夜営業の枠は前日分としてキャッシュされている場合がある
+    transaction.on_commit(
+        lambda: cache.delete_many([_cache_key(shop_id, date), _cache_key(shop_id, date - timedelta(days=1))])
+    )
+
+
+def reserve_slot(shop, start):
+    """
+    枠を1件予約する（注文確定のトランザクション内で呼ぶ）。
+    満席の場合は SlotUnavailable
+    """
+    slot, created = PickupSlot.objects.get_or_create(shop=shop, start=start)
+    updated = PickupSlot.objects.filter(pk=slot.pk, reserved__lt=shop.slot_capacity).update(
+        reserved=F("reserved") + 1
+    )
+    if not updated:
+        raise SlotUnavailable("選択した受け取り時刻は満席です。別の時刻を選択してください")
+    _invalidate(shop.id, start)
+
+
+def reserve_pickup(shop, pickup_time=None):
+    """
+    注文確定時に受け取り時刻を確認する（注文作成のトランザクション内で呼ぶ）。
+    pickup_time（YYYY-MM-DDTHH:MM）を指定した場合は枠を予約して開始時刻を返し、選択できなければ SlotUnavailable。
+    指定がない場合は営業時間内なら None、営業時間外なら ShopClosed
+    """
+    if pickup_time:
+        start = parse_pickup_time(shop, pickup_time)
+        reserve_slot(shop, start)
+        return start
+    if not is_open(shop):
+        raise ShopClosed("営業時間外のため、受け取り時刻を選択してください")
+    return None
+
+
+def release_slot(order):
+    """キャンセルされた注文の枠を解放する"""
+    if not order.pickup_time:
+        return
+    PickupSlot.objects.filter(shop_id=order.shop_id, start=order.pickup_time, reserved__gt=0).update(
+        reserved=F("reserved") - 1
+    )
+    _invalidate(order.shop_id, order.pickup_time)
@@ -0,0 +1,48 @@
+"""
+ショップアカウントと担当ショップの対応
+
+管理画面のリクエストごとにショップを引かないよう、アカウントごとの担当ショップをキャッシュする。
+権限の判定に使うため、クライアント側（署名付きCookieのセッション）ではなくサーバー側のキャッシュに保存し、
+ショップの保存・削除（担当アカウントの変更を含む）のコミット後に、変更前後のアカウントの分を破棄する。
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app.models import Shop
+
+STAFF_SHOP_CACHE_TIMEOUT = 60 * 60
+
+
+def staff_shop_cache_key(user_id):
+    return f"staff:shop:{user_id}"
+
+
+def get_staff_shop(user):
+    """アカウントの担当ショップ {"shop_id", "name"}（キャッシュ）。ショップがなければ None"""
+    key = staff_shop_cache_key(user.pk)
+    staff_shop = cache.get(key)
+    if staff_shop is None:
+        shop = Shop.objects.filter(user=user).values("id", "name").first()
+        # ショップのないアカウントも空の辞書としてキャッシュする
+        staff_shop = {"shop_id": shop["id"], "name": shop["name"]} if shop else {}
+        cache.set(key, staff_shop, STAFF_SHOP_CACHE_TIMEOUT)
+    return staff_shop or None
+
+
+@receiver(pre_save, sender=Shop)
+def shop_saving(sender, instance, **kwargs):
+    # 担当アカウントが変わった場合に変更前のアカウントのキャッシュも破棄する
+    instance._previous_user_id = (
+        Shop.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first() if instance.pk else None
+    )
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    keys = {staff_shop_cache_key(instance.user_id)}
+    previous_user_id = getattr(instance, "_previous_user_id", None)
+    if previous_user_id:
+        keys.add(staff_shop_cache_key(previous_user_id))
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -1,3 +1,286 @@
+from datetime import time, timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import UserAccount
+from app.management.commands.purge_customers import ANONYMOUS_NAME, anonymize_customers
+from app.models import (
+    Cart,
+    CartItem,
+    Customer,
+    LineNotification,
+    Order,
+    PickupSlot,
+    Product,
+    Shop,
+    ShopHoliday,
+)
+
+
+def create_shop(name, email):
+    user = UserAccount.objects.create_user(email, "password", name=name)
+    return Shop.objects.create(user=user, name=name)
+
+
+class ShopStaffScopeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop("ショップA", "a@example.com")
+        self.other = create_shop("ショップB", "b@example.com")
+        customer = Customer.objects.create(name="顧客", line_id="Ustaff")
+        self.order = Order.objects.create(customer=customer, shop=self.shop, total_amount=500)
+        self.other_order = Order.objects.create(customer=customer, shop=self.other, total_amount=500)
+        self.other_product = Product.objects.create(shop=self.other, name="紅茶", price=400)
+        self.client.force_login(self.shop.user)
+
+    def test_other_shop_pages_return_404(self):
+        for url in [
+            reverse("app:order_detail", args=[self.other_order.id]),
+            reverse("app:product_manage", args=[self.other.id]),
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+        for url in [
+            reverse("app:product_edit", args=[self.other_product.id]),
+            reverse("app:shop_edit", args=[self.other.id]),
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.assertEqual(self.client.post(url, {"name": "変更"}).status_code, 404)
+
+        self.other_product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.other_product.name, self.other.name), ("紅茶", "ショップB"))
+
+    def test_order_board_status_change_is_scoped(self):
+        response = self.client.post(
+            reverse("app:order_manage"), {"order_id": self.other_order.id, "status": "cancelled"}
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.other_order.refresh_from_db()
+        self.assertEqual(self.other_order.status, "pending")
+
+    def test_order_board_lists_own_orders_only(self):
+        response = self.client.get(reverse("app:order_manage"))
+
+        self.assertEqual([order.id for order in response.context["orders"]], [self.order.id])
+        self.assertContains(response, '<span class="font-bold">ショップA</span>', html=True)
+
+    def test_order_board_is_paginated(self):
+        customer = self.order.customer
+        Order.objects.bulk_create(
+            [Order(customer=customer, shop=self.shop, total_amount=100) for _ in range(55)]
+        )
+
+        first = self.client.get(reverse("app:order_manage"))
+        second = self.client.get(reverse("app:order_manage"), {"page": 2})
+
+        self.assertEqual(len(first.context["orders"]), 50)
+        self.assertEqual(len(second.context["orders"]), 6)
+
+    def test_reassigned_shop_revokes_access(self):
+        self.assertEqual(self.client.get(reverse("app:order_detail", args=[self.order.id])).status_code, 200)
+
+        new_owner = UserAccount.objects.create_user("new@example.com", "password", name="新担当")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.user = new_owner
+            self.shop.save()
+
+        response = self.client.get(reverse("app:order_detail", args=[self.order.id]))
+        self.assertRedirects(response, reverse("app:index"), fetch_redirect_response=False)
+
+    def test_search_is_not_crowded_out_by_other_shops_customers(self):
+        others = Customer.objects.bulk_create(
+            [Customer(name=f"田中{i:03d}", line_id=f"Utanaka{i:03d}") for i in range(120)]
+        )
+        Order.objects.bulk_create([Order(customer=c, shop=self.other, total_amount=100) for c in others])
+        customer = Customer.objects.create(name="田中太郎", line_id="Utanaka-own")
+        order = Order.objects.create(customer=customer, shop=self.shop, total_amount=100)
+
+        response = self.client.get(reverse("app:order_manage"), {"q": "田中"})
+
+        self.assertEqual([o.id for o in response.context["orders"]], [order.id])
+
+
+class AppCheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop("ショップA", "a@example.com")
+        # 24時間営業
+        self.shop.open_time = self.shop.close_time = time(0)
+        self.shop.save()
+        self.customer = Customer.objects.create(name="顧客", line_id="Ucheckout")
+        product = Product.objects.create(shop=self.shop, name="コーヒー", price=400)
+        cart = Cart.objects.create(customer=self.customer, shop=self.shop)
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+        self.url = reverse("app:order_confirm") + "?line_id=Ucheckout"
+
+    def close_shop(self):
+        # 前日開店の深夜営業分も含めて休業にする
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            for date in (today - timedelta(days=1), today):
+                ShopHoliday.objects.create(shop=self.shop, date=date, is_closed=True)
+
+    def test_closed_shop_rejects_order_without_pickup_time(self):
+        self.close_shop()
+        self.assertContains(self.client.get(self.url), "受け取り時刻を選択してください（営業時間外）")
+
+        response = self.client.post(self.url, {"note": ""})
+
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.customer.cart.items.count(), 1)
+
+    def test_pickup_time_reserves_slot(self):
+        start = timezone.localtime() + timedelta(days=1)
+        start = start.replace(hour=12, minute=0, second=0, microsecond=0)
+
+        response = self.client.post(self.url, {"pickup_time": start.strftime("%Y-%m-%dT%H:%M")})
+
+        order = Order.objects.get()
+        self.assertRedirects(
+            response, reverse("app:order_complete", args=[order.id]) + "?line_id=Ucheckout",
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(order.pickup_time, start)
+        self.assertEqual(PickupSlot.objects.get(shop=self.shop, start=start).reserved, 1)
+
+
+class PurgeCustomersTests(TestCase):
+    def setUp(self):
+        self.shop = create_shop("ショップA", "a@example.com")
+        product = Product.objects.create(shop=self.shop, name="コーヒー", price=400)
+        now = timezone.now()
+        self.expired = self.customer("Uexpired", unfollowed_at=now - timedelta(days=40))
+        self.recent = self.customer("Urecent", unfollowed_at=now - timedelta(days=5))
+        self.active = self.customer("Uactive")
+        for customer in (self.expired, self.recent, self.active):
+            order = Order.objects.create(customer=customer, shop=self.shop, total_amount=400, note="氷少なめ")
+            LineNotification.objects.create(order=order, kind="order_confirmed", line_id=customer.line_id, text="注文")
+            LineNotification.objects.create(
+                order=order, kind="order_cancelled", line_id=customer.line_id, text="キャンセル", status="sent"
+            )
+            cart = Cart.objects.create(customer=customer, shop=self.shop)
+            CartItem.objects.create(cart=cart, product=product)
+
+    def customer(self, line_id, unfollowed_at=None):
+        return Customer.objects.create(
+            name=line_id,
+            phone_number="09012345678",
+            line_id=line_id,
+            is_active=unfollowed_at is None,
+            unfollowed_at=unfollowed_at,
+        )
+
+    def test_customers_past_retention_are_anonymized(self):
+        call_command("purge_customers", days=30, stdout=StringIO())
+
+        self.expired.refresh_from_db()
+        self.assertEqual(
+            (self.expired.name, self.expired.phone_number, self.expired.line_id, self.expired.unfollowed_at),
+            (ANONYMOUS_NAME, None, f"deleted-{self.expired.id}", None),
+        )
+        order = self.expired.orders.get()
+        self.assertIsNone(order.note)
+        self.assertFalse(order.notifications.exists())
+        self.assertFalse(Cart.objects.filter(customer=self.expired).exists())
+
+        for customer in (self.recent, self.active):
+            with self.subTest(line_id=customer.line_id):
+                customer.refresh_from_db()
+                self.assertEqual(customer.name, customer.line_id)
+                self.assertEqual(customer.orders.get().notifications.count(), 2)
+                self.assertTrue(Cart.objects.filter(customer=customer).exists())
+
+    def test_customer_who_followed_again_is_skipped(self):
+        cutoff = timezone.now() - timedelta(days=30)
+        # 対象として選択した後に友達追加し直した
+        Customer.objects.filter(id=self.expired.id).update(is_active=True, unfollowed_at=None)
+
+        self.assertEqual(anonymize_customers([self.expired.id], cutoff), 0)
+
+        self.expired.refresh_from_db()
+        self.assertEqual((self.expired.name, self.expired.line_id), ("Uexpired", "Uexpired"))
+        self.assertEqual(self.expired.orders.get().note, "氷少なめ")
+        self.assertTrue(Cart.objects.filter(customer=self.expired).exists())
+
+
+class PurgeCartsTests(TestCase):
+    def setUp(self):
+        self.shop = create_shop("ショップA", "a@example.com")
+        self.product = Product.objects.create(shop=self.shop, name="コーヒー", price=400)
+        self.expired = timezone.now() - timedelta(days=settings.CART_EXPIRE_DAYS + 1)
+
+    def cart(self, line_id, updated_at, item_created_at=None):
+        customer = Customer.objects.create(name=line_id, line_id=line_id)
+        cart = Cart.objects.create(customer=customer, shop=self.shop)
+        item = CartItem.objects.create(cart=cart, product=self.product)
+        # auto_now / auto_now_add を避けるため update で日時を設定する
+        CartItem.objects.filter(pk=item.pk).update(created_at=item_created_at or updated_at)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=updated_at)
+        return cart
+
+    def test_only_carts_untouched_for_expire_days_are_deleted(self):
+        stale = self.cart("Ustale", self.expired)
+        recent = self.cart("Urecent", timezone.now() - timedelta(days=1))
+        new_item = self.cart("Unewitem", self.expired, item_created_at=timezone.now())
+
+        call_command("purge_carts", stdout=StringIO())
+
+        self.assertEqual(set(Cart.objects.values_list("id", flat=True)), {recent.id, new_item.id})
+        self.assertFalse(CartItem.objects.filter(cart_id=stale.id).exists())
+
+    def test_cart_item_save_and_delete_touch_cart(self):
+        cart = self.cart("Utouch", self.expired)
+        item = cart.items.get()
+
+        item.quantity = 3
+        item.save()
+        cart.refresh_from_db()
+        self.assertGreater(cart.updated_at, self.expired)
+
+        Cart.objects.filter(pk=cart.pk).update(updated_at=self.expired)
+        item.delete()
+        cart.refresh_from_db()
+        self.assertGreater(cart.updated_at, self.expired)
+
+
+class OrderAdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop("ショップA", "a@example.com")
+        customer = Customer.objects.create(name="顧客", line_id="Uadmin")
+        self.start = (timezone.localtime() + timedelta(days=1)).replace(hour=12, minute=0, second=0, microsecond=0)
+        PickupSlot.objects.create(shop=self.shop, start=self.start, reserved=1)
+        self.order = Order.objects.create(
+            customer=customer, shop=self.shop, total_amount=400, pickup_time=self.start
+        )
+        admin_user = UserAccount.objects.create_superuser("admin@example.com", "password", name="管理者")
+        self.client.force_login(admin_user)
+
+    def test_cancelling_in_admin_releases_pickup_slot(self):
+        url = reverse("admin:app_order_change", args=[self.order.id])
+        local = timezone.localtime(self.start)
+        response = self.client.post(url, {
+            "customer": self.order.customer_id,
+            "shop": self.shop.id,
+            "status": "cancelled",
+            "total_amount": 400,
+            "note": "",
+            "pickup_time_0": local.strftime("%Y-%m-%d"),
+            "pickup_time_1": local.strftime("%H:%M:%S"),
+        })
 
-# Create your tests here.
+        self.assertRedirects(response, reverse("admin:app_order_changelist"), fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "cancelled")
+        self.assertEqual(PickupSlot.objects.get(shop=self.shop, start=self.start).reserved, 0)
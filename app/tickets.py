@@ -0,0 +1,44 @@
+"""
+ショップ・日付ごとの受付番号の採番
+
+受付番号は ShopDailyCounter の行をショップ・日付ごとに1つ持ち、1文の UPSERT（INSERT ... ON CONFLICT DO UPDATE
+... RETURNING）で加算と取得を同時に行う。注文作成のトランザクションの外（自動コミット）で実行するため、
+同じショップで同時に注文が確定しても、カウンタ行のロックを待つのはこの1文の間だけになる。
+注文作成が失敗した場合は番号が欠番になるが、重複はしない。
+
+RETURNING をサポートしないデータベースでは、F() による加算と取得の2文で採番する。
+"""
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.models import Order, ShopDailyCounter
+
+UPSERT_SQL = """
+INSERT INTO {table} (shop_id, date, last_number) VALUES (%s, %s, 1)
+ON CONFLICT (shop_id, date) DO UPDATE SET last_number = {table}.last_number + 1
+RETURNING last_number
+"""
+
+
+def next_ticket_number(shop_id, date=None):
+    """受付番号を1つ採番する"""
+    date = date or timezone.localdate()
+    if connection.vendor in ("postgresql", "sqlite"):
+        table = connection.ops.quote_name(ShopDailyCounter._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT_SQL.format(table=table), [shop_id, connection.ops.adapt_datefield_value(date)])
+            return cursor.fetchone()[0]
+
+    with transaction.atomic():
+        ShopDailyCounter.objects.get_or_create(shop_id=shop_id, date=date)
+        counter = ShopDailyCounter.objects.filter(shop_id=shop_id, date=date)
+        counter.update(last_number=F("last_number") + 1)
+        return counter.values_list("last_number", flat=True).get()
+
+
+def assign_ticket(order):
+    """作成済みの注文に受付番号を付ける（注文作成のトランザクションの後で呼ぶ）"""
+    order.ticket_date = timezone.localdate(order.created_at)
+    order.ticket_number = next_ticket_number(order.shop_id, order.ticket_date)
+    Order.objects.filter(pk=order.pk).update(ticket_date=order.ticket_date, ticket_number=order.ticket_number)
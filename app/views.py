@@ -1,11 +1,19 @@
+from django.core.paginator import Paginator
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.http import JsonResponse
 from django.utils import timezone
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, Q, Sum
 from .models import Shop, Product, Cart, CartItem, Order, OrderItem, Customer
+from .order_queue import enqueue_order, status_changed
+from .schedule import ShopClosed, is_open
+from .search import search_orders
+from .slots import SlotUnavailable, availability, release_slot, reserve_pickup
+from .staff import get_staff_shop
+from .tickets import assign_ticket
 from .forms import ShopRegisterForm, ProductRegisterForm, CartItemForm, OrderForm
 from django.urls import reverse
 
@@ -52,7 +60,8 @@ class LineUserRequiredMixin:
 # ショップ一覧（顧客向け）
 class IndexView(LineUserRequiredMixin, View):
     def get(self, request):
-        shops = Shop.objects.filter(is_active=True).order_by("name")
+        # 営業時間外のショップは表示しない（is_open は update_shop_hours で更新）
+        shops = Shop.objects.filter(is_active=True, is_open=True).order_by("name")
         return render(request, "app/index.html", {"shops": shops})
 
 
@@ -69,8 +78,8 @@ class ShopDetailView(LineUserRequiredMixin, View):
                 products_by_category[product.category] = []
             products_by_category[product.category].append(product)
         
-        # カート情報も取得
-        cart, created = Cart.objects.get_or_create(customer=request.customer)
+        # カート情報も取得（表示のみなのでカートが無ければ作成しない）
+        cart = Cart.objects.filter(customer=request.customer).first()
         
         return render(
             request,
@@ -91,6 +100,36 @@ def check_superuser(request):
     return None
 
 
+# 管理者またはショップアカウントのみアクセス可能にするミックスイン
+# ショップアカウントは自分のショップのデータのみ扱える（request.staff_shop_id、管理者は None）
+class ShopStaffRequiredMixin(LoginRequiredMixin):
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+
+        request.staff_shop = None
+        request.staff_shop_id = None
+        if not request.user.is_superuser:
+            request.staff_shop = get_staff_shop(request.user)
+            if request.staff_shop is None:
+                messages.error(request, "管理者またはショップのアカウントでログインしてください")
+                return redirect("app:index")
+            request.staff_shop_id = request.staff_shop["shop_id"]
+        return super().dispatch(request, *args, **kwargs)
+
+    def for_staff(self, queryset, field="shop_id"):
+        """ショップアカウントの場合は自分のショップのデータに絞り込む"""
+        if self.request.staff_shop_id is None:
+            return queryset
+        return queryset.filter(**{field: self.request.staff_shop_id})
+
+    def get_product_form(self, *args, **kwargs):
+        """商品フォーム（選択できるショップを絞り込む）"""
+        form = ProductRegisterForm(*args, **kwargs)
+        form.fields["shop"].queryset = self.for_staff(Shop.objects.all(), "id")
+        return form
+
+
 # ショップ登録（管理者用）
 class ShopRegisterView(LoginRequiredMixin, View):
     def get(self, request):
@@ -116,18 +155,15 @@ class ShopRegisterView(LoginRequiredMixin, View):
 
 
 # 商品登録（管理者用）
-class ProductRegisterView(LoginRequiredMixin, View):
+class ProductRegisterView(ShopStaffRequiredMixin, View):
     def get(self, request):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        shop_id = request.GET.get("shop_id")
-        form = ProductRegisterForm()
+        shop_id = request.GET.get("shop_id") or request.staff_shop_id
+        form = self.get_product_form()
         
         if shop_id:
             # 特定のショップが選択された状態でフォームを表示
             try:
-                shop = Shop.objects.get(id=shop_id)
+                shop = self.for_staff(Shop.objects, "id").get(id=shop_id)
                 form.initial = {'shop': shop}
                 context = {"form": form, "selected_shop": shop}
             except Shop.DoesNotExist:
@@ -138,10 +174,7 @@ class ProductRegisterView(LoginRequiredMixin, View):
         return render(request, "app/product_register.html", context)
 
     def post(self, request):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        form = ProductRegisterForm(request.POST, request.FILES)
+        form = self.get_product_form(request.POST, request.FILES)
         if form.is_valid():
             product = form.save()
             messages.success(request, "商品を登録しました")
@@ -151,22 +184,16 @@ class ProductRegisterView(LoginRequiredMixin, View):
 
 
 # ショップ管理（管理者用）
-class ShopManageView(LoginRequiredMixin, View):
+class ShopManageView(ShopStaffRequiredMixin, View):
     def get(self, request):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        shops = Shop.objects.all().order_by("-created_at")
+        shops = self.for_staff(Shop.objects.all(), "id").order_by("-created_at")
         return render(request, "app/shop_manage.html", {"shops": shops})
 
 
 # 商品管理（管理者用）
-class ProductManageView(LoginRequiredMixin, View):
+class ProductManageView(ShopStaffRequiredMixin, View):
     def get(self, request, shop_id):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        shop = get_object_or_404(Shop, id=shop_id)
+        shop = get_object_or_404(self.for_staff(Shop.objects, "id"), id=shop_id)
         products = Product.objects.filter(shop=shop).order_by('category', 'name')
         
         context = {
@@ -177,51 +204,67 @@ class ProductManageView(LoginRequiredMixin, View):
 
 
 # 注文管理（管理者用）
-class OrderManageView(LoginRequiredMixin, View):
+class OrderManageView(ShopStaffRequiredMixin, View):
+    # 1ページに表示する注文数
+    paginate_by = 50
+
     def get(self, request):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        orders = Order.objects.all().order_by("-created_at")
-        return render(request, "app/order_manage.html", {"orders": orders})
+        orders = (
+            self.for_staff(Order.objects.all())
+            .select_related("customer", "shop")
+            .prefetch_related("items")
+            .order_by("-created_at")
+        )
+        query = request.GET.get("q", "").strip()
+        if query:
+            orders = search_orders(orders, query, shop_id=request.staff_shop_id)
+        # 本日の注文数・売上（キャンセルを除く）
+        today_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        today = (
+            self.for_staff(Order.objects.filter(created_at__gte=today_start))
+            .exclude(status="cancelled")
+            .aggregate(order_count=Count("id"), sales=Sum("total_amount"))
+        )
+        page = Paginator(orders, self.paginate_by).get_page(request.GET.get("page"))
+        return render(
+            request,
+            "app/order_manage.html",
+            {"orders": page.object_list, "page_obj": page, "today": today, "query": query},
+        )
 
     def post(self, request):
-        if check_superuser(request):
-            return redirect("app:index")
-        
         order_id = request.POST.get("order_id")
         new_status = request.POST.get("status")
         
         if order_id and new_status:
-            order = get_object_or_404(Order, id=order_id)
+            order = get_object_or_404(self.for_staff(Order.objects), id=order_id)
+            old_status = order.status
             order.status = new_status
             order.save()
+            if new_status == "cancelled" and old_status != "cancelled":
+                release_slot(order)
+            status_changed(order, old_status)
             messages.success(request, f"注文ステータスを{order.get_status_display()}に更新しました")
         
         return redirect("app:order_manage")
 
 
 # 注文詳細（管理者用）
-class OrderDetailView(LoginRequiredMixin, View):
+class OrderDetailView(ShopStaffRequiredMixin, View):
     def get(self, request, order_id):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        order = get_object_or_404(Order, id=order_id)
+        # 商品名などは注文時のスナップショットを表示し、商品は画像の表示にのみ使う（削除済みなら None）
+        orders = Order.objects.select_related("customer", "shop").prefetch_related("items__product")
+        order = get_object_or_404(self.for_staff(orders), id=order_id)
         return render(request, "app/order_detail.html", {"order": order})
 
 
 # カート表示（顧客向け）
 class CartView(LineUserRequiredMixin, View):
     def get(self, request):
-        cart, created = Cart.objects.get_or_create(customer=request.customer)
-        
-        # カートに商品がある場合は、その商品のショップIDを取得
-        shop_id = None
-        if cart.items.exists():
-            shop_id = cart.items.first().product.shop.id
+        # 表示のみなのでカートが無ければ作成しない
+        cart = Cart.objects.filter(customer=request.customer).first()
         
-        return render(request, "app/cart.html", {"cart": cart, "shop_id": shop_id})
+        return render(request, "app/cart.html", {"cart": cart, "shop_id": cart.shop_id if cart else None})
 
     def post(self, request):
         action = request.POST.get("action")
@@ -234,6 +277,12 @@ class CartView(LineUserRequiredMixin, View):
                 product = Product.objects.get(id=product_id, is_available=True)
                 cart, created = Cart.objects.get_or_create(customer=request.customer)
                 
+                # カートには1つのショップの商品のみ入れられる
+                if not cart.assign_shop(product.shop_id):
+                    messages.error(request, "別のショップの商品がカートに入っています。注文を確定するかカートを空にしてから追加してください")
+                    line_id = request.GET.get('line_id')
+                    return redirect(build_url_with_line_id('app:cart', line_id))
+                
                 # 既存のカートアイテムを確認
                 cart_item, created = CartItem.objects.get_or_create(
                     cart=cart, product=product, defaults={"quantity": quantity}
@@ -294,13 +343,26 @@ class CartView(LineUserRequiredMixin, View):
 class OrderConfirmView(LineUserRequiredMixin, View):
     def get(self, request):
         try:
-            cart = Cart.objects.get(customer=request.customer)
-            if not cart.items.exists():
+            cart = Cart.objects.select_related("shop").get(customer=request.customer)
+            first_item = cart.items.select_related("product__shop").first()
+            if first_item is None:
                 messages.error(request, "カートが空です")
                 line_id = request.GET.get('line_id')
                 return redirect(build_url_with_line_id('app:cart', line_id))
             
-            return render(request, "app/order_confirm.html", {"cart": cart})
+            # 受け取り枠の空き状況（キャッシュ）
+            shop = cart.shop or first_item.product.shop
+            pickup_dates, pickup_availability = availability(shop)
+            return render(
+                request,
+                "app/order_confirm.html",
+                {
+                    "cart": cart,
+                    "pickup_dates": pickup_dates,
+                    "pickup_availability": pickup_availability,
+                    "open_now": is_open(shop),
+                },
+            )
         except Cart.DoesNotExist:
             messages.error(request, "カートが見つかりません")
             line_id = request.GET.get('line_id')
@@ -308,31 +370,38 @@ class OrderConfirmView(LineUserRequiredMixin, View):
 
     def post(self, request):
         try:
-            cart = Cart.objects.get(customer=request.customer)
-            if not cart.items.exists():
+            cart = Cart.objects.select_related("shop").get(customer=request.customer)
+            cart_items = list(cart.items.select_related("product__shop"))
+            if not cart_items:
                 messages.error(request, "カートが空です")
                 line_id = request.GET.get('line_id')
                 return redirect(build_url_with_line_id('app:cart', line_id))
             
-            # 注文を作成
-            order = Order.objects.create(
-                customer=request.customer,
-                shop=cart.items.first().product.shop,
-                total_amount=cart.total_price,
-                note=request.POST.get("note", ""),
-            )
-            
-            # 注文アイテムを作成
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price,
+            with transaction.atomic():
+                # 営業時間の確認・受け取り枠の予約（LINEの注文確定と共通）
+                shop = cart.shop or cart_items[0].product.shop
+                pickup_start = reserve_pickup(shop, request.POST.get("pickup_time"))
+
+                # 注文を作成
+                order = Order.objects.create(
+                    customer=request.customer,
+                    shop=shop,
+                    total_amount=sum(item.subtotal for item in cart_items),
+                    note=request.POST.get("note", ""),
+                    pickup_time=pickup_start,
                 )
-            
-            # カートをクリア
-            cart.items.all().delete()
+
+                # 注文アイテムを作成
+                OrderItem.objects.bulk_create(
+                    [OrderItem.for_product(cart_item.product, cart_item.quantity, order=order) for cart_item in cart_items]
+                )
+
+                # カートをクリア
+                cart.items.all().delete()
+
+                # 待ち件数の行ロックはコミット直前に取る
+                enqueue_order(order)
+            assign_ticket(order)
             
             messages.success(request, "注文が完了しました")
             line_id = request.GET.get('line_id')
@@ -342,6 +411,10 @@ class OrderConfirmView(LineUserRequiredMixin, View):
             messages.error(request, "カートが見つかりません")
             line_id = request.GET.get('line_id')
             return redirect(build_url_with_line_id('app:index', line_id))
+        except (SlotUnavailable, ShopClosed) as e:
+            messages.error(request, str(e))
+            line_id = request.GET.get('line_id')
+            return redirect(build_url_with_line_id('app:order_confirm', line_id))
 
 
 # 注文完了（顧客向け）
@@ -368,8 +441,11 @@ class OrderCancelView(LineUserRequiredMixin, View):
         try:
             order = Order.objects.get(id=order_id, customer=request.customer)
             if order.status in ["pending", "preparing"]:
+                old_status = order.status
                 order.status = "cancelled"
                 order.save()
+                release_slot(order)
+                status_changed(order, old_status)
                 messages.success(request, "注文をキャンセルしました")
             else:
                 messages.error(request, "この注文はキャンセルできません")
@@ -380,20 +456,14 @@ class OrderCancelView(LineUserRequiredMixin, View):
 
 
 # ショップ編集（管理者用）
-class ShopEditView(LoginRequiredMixin, View):
+class ShopEditView(ShopStaffRequiredMixin, View):
     def get(self, request, shop_id):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        shop = get_object_or_404(Shop, id=shop_id)
+        shop = get_object_or_404(self.for_staff(Shop.objects, "id"), id=shop_id)
         form = ShopRegisterForm(instance=shop)
         return render(request, "app/shop_edit.html", {"form": form, "shop": shop})
 
     def post(self, request, shop_id):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        shop = get_object_or_404(Shop, id=shop_id)
+        shop = get_object_or_404(self.for_staff(Shop.objects, "id"), id=shop_id)
         form = ShopRegisterForm(request.POST, request.FILES, instance=shop)
         if form.is_valid():
             form.save()
@@ -404,21 +474,15 @@ class ShopEditView(LoginRequiredMixin, View):
 
 
 # 商品編集（管理者用）
-class ProductEditView(LoginRequiredMixin, View):
+class ProductEditView(ShopStaffRequiredMixin, View):
     def get(self, request, product_id):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        product = get_object_or_404(Product, id=product_id)
-        form = ProductRegisterForm(instance=product)
+        product = get_object_or_404(self.for_staff(Product.objects), id=product_id)
+        form = self.get_product_form(instance=product)
         return render(request, "app/product_edit.html", {"form": form, "product": product})
 
     def post(self, request, product_id):
-        if check_superuser(request):
-            return redirect("app:index")
-        
-        product = get_object_or_404(Product, id=product_id)
-        form = ProductRegisterForm(request.POST, request.FILES, instance=product)
+        product = get_object_or_404(self.for_staff(Product.objects), id=product_id)
+        form = self.get_product_form(request.POST, request.FILES, instance=product)
         if form.is_valid():
             form.save()
             messages.success(request, "商品情報を更新しました")
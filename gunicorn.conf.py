@@ -0,0 +1,90 @@
+"""
+本番用 gunicorn 設定
+
+gunicorn は起動ディレクトリの gunicorn.conf.py を自動で読み込む。
+環境変数で調整できる項目:
+
+- PORT: 待ち受けポート（既定 8080）
+- GUNICORN_WORKER_CLASS: "gthread"（既定, WSGI）または "uvicorn"（ASGI + 非同期ビュー）
+- WEB_CONCURRENCY: ワーカー数（既定は CPU数 × 2 + 1、GUNICORN_MAX_WORKERS で上限。共有キャッシュがなければ 1）
+- GUNICORN_THREADS: gthread ワーカーあたりのスレッド数（既定 4、1ワーカーの場合は 8）
+
+複数ワーカーで起動するには CACHE_URL に共有キャッシュ（redis:// など）の指定が必要。
+注文の要約・営業時間・担当ショップなどのキャッシュは保存時に破棄するが、プロセス内メモリのキャッシュでは
+破棄が他のワーカーに伝わらず、古い内容を返し続けるため。
+CACHE_URL が未指定（プロセス内メモリ）の場合は既定で1ワーカー（スレッド数を増やす）で起動し、
+それでも WEB_CONCURRENCY で複数ワーカーを指定した場合は起動を止める。
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# プロセス内にしか保持されないキャッシュ（CACHE_URL のスキーム / Django のバックエンド）
+LOCAL_CACHE_SCHEMES = ("locmemcache", "dummycache")
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+shared_cache = os.environ.get("CACHE_URL", "locmemcache://").split("://")[0] not in LOCAL_CACHE_SCHEMES
+
+workers = int(
+    os.environ.get(
+        "WEB_CONCURRENCY",
+        min(multiprocessing.cpu_count() * 2 + 1, int(os.environ.get("GUNICORN_MAX_WORKERS", 4)))
+        if shared_cache
+        else 1,
+    )
+)
+
+# ワーカー
+if os.environ.get("GUNICORN_WORKER_CLASS", "gthread") == "uvicorn":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "order_app.asgi:application"
+    # ASGIで起動する場合はLINE向けビューも非同期版にする
+    os.environ.setdefault("LINE_ASYNC_VIEWS", "True")
+else:
+    worker_class = "gthread"
+    wsgi_app = "order_app.wsgi:application"
+    # 1ワーカーの場合はスレッドで同時接続を受ける
+    threads = int(os.environ.get("GUNICORN_THREADS", 4 if workers > 1 else 8))
+
+# マスターでアプリを読み込んでからforkし、import済みのコードをワーカー間で共有する
+preload_app = True
+
+# メモリリーク対策で一定数のリクエストごとにワーカーを入れ替える（一斉再起動を避けるためジッターを入れる）
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+keepalive = 5
+timeout = 120
+graceful_timeout = 30
+
+# ハートビートファイルをメモリ上に置き、コンテナのディスクI/Oでワーカーが止まらないようにする
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+accesslog = "-"
+errorlog = "-"
+
+
+
+def on_starting(server):
+    if server.cfg.workers <= 1:
+        return
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "order_app.settings")
+    from django.conf import settings
+
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend in LOCAL_CACHE_BACKENDS:
+        raise RuntimeError(
+            f"ワーカー数が{server.cfg.workers}のため、CACHE_URL に共有キャッシュ（redis:// など）を指定してください"
+            f"（現在: {backend}）。1ワーカーで起動する場合は WEB_CONCURRENCY を指定しないか 1 にしてください"
+        )
+
+
+def post_fork(server, worker):
+    # preload時にマスターで開いたDB接続をワーカーに引き継がない
+    from django.db import connections
+
+    connections.close_all()
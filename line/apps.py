@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'line'
+
+    def ready(self):
+        # 注文要約キャッシュの破棄用シグナルを登録
+        from . import commands  # noqa: F401
@@ -0,0 +1,451 @@
+"""
+LINE向けビューの非同期版（ASGI用）
+
+ORMは非同期API（aget / acreate / async for など）を使い、LINE Messaging APIへの送信は
+aiohttp で行うため、LINE APIやDBの待ち時間中もワーカーを占有しない。
+トランザクションを伴う処理（注文確定・キャンセル）は line.views の共通関数を
+sync_to_async で呼び出し、同期版と同じ処理を通す。
+Webhookのイベント処理はLINE SDKの同期呼び出し（プロフィール取得・返信）を含むため、
+ORMと描画に使う共有の同期スレッドではなく、スレッドプールで実行する。
+
+settings.LINE_ASYNC_VIEWS が有効な場合に line/urls.py から使用される。
+"""
+import asyncio
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.http.response import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseServerError,
+)
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
+
+from app.models import Cart, CartItem, Customer, Order, Product, Shop
+from app.schedule import ShopClosed, is_open
+from app.slots import SlotUnavailable, availability
+from line.views import (
+    EMPTY_CART_TOTALS,
+    SHOP_MISMATCH_MESSAGE,
+    add_items_response,
+    annotate_open,
+    build_url_with_line_id,
+    cancel_order,
+    cart_item_response,
+    create_cancel_message,
+    create_order_message,
+    create_reorder_messages,
+    handler,
+    order_eta,
+    parse_cart_items,
+    place_order,
+    reorder,
+)
+from line.notifications import PUSH_TIMEOUT, create_notification, push_request, record_result
+from order_app.metrics import track_line_api
+
+# テンプレート内で遅延評価されるクエリがあるため、描画は同期スレッドで行う
+arender = sync_to_async(render)
+
+# LINE APIのタイムアウト（秒）
+LINE_API_TIMEOUT = 10
+
+# (イベントループ, セッション)
+_http_session = (None, None)
+
+
+def get_http_session():
+    """イベントループごとに共有するHTTPセッション"""
+    global _http_session
+    loop = asyncio.get_running_loop()
+    session_loop, session = _http_session
+    if session is None or session.closed or session_loop is not loop:
+        session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=LINE_API_TIMEOUT)
+        )
+        _http_session = (loop, session)
+    return session
+
+
+async def adeliver(notification, timeout=PUSH_TIMEOUT):
+    """通知を送信する（非同期版）。戻り値: 送信済みか"""
+    if notification.status != "pending":
+        return notification.status == "sent"
+
+    url, headers, body = push_request(notification)
+    try:
+        with track_line_api():
+            async with get_http_session().post(
+                url, headers=headers, data=body, timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                text = await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return await sync_to_async(record_result)(notification, error=str(e))
+    return await sync_to_async(record_result)(notification, response.status, text)
+
+
+async def anotify(order, kind, line_id, text):
+    """通知を作成して送信する（非同期版）"""
+    notification = await sync_to_async(create_notification)(order, kind, line_id, text)
+    return await adeliver(notification)
+
+
+# LINEユーザーのみアクセス可能にするミックスイン（非同期版）
+class AsyncLineLoginRequiredMixin:
+    async def dispatch(self, request, *args, **kwargs):
+        line_id = request.GET.get("line_id") or await request.session.aget("line_id")
+
+        if not line_id:
+            return redirect("line:line_required")
+
+        customer, _ = await Customer.objects.aget_or_create(line_id=line_id)
+        if await request.session.aget("line_id") != line_id:
+            await request.session.aset("line_id", line_id)
+        request.customer = customer
+        request.line_id = line_id
+
+        return await super().dispatch(request, *args, **kwargs)
+
+
+# LINEアプリのメインページ
+class IndexView(View):
+    async def get(self, request):
+        shops = [shop async for shop in Shop.objects.filter(is_active=True).order_by("name")]
+        await sync_to_async(annotate_open)(shops)
+        return await arender(
+            request,
+            "line/index.html",
+            {
+                "shops": shops,
+                "line_id": request.GET.get("line_id"),
+                "liff_id": "2007902301-b7xL87yd",
+            },
+        )
+
+
+# 商品一覧（LINE用）
+class ProductView(AsyncLineLoginRequiredMixin, View):
+    async def get(self, request, shop_id):
+        shop = await aget_object_or_404(Shop, id=shop_id)
+        products = [
+            product
+            async for product in shop.products.filter(is_available=True).order_by("category", "name")
+        ]
+        cart = await Cart.objects.filter(customer=request.customer).afirst()
+
+        # セッションに最後にアクセスしたショップIDを保存
+        if await request.session.aget("last_shop_id") != shop_id:
+            await request.session.aset("last_shop_id", shop_id)
+
+        return await arender(
+            request,
+            "line/product.html",
+            {
+                "shop": shop,
+                "products": products,
+                "line_id": request.line_id,
+                "cart": cart,
+                "liff_id": "2007902301-b7xL87yd",
+                "open_now": await sync_to_async(is_open)(shop),
+            },
+        )
+
+
+# カート表示・管理（LINE用）
+class CartView(AsyncLineLoginRequiredMixin, View):
+    async def get(self, request):
+        # 表示のみなのでカートが無ければ作成しない
+        cart = await Cart.objects.filter(customer=request.customer).afirst()
+        items = []
+        if cart:
+            items = [
+                item async for item in cart.items.select_related("product__shop").order_by("created_at")
+            ]
+
+        # カートのショップ（カートが空の場合は、セッションから最後にアクセスしたショップID）
+        shop_id = cart.shop_id if items else await request.session.aget("last_shop_id")
+
+        return await arender(
+            request,
+            "line/cart.html",
+            {
+                "cart": cart,
+                "items": items,
+                "totals": await cart.atotals() if items else EMPTY_CART_TOTALS,
+                "shop_id": shop_id,
+                "line_id": request.line_id,
+                "liff_id": "2007902301-b7xL87yd",
+            },
+        )
+
+    async def post(self, request):
+        action = request.POST.get("action")
+        is_ajax = request.headers.get("x-requested-with") == "XMLHttpRequest"
+
+        if action == "add_to_cart":
+            product_id = request.POST.get("product_id")
+            quantity = int(request.POST.get("quantity", 1))
+
+            try:
+                product = await Product.objects.aget(id=product_id, is_available=True)
+            except Product.DoesNotExist:
+                if is_ajax:
+                    return JsonResponse({"ok": False, "message": "商品が見つかりません"}, status=404)
+                messages.error(request, "商品が見つかりません")
+                return redirect(build_url_with_line_id("line:index", request.line_id))
+
+            cart, created = await Cart.objects.aget_or_create(customer=request.customer)
+
+            # カートには1つのショップの商品のみ入れられる
+            if not await cart.aassign_shop(product.shop_id):
+                if is_ajax:
+                    return JsonResponse({"ok": False, "message": SHOP_MISMATCH_MESSAGE}, status=409)
+                messages.error(request, SHOP_MISMATCH_MESSAGE)
+                return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+            cart_item, created = await CartItem.objects.aget_or_create(
+                cart=cart, product=product, defaults={"quantity": quantity}
+            )
+            if not created:
+                cart_item.quantity += quantity
+                await cart_item.asave()
+
+            # AJAX要求ならJSONを返す（フラッシュメッセージは使わない）
+            if is_ajax:
+                totals = await cart.atotals()
+                return JsonResponse({
+                    "ok": True,
+                    "cart_count": totals["item_count"],
+                    "cart": totals,
+                    "message": f"{product.name}をカートに追加しました",
+                })
+
+            messages.success(request, f"{product.name}をカートに追加しました")
+            return redirect(build_url_with_line_id("line:product", request.line_id, shop_id=product.shop_id))
+
+        elif action == "add_items":
+            # 複数商品をまとめて追加（商品の検証1クエリ + 一括upsert）
+            try:
+                quantities = parse_cart_items(request.POST.get("items"))
+            except (ValueError, KeyError, TypeError):
+                return JsonResponse({"ok": False, "message": "商品の指定が正しくありません"}, status=400)
+
+            cart, created = await Cart.objects.aget_or_create(customer=request.customer)
+            products = await sync_to_async(cart.add_items)(quantities)
+
+            # カートには1つのショップの商品のみ入れられる（add_to_cart と同じ応答）
+            if products is None:
+                if is_ajax:
+                    return JsonResponse({"ok": False, "message": SHOP_MISMATCH_MESSAGE}, status=409)
+                messages.error(request, SHOP_MISMATCH_MESSAGE)
+                return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+            if is_ajax:
+                return add_items_response(quantities, products, await cart.atotals())
+
+            if products:
+                messages.success(request, f"{len(products)}件の商品をカートに追加しました")
+            else:
+                messages.error(request, "追加できる商品がありません")
+            return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+        elif action in ("update_quantity", "remove_item"):
+            item_id = request.POST.get("item_id")
+            quantity = int(request.POST.get("quantity", 1)) if action == "update_quantity" else 0
+
+            try:
+                cart_item = await CartItem.objects.select_related("cart", "product").aget(
+                    id=item_id, cart__customer=request.customer
+                )
+            except CartItem.DoesNotExist:
+                if is_ajax:
+                    return JsonResponse({"ok": False, "message": "カートアイテムが見つかりません"}, status=404)
+                messages.error(request, "カートアイテムが見つかりません")
+                return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+            if quantity > 0:
+                cart_item.quantity = quantity
+                await cart_item.asave(update_fields=["quantity"])
+                message = "数量を更新しました"
+            else:
+                await cart_item.adelete()
+                message = "商品を削除しました"
+
+            if is_ajax:
+                return cart_item_response(cart_item, item_id, quantity, await cart_item.cart.atotals(), message)
+
+            messages.success(request, message)
+
+        return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+
+# 注文確認（LINE用）
+class OrderConfirmView(AsyncLineLoginRequiredMixin, View):
+    async def get(self, request):
+        try:
+            cart = await Cart.objects.select_related("shop").aget(customer=request.customer)
+        except Cart.DoesNotExist:
+            messages.error(request, "カートが見つかりません")
+            return redirect(build_url_with_line_id("line:index", request.line_id))
+
+        first_item = await cart.items.select_related("product__shop").afirst()
+        if first_item is None:
+            messages.error(request, "カートが空です")
+            return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+        # 受け取り枠の空き状況（キャッシュ）
+        shop = cart.shop or first_item.product.shop
+        pickup_dates, pickup_availability = await sync_to_async(availability)(shop)
+
+        return await arender(
+            request,
+            "line/order_confirm.html",
+            {
+                "cart": cart,
+                "line_id": request.line_id,
+                "pickup_dates": pickup_dates,
+                "pickup_availability": pickup_availability,
+                "open_now": await sync_to_async(is_open)(shop),
+            },
+        )
+
+    async def post(self, request):
+        try:
+            order = await sync_to_async(place_order)(
+                request.customer, request.POST.get("note", ""), request.POST.get("pickup_time")
+            )
+        except Cart.DoesNotExist:
+            messages.error(request, "カートが見つかりません")
+            return redirect(build_url_with_line_id("line:index", request.line_id))
+        except (SlotUnavailable, ShopClosed) as e:
+            messages.error(request, str(e))
+            return redirect(build_url_with_line_id("line:order_confirm", request.line_id))
+
+        if order is None:
+            messages.error(request, "カートが空です")
+            return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+        order_message = await sync_to_async(create_order_message)(order)
+        await anotify(order, "order_confirmed", request.line_id, order_message)
+
+        messages.success(request, "注文が完了しました")
+        return redirect(build_url_with_line_id("line:order_complete", request.line_id, order_id=order.id))
+
+
+# 注文完了（LINE用）
+class OrderCompleteView(AsyncLineLoginRequiredMixin, View):
+    async def get(self, request, order_id):
+        try:
+            order = await Order.objects.select_related("shop__queue").aget(id=order_id, customer=request.customer)
+        except Order.DoesNotExist:
+            messages.error(request, "注文が見つかりません")
+            return redirect(build_url_with_line_id("line:index", request.line_id))
+        return await arender(
+            request,
+            "line/order_complete.html",
+            {"order": order, "ready_at": order_eta(order), "line_id": request.line_id},
+        )
+
+
+# 注文履歴（LINE用）
+class OrderHistoryView(AsyncLineLoginRequiredMixin, View):
+    async def get(self, request):
+        orders = [
+            order
+            async for order in Order.objects.filter(customer=request.customer)
+            .select_related("shop")
+            .prefetch_related("items")
+            .order_by("-created_at")
+        ]
+        return await arender(request, "line/order_history.html", {"orders": orders, "line_id": request.line_id})
+
+    async def post(self, request):
+        # 再注文: 過去の注文の商品をまとめてカートに追加
+        order = await aget_object_or_404(Order, id=request.POST.get("order_id"), customer=request.customer)
+        result = await sync_to_async(reorder)(request.customer, order)
+        if result is None:
+            if request.headers.get("x-requested-with") == "XMLHttpRequest":
+                return JsonResponse({"ok": False, "message": SHOP_MISMATCH_MESSAGE}, status=409)
+            messages.error(request, SHOP_MISMATCH_MESSAGE)
+            return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+        products, skipped, price_changes = result
+        results = create_reorder_messages(products, skipped, price_changes)
+
+        if request.headers.get("x-requested-with") == "XMLHttpRequest":
+            return JsonResponse({
+                "ok": bool(products),
+                "messages": [message for level, message in results],
+                "skipped": skipped,
+                "price_changes": [
+                    {"name": name, "old_price": old_price, "new_price": new_price}
+                    for name, old_price, new_price in price_changes
+                ],
+            })
+
+        for level, message in results:
+            messages.add_message(request, level, message)
+        if not products:
+            messages.error(request, "カートに追加できる商品がありません")
+            return redirect(build_url_with_line_id("line:order_history", request.line_id))
+        return redirect(build_url_with_line_id("line:cart", request.line_id))
+
+
+# 注文キャンセル（LINE用）
+class OrderCancelView(AsyncLineLoginRequiredMixin, View):
+    async def post(self, request, order_id):
+        try:
+            order = await Order.objects.select_related("shop").aget(id=order_id, customer=request.customer)
+        except Order.DoesNotExist:
+            messages.error(request, "注文が見つかりません")
+            return redirect(build_url_with_line_id("line:order_history", request.line_id))
+
+        if await sync_to_async(cancel_order)(order):
+            await anotify(order, "order_cancelled", request.line_id, create_cancel_message(order))
+            messages.success(request, "注文をキャンセルしました")
+        else:
+            messages.error(request, "この注文はキャンセルできません")
+
+        return redirect(build_url_with_line_id("line:order_history", request.line_id))
+
+
+def handle_events(body, signature):
+    """Webhookのイベントを line.views のハンドラーで処理する（スレッドプールで実行）"""
+    try:
+        handler.handle(body, signature)
+    finally:
+        # プールのスレッドで開いたDB接続はリクエスト終了時に閉じられないため、ここで後始末する
+        close_old_connections()
+
+
+# LINEコールバック（イベント処理は line.views のハンドラーをスレッドプールで実行）
+# 共有の同期スレッドで実行すると、LINE APIの応答待ちの間そのワーカーの他のリクエストも止まる
+class CallbackView(View):
+    async def get(self, request):
+        return HttpResponse("OK")
+
+    async def post(self, request):
+        signature = request.META["HTTP_X_LINE_SIGNATURE"]
+        body = request.body.decode("utf-8")
+
+        try:
+            await sync_to_async(handle_events, thread_sensitive=False)(body, signature)
+        except InvalidSignatureError:
+            return HttpResponseBadRequest()
+        except LineBotApiError as e:
+            print(e)
+            return HttpResponseServerError()
+
+        return HttpResponse("OK")
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
@@ -0,0 +1,82 @@
+"""
+トークでのコマンド（注文確認・注文変更・注文キャンセル）への応答
+
+Flexメニュー（menu_message）のボタンが送るテキストに、Webhookの応答トークンで返信する。
+返信に使う注文の一覧は顧客ごとの要約としてキャッシュしておき、注文が保存/削除されたら破棄する。
+キャッシュがない場合も要約の作成は1クエリで済むため、Webhookの処理時間内に返信できる。
+注文はLIFF（どのワーカーでも）で作成されるため、破棄が全ワーカーに届くよう共有キャッシュ（CACHE_URL）を前提とする。
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from linebot.models import TextSendMessage
+
+from app.models import Customer, Order
+from line.line_messages import (
+    cancel_order_message,
+    change_order_message,
+    check_order_message,
+    menu_message,
+    new_menu_message,
+)
+
+SUMMARY_CACHE_TIMEOUT = 60 * 60
+# 確認できる注文（受け取り前）
+ACTIVE_STATUSES = ("pending", "preparing", "ready")
+# 変更・キャンセルできる注文（cancel_order と同じ）
+CHANGEABLE_STATUSES = ("pending", "preparing")
+# Flexメッセージに並べるボタンの上限
+MAX_SUMMARY_ORDERS = 10
+
+OrderSummary = namedtuple("OrderSummary", ["id", "created_at", "status", "shop_name", "total_amount"])
+
+
+def summary_cache_key(line_id):
+    return f"line:orders:{line_id}"
+
+
+def order_summaries(line_id):
+    """受け取り前の注文の要約（新しい順・キャッシュ）"""
+    key = summary_cache_key(line_id)
+    summaries = cache.get(key)
+    if summaries is None:
+        rows = (
+            Order.objects.filter(customer__line_id=line_id, status__in=ACTIVE_STATUSES)
+            .order_by("-created_at")
+            .values_list("id", "created_at", "status", "shop__name", "total_amount")[:MAX_SUMMARY_ORDERS]
+        )
+        summaries = [OrderSummary(*row) for row in rows]
+        cache.set(key, summaries, SUMMARY_CACHE_TIMEOUT)
+    return summaries
+
+
+def command_reply(line_id, text):
+    """テキストに対する返信メッセージ"""
+    summaries = order_summaries(line_id)
+    if not summaries:
+        return new_menu_message()
+
+    changeable = [summary for summary in summaries if summary.status in CHANGEABLE_STATUSES]
+    if text == "注文確認":
+        return check_order_message(summaries)
+    if text in ("注文変更", "注文キャンセル", "キャンセル"):
+        if not changeable:
+            return [TextSendMessage(text="変更・キャンセルできる注文はありません。"), new_menu_message()]
+        if text == "注文変更":
+            return change_order_message(changeable)
+        return cancel_order_message(changeable)
+    return menu_message()
+
+
+@receiver([post_save, post_delete], sender=Order)
+def order_changed(sender, instance, **kwargs):
+    if Order.customer.is_cached(instance):
+        line_id = instance.customer.line_id
+    else:
+        line_id = Customer.objects.filter(pk=instance.customer_id).values_list("line_id", flat=True).first()
+    if line_id:
+        key = summary_cache_key(line_id)
+        transaction.on_commit(lambda: cache.delete(key))
@@ -2,160 +2,38 @@ from django.conf import settings
 from django.utils import timezone
 
 from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
 from linebot.models import (
     FlexSendMessage,
 )
 
-line_bot_api = LineBotApi(settings.CHANNEL_ACCESS_TOKEN)
+from order_app.metrics import track_line_api
 
+line_bot_api = LineBotApi(settings.CHANNEL_ACCESS_TOKEN, endpoint=settings.LINE_API_ENDPOINT)
 
-# 注文確定
-def send_order_confirm_message(line_id, order):
-    content_json = {
-        "type": "flex",
-        "altText": "注文完了しました",
-        "contents": {
-            "type": "bubble",
-            "header": {
-                "type": "box",
-                "layout": "vertical",
-                "flex": 0,
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": "注文完了",
-                        "weight": "bold",
-                        "align": "center",
-                        "contents": [],
-                    }
-                ],
-            },
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "box",
-                        "layout": "vertical",
-                        "contents": [
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "注文番号",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": str(order.id),
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "注文日時",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": timezone.localtime(order.created_at).strftime("%Y年%m月%d日 %H:%M"),
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "ショップ",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": order.shop.name,
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "住所",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": order.shop.address or "未設定",
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "電話番号",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": order.shop.tel or "未設定",
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "受け取り予定",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": timezone.localtime(order.pickup_time).strftime("%H:%M") if order.pickup_time else "未設定",
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                            {
-                                "type": "box",
-                                "layout": "baseline",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "合計金額",
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": f"{order.total_amount}円",
-                                        "align": "end",
-                                    },
-                                ],
-                            },
-                        ],
-                    }
-                ],
-            },
-        },
-    }
 
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+def push_message(line_id, messages):
+    """プッシュメッセージで送信する（送信数がメッセージ通数の上限にカウントされる）"""
+    with track_line_api():
+        line_bot_api.push_message(line_id, messages=messages)
+
+
+def reply_message(reply_token, messages, line_id=None):
+    """
+    Webhookの応答トークンで返信する（通数にカウントされず、プッシュより速い）。
+    応答トークンの期限切れ等で返信できなかった場合、line_id があればプッシュで送り直す
+    """
+    try:
+        with track_line_api():
+            line_bot_api.reply_message(reply_token, messages)
+    except LineBotApiError:
+        if line_id is None:
+            raise
+        push_message(line_id, messages)
 
 
 # 注文がある場合
-def send_menu_message(line_id):
+def menu_message():
     content_json = {
         "type": "flex",
         "altText": "メニューを選択してください",
@@ -211,12 +89,11 @@ def send_menu_message(line_id):
         },
     }
 
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+    return FlexSendMessage.new_from_json_dict(content_json)
 
 
 # 注文がない場合
-def send_new_menu_message(line_id):
+def new_menu_message():
     content_json = {
         "type": "flex",
         "altText": "メニューを選択してください",
@@ -253,12 +130,11 @@ def send_new_menu_message(line_id):
         },
     }
 
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+    return FlexSendMessage.new_from_json_dict(content_json)
 
 
 # 注文確認
-def send_check_order_message(line_id, orders):
+def check_order_message(orders):
     content_json = {
         "type": "flex",
         "altText": "注文確認",
@@ -294,7 +170,8 @@ def send_check_order_message(line_id, orders):
             "action": {
                 "type": "postback",
                 "label": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
-                "text": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
+                # text を指定するとテキストメッセージとしても送られ、コマンドとして応答してしまうため表示のみにする
+                "displayText": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
                 "data": f"action=注文確認&order_id={order.id}",
             },
             "style": "primary",
@@ -302,12 +179,11 @@ def send_check_order_message(line_id, orders):
         buttons.append(button)
 
     content_json["contents"]["body"]["contents"] = buttons
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+    return FlexSendMessage.new_from_json_dict(content_json)
 
 
 # 注文確認詳細
-def send_check_order_detail_message(line_id, order):
+def check_order_detail_message(order):
     local_date = timezone.localtime(order.created_at)
 
     content_json = {
@@ -419,12 +295,11 @@ def send_check_order_detail_message(line_id, order):
         },
     }
 
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+    return FlexSendMessage.new_from_json_dict(content_json)
 
 
 # 注文変更
-def send_change_order_message(line_id, orders):
+def change_order_message(orders):
     content_json = {
         "type": "flex",
         "altText": "注文変更",
@@ -459,21 +334,129 @@ def send_change_order_message(line_id, orders):
         button = {
             "type": "button",
             "action": {
-                "type": "uri",
+                "type": "postback",
                 "label": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
-                "uri": f"https://liff.line.me/{settings.LIFF_ID}?order_id={order.id}",
+                "displayText": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
+                "data": f"action=注文変更&order_id={order.id}",
             },
             "style": "primary",
         }
         buttons.append(button)
 
     content_json["contents"]["body"]["contents"] = buttons
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+    return FlexSendMessage.new_from_json_dict(content_json)
+
+
+# 注文変更の確認
+def change_order_confirm_message(order):
+    content_json = {
+        "type": "flex",
+        "altText": "注文変更",
+        "contents": {
+            "type": "bubble",
+            "header": {
+                "type": "box",
+                "layout": "vertical",
+                "flex": 0,
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": "注文変更",
+                        "weight": "bold",
+                        "align": "center",
+                        "contents": [],
+                    }
+                ],
+            },
+            "body": {
+                "type": "box",
+                "layout": "vertical",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": (
+                            f"注文#{order.id}（{order.shop.name}・{order.total_amount}円）を取り消して、"
+                            "商品をカートに戻します。カートで内容を変更してから注文し直してください。"
+                        ),
+                        "wrap": True,
+                        "contents": [],
+                    }
+                ],
+            },
+            "footer": {
+                "type": "box",
+                "layout": "vertical",
+                "spacing": "md",
+                "contents": [
+                    {
+                        "type": "button",
+                        "action": {
+                            "type": "postback",
+                            "label": "カートに戻して変更する",
+                            "displayText": f"注文#{order.id}を変更する",
+                            "data": f"action=注文変更確定&order_id={order.id}",
+                        },
+                        "style": "primary",
+                    },
+                    {
+                        "type": "button",
+                        "action": {
+                            "type": "message",
+                            "label": "やめる",
+                            "text": "メニュー",
+                        },
+                        "style": "secondary",
+                    },
+                ],
+            },
+        },
+    }
+
+    return FlexSendMessage.new_from_json_dict(content_json)
+
+
+# カートへの案内
+def cart_message(text):
+    content_json = {
+        "type": "flex",
+        "altText": text,
+        "contents": {
+            "type": "bubble",
+            "body": {
+                "type": "box",
+                "layout": "vertical",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": text,
+                        "wrap": True,
+                        "contents": [],
+                    }
+                ],
+            },
+            "footer": {
+                "type": "box",
+                "layout": "vertical",
+                "contents": [
+                    {
+                        "type": "button",
+                        "action": {
+                            "type": "uri",
+                            "label": "カートを開く",
+                            "uri": f"https://liff.line.me/{settings.LIFF_ID}/cart/",
+                        },
+                        "style": "primary",
+                    }
+                ],
+            },
+        },
+    }
+
+    return FlexSendMessage.new_from_json_dict(content_json)
 
 
 # 注文キャンセル
-def send_cancel_order_message(line_id, orders):
+def cancel_order_message(orders):
     content_json = {
         "type": "flex",
         "altText": "注文キャンセル",
@@ -510,7 +493,8 @@ def send_cancel_order_message(line_id, orders):
             "action": {
                 "type": "postback",
                 "label": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
-                "text": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
+                # text を指定するとテキストメッセージとしても送られ、コマンドとして応答してしまうため表示のみにする
+                "displayText": f"注文#{order.id} - {local_date.strftime('%m/%d %H:%M')}",
                 "data": f"action=注文キャンセル&order_id={order.id}",
             },
             "style": "secondary",
@@ -518,5 +502,5 @@ def send_cancel_order_message(line_id, orders):
         buttons.append(button)
 
     content_json["contents"]["body"]["contents"] = buttons
-    result = FlexSendMessage.new_from_json_dict(content_json)
-    line_bot_api.push_message(line_id, messages=result)
+    return FlexSendMessage.new_from_json_dict(content_json)
+
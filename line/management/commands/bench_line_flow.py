@@ -0,0 +1,226 @@
+"""
+LINE注文フローのベンチマーク
+
+テスト用DBを作成して実データに近いデータ（実行時刻によらず注文できるよう24時間営業のショップ）を投入し、
+LINE APIをスタブ化した上で
+ショップ一覧 → 商品一覧 → カート追加(AJAX) → 注文確認 → 注文確定 → 注文履歴 の流れを
+繰り返し実行する。ステップごとにリクエスト/秒、レイテンシのパーセンタイル、クエリ数を出力する。
+
+使い方:
+    python manage.py bench_line_flow --iterations 200 --output bench.json
+    python manage.py bench_line_flow --baseline bench.json  # 前回結果との比較
+"""
+import io
+import json
+import random
+import statistics
+import time
+from contextlib import ExitStack, redirect_stdout
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from app.models import Customer, Product
+
+STEPS = [
+    "line:index",
+    "line:product",
+    "line:cart(add)",
+    "line:order_confirm",
+    "line:order_confirm(post)",
+    "line:order_history",
+]
+
+
+class StubResponse:
+    status_code = 200
+    text = "{}"
+
+
+class Command(BaseCommand):
+    help = "LINE注文フローのベンチマークを実行する（LINE APIはスタブ化）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shops", type=int, default=5)
+        parser.add_argument("--products", type=int, default=300, help="ショップあたりの商品数")
+        parser.add_argument("--customers", type=int, default=500)
+        parser.add_argument("--orders", type=float, default=20, help="顧客あたりの平均注文数")
+        parser.add_argument("--iterations", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="結果をJSONで保存するパス")
+        parser.add_argument("--baseline", help="比較対象の結果JSON")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="p95レイテンシの許容悪化率（0.2 = 20%%）",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            rng = random.Random(options["seed"])
+            self.stdout.write("データ投入中...")
+            started = time.perf_counter()
+            shop_ids, line_ids = self.seed(rng, options)
+            self.stdout.write(f"データ投入完了: {time.perf_counter() - started:.1f}秒")
+
+            results = self.run_flow(rng, shop_ids, line_ids, options["iterations"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["threshold"])
+
+    # データ投入（generate_data コマンドを利用）
+    def seed(self, rng, options):
+        call_command(
+            "generate_data",
+            shops=options["shops"],
+            products=options["products"],
+            customers=options["customers"],
+            orders_per_customer=options["orders"],
+            cart_ratio=0,
+            open_24h=True,
+            seed=options["seed"],
+            prefix="bench",
+            verbosity=0,
+            stdout=io.StringIO(),
+        )
+
+        shop_products = {}
+        for shop_id, product_id in Product.objects.filter(is_available=True).values_list(
+            "shop_id", "id"
+        ):
+            shop_products.setdefault(shop_id, []).append(product_id)
+        line_ids = list(Customer.objects.order_by("id").values_list("line_id", flat=True))
+        return shop_products, line_ids
+
+    # 注文フローの実行
+    def run_flow(self, rng, shop_products, line_ids, iterations):
+        client = Client()
+        timings = {step: [] for step in STEPS}
+        queries = {step: [] for step in STEPS}
+
+        def measure(step, func, failure_url=None):
+            """failure_url: このURLへのリダイレクトは失敗として扱う（エラーをメッセージで表示して戻る画面）"""
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = func()
+                elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                raise CommandError(f"{step}: HTTP {response.status_code}")
+            if failure_url and response.status_code == 302 and response.url.startswith(failure_url):
+                raise CommandError(f"{step}: {response.url} にリダイレクトされました")
+            timings[step].append(elapsed)
+            queries[step].append(len(ctx.captured_queries))
+            return response
+
+        with ExitStack() as stack:
+            # LINE APIをスタブ化
+            stack.enter_context(mock.patch("line.notifications.requests.post", return_value=StubResponse()))
+            if settings.LINE_ASYNC_VIEWS:
+                stack.enter_context(
+                    mock.patch("line.async_views.adeliver", mock.AsyncMock(return_value=True))
+                )
+            # ビューのデバッグ出力を抑制する
+            stack.enter_context(redirect_stdout(io.StringIO()))
+
+            for _ in range(iterations):
+                line_id = rng.choice(line_ids)
+                shop_id = rng.choice(list(shop_products))
+                query = f"?line_id={line_id}"
+
+                measure("line:index", lambda: client.get(reverse("line:index") + query))
+                measure(
+                    "line:product",
+                    lambda: client.get(reverse("line:product", args=[shop_id]) + query),
+                )
+                for product_id in rng.sample(shop_products[shop_id], 2):
+                    measure(
+                        "line:cart(add)",
+                        lambda: client.post(
+                            reverse("line:cart") + query,
+                            {"action": "add_to_cart", "product_id": product_id, "quantity": 1},
+                            headers={"x-requested-with": "XMLHttpRequest"},
+                        ),
+                    )
+                measure("line:order_confirm", lambda: client.get(reverse("line:order_confirm") + query))
+                measure(
+                    "line:order_confirm(post)",
+                    lambda: client.post(reverse("line:order_confirm") + query, {"note": ""}),
+                    failure_url=reverse("line:order_confirm"),
+                )
+                measure("line:order_history", lambda: client.get(reverse("line:order_history") + query))
+
+        results = {}
+        for step in STEPS:
+            samples = sorted(timings[step])
+            results[step] = {
+                "requests": len(samples),
+                "rps": len(samples) / sum(samples) if samples else 0,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "queries_avg": statistics.mean(queries[step]) if queries[step] else 0,
+                "queries_max": max(queries[step], default=0),
+            }
+        return results
+
+    def report(self, results):
+        header = f"{'step':<26}{'n':>6}{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'q_avg':>8}{'q_max':>7}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for step, r in results.items():
+            self.stdout.write(
+                f"{step:<26}{r['requests']:>6}{r['rps']:>9.1f}{r['p50_ms']:>9.2f}"
+                f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['queries_avg']:>8.1f}{r['queries_max']:>7}"
+            )
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for step, r in results.items():
+            base = baseline.get(step)
+            if not base:
+                continue
+            if r["queries_max"] > base["queries_max"]:
+                regressions.append(
+                    f"{step}: クエリ数 {base['queries_max']} → {r['queries_max']}"
+                )
+            if base["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{step}: p95 {base['p95_ms']:.2f}ms → {r['p95_ms']:.2f}ms"
+                )
+
+        if regressions:
+            raise CommandError("性能が悪化しています:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("ベースラインからの悪化はありません"))
+
+
+def percentile(samples, pct):
+    """ソート済みサンプルのパーセンタイル（最近傍順位法）"""
+    if not samples:
+        return 0
+    index = max(0, min(len(samples) - 1, round(pct / 100 * len(samples)) - 1))
+    return samples[index]
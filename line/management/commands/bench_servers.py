@@ -0,0 +1,251 @@
+"""
+WSGI（同期ワーカー）と ASGI（uvicornワーカー + 非同期ビュー）の同時接続スループット比較
+
+一時DBにデータ（24時間営業のショップ）を投入し、遅延を入れたLINE APIのスタブサーバーを立てた上で、
+同じワーカー数の gunicorn を WSGI / ASGI それぞれで起動して負荷をかける。
+各仮想ユーザーは 商品一覧 → カート追加 → 注文確定（LINE push あり）を繰り返す。
+
+使い方:
+    python manage.py bench_servers --workers 2 --concurrency 50 --duration 20 --line-latency 0.3
+"""
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import aiohttp
+import requests
+from aiohttp import web
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from line.management.commands.bench_line_flow import percentile
+
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+SHOP_RE = re.compile(r'data-shop-id="(\d+)"')
+PRODUCT_RE = re.compile(r'data-product-id="(\d+)"')
+
+MODES = {
+    "wsgi": {
+        "args": ["order_app.wsgi:application", "--worker-class", "sync"],
+        "env": {"LINE_ASYNC_VIEWS": "0"},
+    },
+    "asgi": {
+        "args": ["order_app.asgi:application", "--worker-class", "uvicorn.workers.UvicornWorker"],
+        "env": {"LINE_ASYNC_VIEWS": "1"},
+    },
+}
+
+
+def start_line_stub(port, latency):
+    """指定した遅延で応答するLINE Messaging APIのスタブを別スレッドで起動する"""
+    loop = asyncio.new_event_loop()
+
+    async def push(request):
+        await asyncio.sleep(latency)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post("/v2/bot/message/push", push)
+    runner = web.AppRunner(app)
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    return loop
+
+
+class Command(BaseCommand):
+    help = "WSGI と ASGI の同時接続スループットを比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--concurrency", type=int, default=50, help="同時仮想ユーザー数")
+        parser.add_argument("--duration", type=float, default=20, help="計測時間（秒）")
+        parser.add_argument("--line-latency", type=float, default=0.3, help="LINE APIの応答遅延（秒）")
+        parser.add_argument("--port", type=int, default=8701)
+        parser.add_argument("--line-port", type=int, default=8702)
+        parser.add_argument("--customers", type=int, default=500)
+        parser.add_argument(
+            "--database-url",
+            help="使用するDB（省略時は一時SQLiteファイル。書き込みが多いためPostgreSQL推奨）",
+        )
+
+    def handle(self, *args, **options):
+        tmpdir = tempfile.TemporaryDirectory()
+        # 比較条件を揃えるため、gunicorn.conf.py の代わりに空の設定ファイルを使う
+        self.gunicorn_config = os.path.join(tmpdir.name, "gunicorn.conf.py")
+        open(self.gunicorn_config, "w").close()
+        database_url = options["database_url"] or f"sqlite:///{tmpdir.name}/bench.sqlite3"
+        base_env = {
+            **os.environ,
+            "DATABASE_URL": database_url,
+            "LINE_API_ENDPOINT": f"http://127.0.0.1:{options['line_port']}",
+            "DEBUG": "False",
+        }
+
+        self.stdout.write("データ投入中...")
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, "manage.py")]
+        subprocess.run(manage + ["migrate", "--noinput", "-v", "0"], env=base_env, check=True)
+        subprocess.run(
+            manage
+            + [
+                "generate_data",
+                "--shops", "3",
+                "--products", "30",
+                "--customers", str(options["customers"]),
+                "--orders-per-customer", "5",
+                "--cart-ratio", "0",
+                "--open-24h",
+                "--prefix", "srv",
+                "-v", "0",
+            ],
+            env=base_env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+        line_loop = start_line_stub(options["line_port"], options["line_latency"])
+        results = {}
+        try:
+            for mode in options["modes"]:
+                results[mode] = self.run_mode(mode, base_env, options)
+        finally:
+            line_loop.call_soon_threadsafe(line_loop.stop)
+            tmpdir.cleanup()
+
+        self.stdout.write("")
+        header = f"{'mode':<8}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for mode, r in results.items():
+            self.stdout.write(
+                f"{mode:<8}{r['requests']:>10}{r['errors']:>8}{r['rps']:>9.1f}"
+                f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+            )
+        for mode, r in results.items():
+            if r["error_detail"]:
+                self.stdout.write(f"{mode} エラー内訳: {r['error_detail']}")
+
+    def run_mode(self, mode, base_env, options):
+        config = MODES[mode]
+        command = [
+            sys.executable, "-m", "gunicorn", *config["args"],
+            "--config", self.gunicorn_config,
+            "--workers", str(options["workers"]),
+            "--bind", f"127.0.0.1:{options['port']}",
+            "--log-level", "warning",
+        ]
+        env = {**base_env, **config["env"]}
+        self.stdout.write(f"[{mode}] サーバー起動: {' '.join(command[2:])}")
+        server = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+        try:
+            base_url = f"http://127.0.0.1:{options['port']}"
+            self.wait_until_ready(base_url, server)
+            return asyncio.run(self.load(base_url, options))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    def wait_until_ready(self, base_url, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("サーバーの起動に失敗しました")
+            try:
+                if requests.get(f"{base_url}/health/", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise CommandError("サーバーが起動しませんでした")
+
+    async def load(self, base_url, options):
+        # generate_data --prefix srv で作成された顧客
+        line_ids = [f"Usrv{i:010d}" for i in range(options["customers"])]
+        async with aiohttp.ClientSession(base_url=base_url) as session:
+            async with session.get(f"/line/?line_id={line_ids[0]}") as response:
+                shop_ids = sorted(set(SHOP_RE.findall(await response.text())))
+        if not shop_ids:
+            raise CommandError("ショップが見つかりません")
+
+        latencies = []
+        errors = Counter()
+        deadline = time.monotonic() + options["duration"]
+
+        async def request(session, method, url, failure_url=None, **kwargs):
+            """failure_url: このURLへのリダイレクトはエラーとして数える（エラーをメッセージで表示して戻る画面）"""
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url, allow_redirects=False, **kwargs) as response:
+                    body = await response.text()
+                    if response.status >= 400:
+                        errors[f"HTTP {response.status}"] += 1
+                        return None
+                    if failure_url and response.headers.get("Location", "").startswith(failure_url):
+                        errors[f"redirect {failure_url}"] += 1
+                        return None
+            except aiohttp.ClientError as e:
+                errors[type(e).__name__] += 1
+                return None
+            latencies.append(time.perf_counter() - start)
+            return body
+
+        async def user(index):
+            query = f"?line_id={line_ids[index % len(line_ids)]}"
+            shop_id = shop_ids[index % len(shop_ids)]
+            jar = aiohttp.CookieJar(unsafe=True)
+            async with aiohttp.ClientSession(base_url=base_url, cookie_jar=jar) as session:
+                while time.monotonic() < deadline:
+                    page = await request(session, "GET", f"/line/product/{shop_id}/{query}")
+                    match = CSRF_RE.search(page or "")
+                    product_ids = PRODUCT_RE.findall(page or "")
+                    if not match or not product_ids:
+                        continue
+                    token = match.group(1)
+                    await request(
+                        session,
+                        "POST",
+                        f"/line/cart/{query}",
+                        data={
+                            "csrfmiddlewaretoken": token,
+                            "action": "add_to_cart",
+                            "product_id": product_ids[index % len(product_ids)],
+                            "quantity": "1",
+                        },
+                        headers={"X-Requested-With": "XMLHttpRequest"},
+                    )
+                    await request(
+                        session,
+                        "POST",
+                        f"/line/order/confirm/{query}",
+                        failure_url="/line/order/confirm/",
+                        data={"csrfmiddlewaretoken": token, "note": ""},
+                    )
+
+        started = time.monotonic()
+        await asyncio.gather(*(user(i) for i in range(options["concurrency"])))
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        return {
+            "requests": len(latencies),
+            "errors": sum(errors.values()),
+            "error_detail": dict(errors),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0,
+        }
@@ -0,0 +1,43 @@
+"""
+送信できなかったLINE通知の再送
+
+リクエスト中に送信できなかった（タイムアウト・LINE APIのエラーなど）通知を、通知ごとのリトライキーを付けて再送する。
+LINEが受付済みの通知は 409 が返り送信済みになるため、二重に届くことはない。
+cron 等で定期実行するか、--loop で常駐させる。
+送信前に通知を確保するため、複数のプロセスで実行しても同じ通知を同時に送信しない。
+
+使い方:
+    python manage.py deliver_notifications
+    python manage.py deliver_notifications --loop --interval 5
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from line.notifications import PUSH_TIMEOUT, claim, deliver, due_notifications
+
+
+class Command(BaseCommand):
+    help = "送信できなかったLINE通知を再送する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="1回に再送する通知数")
+        parser.add_argument("--timeout", type=float, default=PUSH_TIMEOUT, help="LINE APIのタイムアウト（秒）")
+        parser.add_argument("--loop", action="store_true", help="終了せずに再送を繰り返す")
+        parser.add_argument("--interval", type=float, default=5, help="--loop 時の待機時間（秒）")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = failed = 0
+            for notification in due_notifications()[: options["batch_size"]]:
+                if not claim(notification, options["timeout"]):
+                    continue
+                if deliver(notification, timeout=options["timeout"]):
+                    sent += 1
+                else:
+                    failed += 1
+            if sent or failed or options["verbosity"] >= 2:
+                self.stdout.write(f"送信: {sent}件 / 未送信: {failed}件")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,138 @@
+"""
+LINEへのプッシュ通知の送信
+
+注文確定・キャンセルの通知は LineNotification に1件ずつ保存してから送信する。
+送信には通知ごとのリトライキー（X-Line-Retry-Key）を付けるため、タイムアウトなどでLINEが受け付けたか
+分からない場合も同じ通知を安全に再送できる（受付済みなら 409 が返るので送信済みとして扱う）。
+
+リクエスト中は短いタイムアウトで1回だけ送信し、送信できなかった通知は deliver_notifications コマンドが再送する。
+リトライキーはLINE側で24時間しか保持されないため、それより古い通知は再送せず送信失敗とする。
+
+同じ通知を複数のプロセスが同時に送信しないよう、送信中の通知は next_attempt_at を送信のタイムアウトより先に
+進めておく（作成時・再送時）。送信結果は送信待ちの場合のみ保存し、他のプロセスが送信済みにした通知を
+古い状態で上書きしない。
+"""
+import json
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from app.models import LineNotification
+from order_app.metrics import track_line_api
+
+# リクエスト中の送信のタイムアウト（秒）
+PUSH_TIMEOUT = 3
+# リトライキーの有効期間
+RETRY_KEY_LIFETIME = timedelta(hours=24)
+# 再送間隔（送信回数に応じて倍にする）
+RETRY_BASE_DELAY = timedelta(seconds=10)
+RETRY_MAX_DELAY = timedelta(minutes=10)
+# 送信中の通知を再送の対象から外しておく時間（タイムアウトに加える余裕）
+SEND_LEASE_MARGIN = timedelta(seconds=10)
+
+
+def lease_until(now, timeout=PUSH_TIMEOUT):
+    """送信を始めた通知を他のプロセスが再送し始めない時刻"""
+    return now + timedelta(seconds=timeout) + SEND_LEASE_MARGIN
+
+
+def create_notification(order, kind, line_id, text):
+    """注文の通知を作成する（同じ注文・種別の通知は1件のみ）"""
+    notification, _ = LineNotification.objects.get_or_create(
+        order=order,
+        kind=kind,
+        # 作成したリクエストが送信を終えるまでは再送の対象にしない
+        defaults={"line_id": line_id, "text": text, "next_attempt_at": lease_until(timezone.now())},
+    )
+    return notification
+
+
+def claim(notification, timeout=PUSH_TIMEOUT):
+    """再送する通知を確保する（他のプロセスが先に確保・送信した場合は False）"""
+    next_attempt_at = lease_until(timezone.now(), timeout)
+    claimed = LineNotification.objects.filter(
+        pk=notification.pk, status="pending", next_attempt_at=notification.next_attempt_at
+    ).update(next_attempt_at=next_attempt_at)
+    if claimed:
+        notification.next_attempt_at = next_attempt_at
+    return bool(claimed)
+
+
+def push_request(notification):
+    """プッシュAPIのリクエスト (URL, ヘッダー, ボディ)"""
+    url = f"{settings.LINE_API_ENDPOINT}/v2/bot/message/push"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {settings.CHANNEL_ACCESS_TOKEN}",
+        "X-Line-Retry-Key": str(notification.retry_key),
+    }
+    data = {"to": notification.line_id, "messages": [{"type": "text", "text": notification.text}]}
+    return url, headers, json.dumps(data)
+
+
+def record_result(notification, status_code=None, error=""):
+    """
+    送信結果を保存する（status_code が None なら通信エラー）。
+    戻り値: 送信済みになったか
+    """
+    now = timezone.now()
+    notification.attempts += 1
+    if status_code in (200, 409):
+        # 409: 同じリトライキーのリクエストをLINEが受付済み
+        notification.status = "sent"
+        notification.sent_at = now
+        notification.last_error = ""
+    else:
+        notification.last_error = f"{status_code or ''} {error}".strip()
+        retryable = status_code is None or status_code == 429 or status_code >= 500
+        if retryable and now - notification.created_at < RETRY_KEY_LIFETIME:
+            delay = min(RETRY_BASE_DELAY * 2 ** (notification.attempts - 1), RETRY_MAX_DELAY)
+            notification.next_attempt_at = now + delay
+        else:
+            notification.status = "failed"
+    # 送信待ちのままの場合のみ保存する（他のプロセスが送信済みにした結果を上書きしない）
+    saved = LineNotification.objects.filter(pk=notification.pk, status="pending").update(
+        status=notification.status,
+        attempts=F("attempts") + 1,
+        last_error=notification.last_error,
+        next_attempt_at=notification.next_attempt_at,
+        sent_at=notification.sent_at,
+    )
+    if not saved:
+        notification.refresh_from_db()
+        print(f"LINEメッセージは他のプロセスで処理済みです: {notification.line_id}（{notification.status}）")
+        return notification.status == "sent"
+
+    if notification.status == "sent":
+        print(f"✅ LINEメッセージ送信成功: {notification.line_id}")
+    else:
+        print(f"❌ LINEメッセージ送信失敗: {notification.last_error}")
+    return notification.status == "sent"
+
+
+def deliver(notification, timeout=PUSH_TIMEOUT):
+    """通知を送信する。戻り値: 送信済みか"""
+    if notification.status != "pending":
+        return notification.status == "sent"
+
+    url, headers, body = push_request(notification)
+    try:
+        with track_line_api():
+            response = requests.post(url, headers=headers, data=body, timeout=timeout)
+    except requests.RequestException as e:
+        return record_result(notification, error=str(e))
+    return record_result(notification, response.status_code, response.text)
+
+
+def notify(order, kind, line_id, text):
+    """通知を作成して送信する（送信できなかった場合は deliver_notifications が再送する）"""
+    return deliver(create_notification(order, kind, line_id, text))
+
+
+def due_notifications(now=None):
+    """再送する通知"""
+    now = now or timezone.now()
+    return LineNotification.objects.filter(status="pending", next_attempt_at__lte=now).order_by("next_attempt_at")
@@ -1,3 +1,734 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+import threading
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from accounts.models import UserAccount
+from app.models import (
+    Cart,
+    CartItem,
+    Customer,
+    LineNotification,
+    Order,
+    PickupSlot,
+    Product,
+    Shop,
+    ShopHoliday,
+    ShopQueue,
+    WebhookEvent,
+)
+from app.order_queue import status_changed
+from app.schedule import is_open
+from app.slots import availability
+from line import async_views
+from line.commands import order_summaries
+from line.line_messages import cancel_order_message, change_order_message, check_order_message
+from line.notifications import claim, create_notification, deliver, due_notifications, record_result
+from app.tickets import next_ticket_number
+from line.views import MAX_BATCH_ITEMS, SHOP_MISMATCH_MESSAGE, place_order
+
+# 非同期版のLINEビュー（LINE_ASYNC_VIEWS=True の場合）のテスト用URL（ROOT_URLCONF="line.tests"）
+urlpatterns = [
+    path(
+        "line/",
+        include(
+            (
+                [
+                    path("", async_views.IndexView.as_view(), name="index"),
+                    path("product/<int:shop_id>/", async_views.ProductView.as_view(), name="product"),
+                    path("cart/", async_views.CartView.as_view(), name="cart"),
+                ],
+                "line",
+            )
+        ),
+    )
+]
+
+
+def create_shop(name="テストショップ", email="shop@example.com"):
+    user = UserAccount.objects.create_user(email, "password", name=name)
+    return Shop.objects.create(user=user, name=name)
+
+
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.db")
+class SessionWriteTests(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.product = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.query = "?line_id=Utest0001"
+
+    def session_writes(self, ctx):
+        return [
+            query["sql"]
+            for query in ctx.captured_queries
+            if "django_session" in query["sql"] and not query["sql"].startswith("SELECT")
+        ]
+
+    def test_steady_state_menu_browse_does_not_write_session(self):
+        # 初回アクセスでセッションを作成
+        self.client.get(reverse("line:product", args=[self.shop.id]) + self.query)
+
+        with CaptureQueriesContext(connection) as ctx:
+            for _ in range(3):
+                self.client.get(reverse("line:index") + self.query)
+                self.client.get(reverse("line:product", args=[self.shop.id]) + self.query)
+                self.client.post(
+                    reverse("line:cart") + self.query,
+                    {"action": "add_to_cart", "product_id": self.product.id, "quantity": 1},
+                    headers={"x-requested-with": "XMLHttpRequest"},
+                )
+                self.client.get(reverse("line:cart") + self.query)
+
+        self.assertEqual(self.session_writes(ctx), [])
+
+    def test_ajax_add_to_cart_does_not_queue_flash_message(self):
+        response = self.client.post(
+            reverse("line:cart") + self.query,
+            {"action": "add_to_cart", "product_id": self.product.id, "quantity": 1},
+            headers={"x-requested-with": "XMLHttpRequest"},
+        )
+
+        self.assertEqual(response.json()["cart_count"], 1)
+        self.assertNotIn("messages", response.cookies)
+
+
+class CartApiTests(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        self.other_shop = create_shop("別のショップ", "other@example.com")
+        self.latte = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.mocha = Product.objects.create(shop=self.shop, name="モカ", price=550)
+        self.sold_out = Product.objects.create(shop=self.shop, name="限定", price=600, is_available=False)
+        self.tea = Product.objects.create(shop=self.other_shop, name="紅茶", price=400)
+        self.customer = Customer.objects.create(name="顧客", line_id="Ucart")
+        self.cart = Cart.objects.create(customer=self.customer, shop=self.shop)
+        self.item = CartItem.objects.create(cart=self.cart, product=self.latte, quantity=1)
+        self.url = reverse("line:cart") + "?line_id=Ucart"
+
+    def post(self, data):
+        return self.client.post(self.url, data, headers={"x-requested-with": "XMLHttpRequest"})
+
+    def add_items(self, items):
+        return self.post({"action": "add_items", "items": items if isinstance(items, str) else json.dumps(items)})
+
+    def cart_contents(self):
+        return dict(self.cart.items.values_list("product_id", "quantity"))
+
+    def test_add_items_merges_quantities(self):
+        response = self.add_items([
+            {"product_id": self.latte.id, "quantity": 2},
+            {"product_id": self.latte.id},
+            {"product_id": self.mocha.id, "quantity": 1},
+            {"product_id": self.sold_out.id, "quantity": 1},
+        ])
+
+        data = response.json()
+        self.assertTrue(data["ok"])
+        self.assertEqual(data["skipped"], [self.sold_out.id])
+        self.assertEqual(data["cart"], {"total_price": 500 * 4 + 550, "item_count": 5})
+        self.assertEqual(self.cart_contents(), {self.latte.id: 4, self.mocha.id: 1})
+
+    def test_add_items_rejects_more_than_max_batch_items(self):
+        items = [{"product_id": self.mocha.id, "quantity": 1}] * (MAX_BATCH_ITEMS + 1)
+
+        self.assertEqual(self.add_items(items).status_code, 400)
+        self.assertEqual(self.cart_contents(), {self.latte.id: 1})
+
+    def test_add_items_rejects_bad_input(self):
+        for raw in [
+            "not json",
+            "{}",
+            "[]",
+            "[1]",
+            '[{"quantity": 1}]',
+            '[{"product_id": "abc"}]',
+            json.dumps([{"product_id": self.mocha.id, "quantity": 0}]),
+        ]:
+            with self.subTest(items=raw):
+                response = self.add_items(raw)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()["ok"])
+        self.assertEqual(self.cart_contents(), {self.latte.id: 1})
+
+    def test_add_items_from_other_shop_returns_409(self):
+        response = self.add_items([{"product_id": self.tea.id, "quantity": 1}])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {"ok": False, "message": SHOP_MISMATCH_MESSAGE})
+        self.assertEqual(self.cart_contents(), {self.latte.id: 1})
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.shop_id, self.shop.id)
+
+    def test_update_quantity_returns_item_and_cart_totals(self):
+        response = self.post({"action": "update_quantity", "item_id": self.item.id, "quantity": 3})
+
+        self.assertEqual(response.json(), {
+            "ok": True,
+            "message": "数量を更新しました",
+            "item": {"id": self.item.id, "quantity": 3, "subtotal": 1500},
+            "cart": {"total_price": 1500, "item_count": 3},
+        })
+
+    def test_remove_item_returns_empty_cart_totals(self):
+        response = self.post({"action": "remove_item", "item_id": self.item.id})
+
+        self.assertEqual(response.json(), {
+            "ok": True,
+            "message": "商品を削除しました",
+            "item": {"id": self.item.id, "quantity": 0, "subtotal": 0},
+            "cart": {"total_price": 0, "item_count": 0},
+        })
+        self.assertEqual(self.cart_contents(), {})
+
+    def test_other_customers_item_is_not_found(self):
+        other = Customer.objects.create(name="他の顧客", line_id="Uother")
+        other_item = CartItem.objects.create(cart=Cart.objects.create(customer=other), product=self.mocha)
+
+        response = self.post({"action": "remove_item", "item_id": other_item.id})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(CartItem.objects.filter(pk=other_item.pk).exists())
+
+
+class CartShopTests(TestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        other_shop = create_shop("別のショップ", "other@example.com")
+        self.latte = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.tea = Product.objects.create(shop=other_shop, name="紅茶", price=400)
+        customer = Customer.objects.create(name="顧客", line_id="Ushop")
+        self.cart = Cart.objects.create(customer=customer)
+        self.data = {"action": "add_to_cart", "product_id": self.tea.id, "quantity": 1}
+        self.headers = {"x-requested-with": "XMLHttpRequest"}
+
+    def add_latte(self):
+        self.assertTrue(self.cart.assign_shop(self.latte.shop_id))
+        CartItem.objects.create(cart=self.cart, product=self.latte, quantity=2)
+
+    def assert_unchanged(self, response, shop_id, contents):
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {"ok": False, "message": SHOP_MISMATCH_MESSAGE})
+        self.assertEqual((shop_id, contents), (self.shop.id, {self.latte.id: 2}))
+
+    def test_first_product_sets_cart_shop(self):
+        self.client.post(reverse("line:cart") + "?line_id=Ushop", self.data, headers=self.headers)
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.shop_id, self.tea.shop_id)
+
+    def test_other_shop_product_is_rejected(self):
+        self.add_latte()
+
+        response = self.client.post(reverse("line:cart") + "?line_id=Ushop", self.data, headers=self.headers)
+
+        self.cart.refresh_from_db()
+        self.assert_unchanged(response, self.cart.shop_id, dict(self.cart.items.values_list("product_id", "quantity")))
+
+    @override_settings(ROOT_URLCONF="line.tests")
+    async def test_other_shop_product_is_rejected_async(self):
+        await sync_to_async(self.add_latte)()
+
+        response = await self.async_client.post(
+            reverse("line:cart") + "?line_id=Ushop", self.data, headers=self.headers
+        )
+
+        self.assertIs(response.resolver_match.func.view_class, async_views.CartView)
+        await self.cart.arefresh_from_db()
+        items = self.cart.items.values_list("product_id", "quantity")
+        contents = {product_id: quantity async for product_id, quantity in items}
+        self.assert_unchanged(response, self.cart.shop_id, contents)
+
+    async def test_aassign_shop_keeps_shop_while_cart_has_items(self):
+        await sync_to_async(self.add_latte)()
+
+        self.assertFalse(await self.cart.aassign_shop(self.tea.shop_id))
+        self.assertTrue(await self.cart.aassign_shop(self.latte.shop_id))
+
+        await CartItem.objects.filter(cart=self.cart).adelete()
+        self.assertTrue(await self.cart.aassign_shop(self.tea.shop_id))
+        await self.cart.arefresh_from_db()
+        self.assertEqual(self.cart.shop_id, self.tea.shop_id)
+
+
+class OvernightPickupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop()
+        # 18:00〜翌2:00の深夜営業
+        self.shop.open_time = time(18)
+        self.shop.close_time = time(2)
+        self.shop.save()
+        self.product = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.customer = Customer.objects.create(name="顧客", line_id="Uovernight")
+        cart = Cart.objects.create(customer=self.customer, shop=self.shop)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        self.now = timezone.make_aware(datetime(2026, 10, 19, 20, 0))
+        self.midnight = timezone.make_aware(datetime(2026, 10, 20, 0, 0))
+
+    def test_after_midnight_slots_are_grouped_under_opening_date(self):
+        dates, remaining = availability(self.shop, days=1, now=self.now)
+
+        (opening_date, starts), = dates
+        self.assertEqual(opening_date, date(2026, 10, 19))
+        self.assertIn(self.midnight, starts)
+        self.assertEqual(remaining["2026-10-19"]["00:00"], self.shop.slot_capacity)
+
+    def test_after_midnight_slot_value_is_next_day(self):
+        with mock.patch("django.utils.timezone.now", return_value=self.now):
+            response = self.client.get(reverse("line:order_confirm") + "?line_id=Uovernight")
+
+        self.assertContains(response, 'value="2026-10-20T00:00"')
+        self.assertNotContains(response, 'value="2026-10-19T00:00"')
+
+    def test_after_midnight_slot_reserves_next_day_counter(self):
+        with mock.patch("django.utils.timezone.now", return_value=self.now):
+            order = place_order(self.customer, pickup_time="2026-10-20T00:00")
+
+        self.assertEqual(order.pickup_time, self.midnight)
+        slot = PickupSlot.objects.get(shop=self.shop)
+        self.assertEqual((slot.start, slot.reserved), (self.midnight, 1))
+
+
+class SharedCacheInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop()
+        self.shop.open_time = self.shop.close_time = time(0)
+        self.shop.save()
+        self.product = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.customer = Customer.objects.create(name="顧客", line_id="Usummary")
+
+    def test_new_order_invalidates_cached_summaries(self):
+        self.assertEqual(order_summaries("Usummary"), [])
+        cart = Cart.objects.create(customer=self.customer, shop=self.shop)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(self.customer)
+
+        self.assertEqual([summary.id for summary in order_summaries("Usummary")], [order.id])
+
+    def test_status_change_invalidates_cached_summaries(self):
+        order = Order.objects.create(customer=self.customer, shop=self.shop, total_amount=500)
+        self.assertEqual(order_summaries("Usummary")[0].status, "pending")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = "completed"
+            order.save()
+
+        self.assertEqual(order_summaries("Usummary"), [])
+
+    def test_holiday_invalidates_cached_hours_after_commit(self):
+        self.assertTrue(is_open(self.shop))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            ShopHoliday.objects.create(shop=self.shop, date=timezone.localdate(), is_closed=True)
+            # コミットまでは変更前の内容を返す
+            self.assertTrue(is_open(self.shop))
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(is_open(self.shop))
+
+
+class OrderQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = create_shop()
+        self.shop.open_time = self.shop.close_time = time(0)
+        self.shop.save()
+        self.product = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.customer = Customer.objects.create(name="顧客", line_id="Uqueue")
+        self.cart = Cart.objects.create(customer=self.customer, shop=self.shop)
+
+    def order(self, pickup_time=None):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        return place_order(self.customer, pickup_time=pickup_time)
+
+    def tomorrow_noon(self):
+        return (timezone.localdate() + timedelta(days=1)).strftime("%Y-%m-%dT12:00")
+
+    def mark_ready(self, order, hours):
+        later = order.created_at + timedelta(hours=hours)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            order.status = "ready"
+            order.save()
+            status_changed(order, "pending")
+
+    def test_scheduled_pickup_order_is_not_queued(self):
+        scheduled = self.order(self.tomorrow_noon())
+        asap = self.order()
+
+        self.assertIsNone(scheduled.queue_position)
+        self.assertEqual(asap.queue_position, 1)
+        self.assertEqual(ShopQueue.objects.get(shop=self.shop).depth, 1)
+
+    def test_scheduled_pickup_order_is_not_a_prep_time_sample(self):
+        asap = self.order()
+        scheduled = self.order(self.tomorrow_noon())
+
+        self.mark_ready(scheduled, hours=20)
+        queue = ShopQueue.objects.get(shop=self.shop)
+        self.assertEqual((queue.depth, queue.avg_prep_seconds), (1, 300))
+
+        self.mark_ready(asap, hours=0.1)
+        queue.refresh_from_db()
+        self.assertEqual(queue.depth, 0)
+        self.assertAlmostEqual(queue.avg_prep_seconds, 300 * 0.8 + 360 * 0.2)
+
+
+# LINEから受信したWebhookのリクエストボディ（記録したものを元に、ユーザーIDなどを置き換えたもの）
+FOLLOW_BODY = {
+    "destination": "Udeadbeefdeadbeefdeadbeefdeadbeef",
+    "events": [
+        {
+            "type": "follow",
+            "follow": {"isUnblocked": False},
+            "webhookEventId": "01HZX7Q9V4K3M2N1P0R8S6T5W4",
+            "deliveryContext": {"isRedelivery": False},
+            "timestamp": 1718000000000,
+            "source": {"type": "user", "userId": "Ureplay0001"},
+            "replyToken": "b60d432864f44d079f6d8efe86cf404b",
+            "mode": "active",
+        }
+    ],
+}
+
+
+UNFOLLOW_BODY = {
+    "destination": "Udeadbeefdeadbeefdeadbeefdeadbeef",
+    "events": [
+        {
+            "type": "unfollow",
+            "webhookEventId": "01HZX7Q9V4K3M2N1P0R8S6UF01",
+            "deliveryContext": {"isRedelivery": False},
+            "timestamp": 1718000000000,
+            "source": {"type": "user", "userId": "Ureplay0001"},
+            "mode": "active",
+        }
+    ],
+}
+
+
+def post_webhook(client, body):
+    """署名を付けてWebhookを送信する"""
+    body = json.dumps(body)
+    signature = base64.b64encode(
+        hmac.new(settings.CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    ).decode()
+    return client.post(
+        reverse("line:callback"), body, content_type="application/json", headers={"x-line-signature": signature}
+    )
+
+
+def postback_body(user_id, data, event_id="01HZX7Q9V4K3M2N1P0R8S6PB01"):
+    return {
+        "destination": "Udeadbeefdeadbeefdeadbeefdeadbeef",
+        "events": [
+            {
+                "type": "postback",
+                "postback": {"data": data},
+                "webhookEventId": event_id,
+                "deliveryContext": {"isRedelivery": False},
+                "timestamp": 1718000000000,
+                "source": {"type": "user", "userId": user_id},
+                "replyToken": "b60d432864f44d079f6d8efe86cf404b",
+                "mode": "active",
+            }
+        ],
+    }
+
+
+def redelivered(body):
+    body = json.loads(json.dumps(body))
+    for event in body["events"]:
+        event["deliveryContext"]["isRedelivery"] = True
+    return body
+
+
+class WebhookReplayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("line.views.line_bot_api")
+        self.line_bot_api = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.line_bot_api.get_profile.return_value.display_name = "リプレイ"
+
+    def post_webhook(self, body):
+        return post_webhook(self.client, body)
+
+    def test_duplicate_delivery_runs_handler_once(self):
+        self.assertEqual(self.post_webhook(FOLLOW_BODY).status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.post_webhook(FOLLOW_BODY).status_code, 200)
+
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(self.line_bot_api.get_profile.call_count, 1)
+        self.assertEqual(Customer.objects.filter(line_id="Ureplay0001").count(), 1)
+
+    def test_redelivery_after_cache_expiry_is_skipped(self):
+        self.post_webhook(FOLLOW_BODY)
+        Customer.objects.filter(line_id="Ureplay0001").delete()
+        cache.clear()
+
+        self.assertEqual(self.post_webhook(redelivered(FOLLOW_BODY)).status_code, 200)
+
+        self.assertEqual(self.line_bot_api.get_profile.call_count, 1)
+        self.assertFalse(Customer.objects.filter(line_id="Ureplay0001").exists())
+
+    def test_redelivery_of_failed_event_is_processed(self):
+        with mock.patch("line.views.Customer.objects.create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post_webhook(FOLLOW_BODY)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        self.post_webhook(redelivered(FOLLOW_BODY))
+
+        self.assertTrue(Customer.objects.filter(line_id="Ureplay0001").exists())
+        self.assertTrue(WebhookEvent.objects.get().is_redelivery)
+
+
+class UnfollowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(name="顧客", line_id="Ureplay0001")
+
+    def test_unfollow_deactivates_customer(self):
+        self.assertEqual(post_webhook(self.client, UNFOLLOW_BODY).status_code, 200)
+
+        self.customer.refresh_from_db()
+        self.assertFalse(self.customer.is_active)
+        self.assertIsNotNone(self.customer.unfollowed_at)
+        self.assertEqual(self.customer.name, "顧客")
+
+    def test_follow_again_reactivates_customer(self):
+        post_webhook(self.client, UNFOLLOW_BODY)
+
+        with mock.patch("line.views.line_bot_api") as line_bot_api:
+            post_webhook(self.client, FOLLOW_BODY)
+
+        self.customer.refresh_from_db()
+        self.assertTrue(self.customer.is_active)
+        self.assertIsNone(self.customer.unfollowed_at)
+        line_bot_api.get_profile.assert_not_called()
+
+
+class OrderPostbackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("line.views.reply_message")
+        self.reply_message = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shop = create_shop()
+        self.product = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+        self.customer = Customer.objects.create(name="顧客", line_id="Upostback")
+        self.order = Order.objects.create(customer=self.customer, shop=self.shop, total_amount=1000)
+        self.order.items.create(product=self.product, product_name="カフェラテ", price=500, quantity=2)
+
+    def replied(self):
+        messages = self.reply_message.call_args.args[1]
+        return messages if isinstance(messages, list) else [messages]
+
+    def test_order_buttons_do_not_send_text_messages(self):
+        summaries = order_summaries("Upostback")
+        for message in (check_order_message(summaries), change_order_message(summaries), cancel_order_message(summaries)):
+            action = message.as_json_dict()["contents"]["body"]["contents"][0]["action"]
+            self.assertEqual(action["type"], "postback")
+            self.assertNotIn("text", action)
+            self.assertIn(f"order_id={self.order.id}", action["data"])
+
+    def test_change_asks_for_confirmation(self):
+        post_webhook(self.client, postback_body("Upostback", f"action=注文変更&order_id={self.order.id}"))
+
+        (message,) = self.replied()
+        self.assertEqual(message.alt_text, "注文変更")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "pending")
+
+    def test_confirmed_change_cancels_order_and_restores_cart(self):
+        post_webhook(self.client, postback_body("Upostback", f"action=注文変更確定&order_id={self.order.id}"))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "cancelled")
+        cart = Cart.objects.get(customer=self.customer)
+        self.assertEqual(list(cart.items.values_list("product_id", "quantity")), [(self.product.id, 2)])
+        self.assertIn("カートに戻しました", self.replied()[0].alt_text)
+
+    def test_change_keeps_order_when_cart_has_other_shop(self):
+        other = create_shop("別のショップ", "other@example.com")
+        cart = Cart.objects.create(customer=self.customer, shop=other)
+        cart.items.create(product=Product.objects.create(shop=other, name="紅茶", price=400))
+
+        post_webhook(self.client, postback_body("Upostback", f"action=注文変更確定&order_id={self.order.id}"))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "pending")
+        self.assertEqual(cart.items.count(), 1)
+
+    def test_completed_order_cannot_be_changed(self):
+        Order.objects.filter(pk=self.order.pk).update(status="completed")
+
+        post_webhook(self.client, postback_body("Upostback", f"action=注文変更確定&order_id={self.order.id}"))
+
+        self.assertIn("変更できません", self.replied()[0].text)
+        self.assertFalse(Cart.objects.filter(customer=self.customer).exists())
+
+
+class NotificationDeliveryTests(TestCase):
+    def setUp(self):
+        shop = create_shop()
+        customer = Customer.objects.create(name="顧客", line_id="Unotify")
+        self.order = Order.objects.create(customer=customer, shop=shop, total_amount=500)
+        self.notification = create_notification(self.order, "order_confirmed", "Unotify", "ご注文ありがとうございます")
+        patcher = mock.patch("line.notifications.requests.post")
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond(self, status_code):
+        self.post.return_value = mock.Mock(status_code=status_code, text="")
+
+    def test_retry_key_is_sent(self):
+        self.respond(200)
+
+        self.assertTrue(deliver(self.notification))
+
+        headers = self.post.call_args.kwargs["headers"]
+        self.assertEqual(headers["X-Line-Retry-Key"], str(self.notification.retry_key))
+        self.notification.refresh_from_db()
+        self.assertEqual((self.notification.status, self.notification.attempts), ("sent", 1))
+
+    def test_conflict_counts_as_sent(self):
+        self.respond(409)
+
+        self.assertTrue(deliver(self.notification))
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, "sent")
+
+    def test_new_notification_is_not_due_while_first_send_is_in_flight(self):
+        self.assertNotIn(self.notification, due_notifications())
+
+    def test_server_error_backs_off(self):
+        self.respond(500)
+
+        self.assertFalse(deliver(self.notification))
+        first = self.notification.next_attempt_at - timezone.now()
+        self.assertFalse(deliver(self.notification))
+        second = self.notification.next_attempt_at - timezone.now()
+
+        self.notification.refresh_from_db()
+        self.assertEqual((self.notification.status, self.notification.attempts), ("pending", 2))
+        self.assertAlmostEqual(first.total_seconds(), 10, delta=1)
+        self.assertAlmostEqual(second.total_seconds(), 20, delta=1)
+
+    def test_timeout_is_retried(self):
+        self.post.side_effect = requests.Timeout("timed out")
+
+        self.assertFalse(deliver(self.notification))
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, "pending")
+        self.assertIn("timed out", self.notification.last_error)
+
+    def test_client_error_fails_without_retry(self):
+        self.respond(400)
+
+        self.assertFalse(deliver(self.notification))
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, "failed")
+
+    def test_expired_retry_key_is_not_retried(self):
+        LineNotification.objects.filter(pk=self.notification.pk).update(
+            created_at=timezone.now() - timedelta(hours=25)
+        )
+        self.notification.refresh_from_db()
+        self.respond(500)
+
+        self.assertFalse(deliver(self.notification))
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, "failed")
+
+    def test_stale_failure_does_not_overwrite_sent(self):
+        stale = LineNotification.objects.get(pk=self.notification.pk)
+        record_result(self.notification, 200)
+
+        self.assertTrue(record_result(stale, error="timed out"))
+
+        self.notification.refresh_from_db()
+        self.assertEqual((self.notification.status, self.notification.attempts), ("sent", 1))
+
+    def test_due_notification_is_claimed_once(self):
+        LineNotification.objects.filter(pk=self.notification.pk).update(next_attempt_at=timezone.now())
+        first, second = due_notifications()[0], due_notifications()[0]
+
+        self.assertTrue(claim(first))
+        self.assertFalse(claim(second))
+        self.assertEqual(list(due_notifications()), [])
+
+
+class TicketNumberTests(TransactionTestCase):
+    def setUp(self):
+        self.shop = create_shop()
+        # 終日営業
+        self.shop.open_time = self.shop.close_time = time(0)
+        self.shop.save()
+        self.product = Product.objects.create(shop=self.shop, name="カフェラテ", price=500)
+
+    def run_in_threads(self, func, args_list):
+        barrier = threading.Barrier(len(args_list))
+        results = []
+        errors = []
+
+        def worker(args):
+            try:
+                barrier.wait()
+                results.append(func(*args))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(args,)) for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_parallel_checkouts_get_unique_sequential_numbers(self):
+        customers = []
+        for i in range(8):
+            customer = Customer.objects.create(name=f"顧客{i}", line_id=f"Uticket{i:04d}")
+            cart = Cart.objects.create(customer=customer, shop=self.shop)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            customers.append(customer)
+
+        orders = self.run_in_threads(place_order, [(customer,) for customer in customers])
+
+        numbers = sorted(order.ticket_number for order in orders)
+        self.assertEqual(numbers, list(range(1, 9)))
+        self.assertEqual(
+            sorted(Order.objects.values_list("ticket_number", flat=True)), numbers
+        )
+
+    def test_numbers_restart_per_shop_and_day(self):
+        other = create_shop("別のショップ", "other@example.com")
+        today = date.today()
+
+        self.run_in_threads(next_ticket_number, [(self.shop.id, today)] * 5)
+
+        self.assertEqual(next_ticket_number(self.shop.id, today), 6)
+        self.assertEqual(next_ticket_number(other.id, today), 1)
+        self.assertEqual(next_ticket_number(self.shop.id, today + timedelta(days=1)), 1)
@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 import re
 import json
-import requests
+from urllib.parse import parse_qs
 
 from django.conf import settings
 from django.http.response import (
@@ -13,16 +13,32 @@ from django.http import JsonResponse
 
 from line.forms import CustomerForm
 
+from django.db import transaction
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 from django.views import View
 from django.contrib import messages
 from app.models import Shop, Product, Cart, CartItem, Order, OrderItem, Customer
+from app.order_queue import enqueue_order, estimated_ready_time, status_changed
+from app.schedule import ShopClosed, is_open
+from app.slots import SlotUnavailable, availability, release_slot, reserve_pickup
+from app.tickets import assign_ticket
 
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
+from order_app.metrics import track_line_api
+from line.commands import CHANGEABLE_STATUSES, command_reply
+from line.line_messages import (
+    cart_message,
+    change_order_confirm_message,
+    check_order_detail_message,
+    reply_message,
+)
+from line.notifications import notify
+from line.webhook import once_per_event
+
 
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
@@ -31,6 +47,7 @@ from linebot.models import (
     MessageEvent,
     PostbackEvent,
     TextMessage,
+    TextSendMessage,
     UnfollowEvent,
 )
 
@@ -43,44 +60,6 @@ def build_url_with_line_id(view_name, line_id=None, **kwargs):
     return url
 
 
-def send_line_message(line_id, message_text):
-    """LINEメッセージを送信するヘルパー関数"""
-    try:
-        # LINE Messaging APIのエンドポイント
-        url = "https://api.line.me/v2/bot/message/push"
-        
-        # ヘッダー設定
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.CHANNEL_ACCESS_TOKEN}"
-        }
-        
-        # メッセージデータ
-        data = {
-            "to": line_id,
-            "messages": [
-                {
-                    "type": "text",
-                    "text": message_text
-                }
-            ]
-        }
-        
-        # APIリクエスト送信
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        
-        if response.status_code == 200:
-            print(f"✅ LINEメッセージ送信成功: {line_id}")
-            return True
-        else:
-            print(f"❌ LINEメッセージ送信失敗: {response.status_code} - {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ LINEメッセージ送信エラー: {str(e)}")
-        return False
-
-
 def create_order_message(order):
     """注文内容をLINEメッセージ用のテキストに変換するヘルパー関数"""
     shop_name = order.shop.name
@@ -90,23 +69,195 @@ def create_order_message(order):
     # 注文商品の詳細
     items_text = ""
     for item in order.items.all():
-        items_text += f"• {item.product.name} × {item.quantity} = ¥{item.subtotal}\n"
+        items_text += f"• {item.product_name} × {item.quantity} = ¥{item.subtotal}\n"
+    
+    pickup_text = ""
+    if order.pickup_time:
+        pickup_text = f"受け取り予定: {timezone.localtime(order.pickup_time):%m/%d %H:%M}\n"
+    else:
+        ready_at = estimated_ready_time(order)
+        if ready_at:
+            pickup_text = f"完成予定: {timezone.localtime(ready_at):%H:%M}頃（待ち{order.queue_position}件）\n"
     
     # 注文メッセージの作成
     message = f"""注文が確定しました！
 
+受付番号: {order.ticket_label}
 注文番号: #{order_id}
 
 注文内容:
 {items_text}
 合計金額: ¥{total_amount}
-
+{pickup_text}
 ご注文ありがとうございます！
-後ほど完成予定時間をお知らせいたします。"""
+準備が完了しましたらお知らせいたします。"""
     
     return message
 
 
+def create_cancel_message(order):
+    """キャンセル通知のメッセージを作成するヘルパー関数"""
+    return f"""🚫 注文がキャンセルされました
+
+ショップ: {order.shop.name}
+注文番号: #{order.id}
+金額: ¥{order.total_amount}
+
+注文のキャンセルが完了しました。"""
+
+
+def place_order(customer, note="", pickup_time=None):
+    """
+    カートの内容から注文を作成してカートを空にする。カートが空の場合はNoneを返す。
+    pickup_time（YYYY-MM-DDTHH:MM）を指定した場合は受け取り枠を予約し、選択できなければ SlotUnavailable。
+    受け取り時刻の指定がなく営業時間外の場合は ShopClosed
+    """
+    with transaction.atomic():
+        cart = Cart.objects.select_related("shop").get(customer=customer)
+        cart_items = list(cart.items.select_related("product__shop"))
+        if not cart_items:
+            return None
+
+        shop = cart.shop or cart_items[0].product.shop
+        pickup_start = reserve_pickup(shop, pickup_time)
+
+        order = Order.objects.create(
+            customer=customer,
+            shop=shop,
+            total_amount=sum(item.subtotal for item in cart_items),
+            note=note,
+            pickup_time=pickup_start,
+        )
+        OrderItem.objects.bulk_create(
+            [OrderItem.for_product(item.product, item.quantity, order=order) for item in cart_items]
+        )
+        cart.items.all().delete()
+        # ショップ全体で共有する行のため、ロックを取るのはコミット直前にする
+        enqueue_order(order)
+
+    # カウンタ行のロックを短くするため、注文のトランザクションの外で採番する
+    assign_ticket(order)
+    return order
+
+
+def cancel_order(order):
+    """キャンセル可能な注文であればキャンセルする"""
+    if order.status not in ["pending", "preparing"]:
+        return False
+    with transaction.atomic():
+        old_status = order.status
+        order.status = "cancelled"
+        order.save()
+        release_slot(order)
+        status_changed(order, old_status)
+    return True
+
+
+def change_order(order):
+    """
+    注文を取り消して同じ商品をカートに戻す（トークからの注文変更）。
+    戻り値: reorder() の結果。カートに別のショップの商品が入っている場合は取り消さずに None
+    """
+    with transaction.atomic():
+        if not cancel_order(order):
+            return None
+        result = reorder(order.customer, order)
+        if result is None:
+            transaction.set_rollback(True)
+        return result
+
+
+def order_action_reply(line_id, action, order_id):
+    """トークの注文ボタン（ポストバック）に対する返信メッセージ"""
+    order = Order.objects.select_related("shop").filter(id=order_id, customer__line_id=line_id).first()
+    if order is None:
+        return TextSendMessage(text="注文が見つかりません")
+
+    if action == "注文確認":
+        return check_order_detail_message(order)
+    if action == "注文キャンセル":
+        # OrderCancelView と同じ条件でキャンセルする
+        if cancel_order(order):
+            return TextSendMessage(text=create_cancel_message(order))
+        return TextSendMessage(text=f"この注文はキャンセルできません（{order.get_status_display()}）")
+    if action in ("注文変更", "注文変更確定"):
+        # 変更は取り消してカートに戻し、LIFFで注文し直してもらう（キャンセルと同じ条件）
+        if order.status not in CHANGEABLE_STATUSES:
+            return TextSendMessage(text=f"この注文は変更できません（{order.get_status_display()}）")
+        if action == "注文変更":
+            return change_order_confirm_message(order)
+        result = change_order(order)
+        if result is None:
+            return TextSendMessage(text="カートに別のショップの商品が入っているため変更できません。カートを空にしてからお試しください。")
+        lines = [f"注文#{order.id}を取り消し、商品をカートに戻しました。"]
+        lines += [message for level, message in create_reorder_messages(*result)]
+        lines.append("カートで内容を変更してから注文し直してください。")
+        return cart_message("\n".join(lines))
+    return command_reply(line_id, action)
+
+
+def annotate_open(shops):
+    """各ショップに営業時間内かどうか（open_now）を設定する"""
+    now = timezone.now()
+    for shop in shops:
+        shop.open_now = is_open(shop, now)
+    return shops
+
+
+def order_eta(order):
+    """注文完了ページ用の完成予定時刻（order は shop__queue を select_related 済みであること）"""
+    queue = getattr(order.shop, "queue", None)
+    if queue is None:
+        return None
+    return estimated_ready_time(order, queue.avg_prep_seconds)
+
+
+def reorder(customer, order):
+    """
+    過去の注文と同じ商品をカートに追加する（販売終了の商品は除く）
+    戻り値: (追加した商品のリスト, 追加できなかった商品名のリスト, 価格が変わった商品 [(商品名, 注文時の価格, 現在の価格)])
+    カートに別のショップの商品が入っている場合は None を返す
+    """
+    items = list(order.items.all())
+    quantities = {}
+    ordered_prices = {}
+    for item in items:
+        if item.product_id is None:
+            # 削除された商品
+            continue
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        ordered_prices[item.product_id] = item.price
+
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(customer=customer)
+        if not cart.assign_shop(order.shop_id):
+            return None
+        products = cart.add_items(quantities)
+        if products is None:
+            return None
+
+    added_ids = {product.id for product in products}
+    skipped = [item.product_name for item in items if item.product_id not in added_ids]
+    price_changes = [
+        (product.name, ordered_prices[product.id], product.price)
+        for product in products
+        if product.price != ordered_prices[product.id]
+    ]
+    return products, skipped, price_changes
+
+
+def create_reorder_messages(products, skipped, price_changes):
+    """再注文の結果を (レベル, メッセージ) のリストにする"""
+    results = []
+    if products:
+        results.append((messages.SUCCESS, f"前回の注文から{len(products)}件の商品をカートに追加しました"))
+    if skipped:
+        results.append((messages.WARNING, f"販売終了のため追加できませんでした: {'、'.join(skipped)}"))
+    for name, old_price, new_price in price_changes:
+        results.append((messages.WARNING, f"{name}の価格が変更されています: ¥{old_price} → ¥{new_price}"))
+    return results
+
+
 # LINE認証が必要なページ
 class LineRequiredView(View):
     def get(self, request):
@@ -128,8 +279,9 @@ class LineLoginRequiredMixin:
         except Customer.DoesNotExist:
             # 本番でも初回アクセスで自動登録
             customer = Customer.objects.create(line_id=line_id)
-        # セッションにも保存して、遷移先でも維持
-        request.session["line_id"] = line_id
+        # セッションにも保存して、遷移先でも維持（変わらない場合は書き込まない）
+        if request.session.get("line_id") != line_id:
+            request.session["line_id"] = line_id
         request.customer = customer
         request.line_id = line_id
         
@@ -142,13 +294,13 @@ class LineLoginRequiredMixin:
 # LINEアプリのメインページ
 class IndexView(View):
     def get(self, request):
-        shops = Shop.objects.filter(is_active=True).order_by("name")
+        shops = annotate_open(list(Shop.objects.filter(is_active=True).order_by("name")))
         line_id = request.GET.get("line_id")
         liff_id = "2007902301-b7xL87yd"  # 環境変数から取得
         
         print(f"🔍 デバッグ情報 shops変数の長さ: {len(shops)} line_id: {line_id or '未設定'} liff_id: {liff_id}")
         print(f"全ショップ数: {Shop.objects.count()}")
-        print(f"アクティブショップ数: {shops.count()}")
+        print(f"アクティブショップ数: {len(shops)}")
         
         return render(
             request,
@@ -174,7 +326,8 @@ class ProductView(LineLoginRequiredMixin, View):
         liff_id = "2007902301-b7xL87yd"  # 環境変数から取得
         
         # セッションに最後にアクセスしたショップIDを保存
-        request.session['last_shop_id'] = shop_id
+        if request.session.get("last_shop_id") != shop_id:
+            request.session["last_shop_id"] = shop_id
         
         return render(
             request,
@@ -185,10 +338,64 @@ class ProductView(LineLoginRequiredMixin, View):
                 "line_id": request.line_id,
                 "cart": cart,
                 "liff_id": liff_id,
+                "open_now": is_open(shop),
             },
         )
 
 
+def cart_item_response(cart_item, item_id, quantity, totals, message):
+    """カートの数量変更・削除のJSONレスポンス（削除時は quantity=0）"""
+    return JsonResponse({
+        "ok": True,
+        "message": message,
+        "item": {
+            "id": int(item_id),
+            "quantity": quantity,
+            "subtotal": cart_item.product.price * quantity,
+        },
+        "cart": totals,
+    })
+
+
+EMPTY_CART_TOTALS = {"total_price": 0, "item_count": 0}
+
+SHOP_MISMATCH_MESSAGE = "別のショップの商品がカートに入っています。注文を確定するかカートを空にしてから追加してください"
+
+# 一度にカートへ追加できる商品の種類数
+MAX_BATCH_ITEMS = 50
+
+
+def parse_cart_items(raw):
+    """
+    まとめて追加する商品のJSON（[{"product_id": 1, "quantity": 2}, ...]）を
+    {商品ID: 数量} に変換する。同じ商品が複数あれば数量を合算する
+    """
+    items = json.loads(raw or "[]")
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_ITEMS:
+        raise ValueError("invalid items")
+    quantities = {}
+    for item in items:
+        product_id = int(item["product_id"])
+        quantity = int(item.get("quantity", 1))
+        if quantity < 1:
+            raise ValueError("invalid quantity")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def add_items_response(quantities, products, totals):
+    """まとめて追加した結果のJSONレスポンス（販売終了などで追加できなかった商品IDも返す）"""
+    added_ids = {product.id for product in products}
+    return JsonResponse({
+        "ok": bool(products),
+        "added": [{"product_id": product.id, "quantity": quantities[product.id]} for product in products],
+        "skipped": sorted(set(quantities) - added_ids),
+        "cart_count": totals["item_count"],
+        "cart": totals,
+        "message": f"{len(products)}件の商品をカートに追加しました" if products else "追加できる商品がありません",
+    })
+
+
 # カート表示・管理（LINE用）
 class CartView(LineLoginRequiredMixin, View):
     def get(self, request):
@@ -196,22 +403,31 @@ class CartView(LineLoginRequiredMixin, View):
         if not request.customer:
             return redirect("line:line_required")
         
-        cart, created = Cart.objects.get_or_create(customer=request.customer)
+        # 表示のみなのでカートが無ければ作成しない
+        cart = Cart.objects.filter(customer=request.customer).first()
+        items = list(cart.items.select_related("product__shop").order_by("created_at")) if cart else []
         
-        # カートに商品がある場合は、その商品のショップIDを取得
-        shop_id = None
-        if cart.items.exists():
-            shop_id = cart.items.first().product.shop.id
-        else:
-            # カートが空の場合は、セッションから最後にアクセスしたショップIDを取得
-            shop_id = request.session.get('last_shop_id')
+        # カートのショップ（カートが空の場合は、セッションから最後にアクセスしたショップID）
+        shop_id = cart.shop_id if items else request.session.get('last_shop_id')
         
         liff_id = "2007902301-b7xL87yd"  # 環境変数から取得
         
-        return render(request, "line/cart.html", {"cart": cart, "shop_id": shop_id, "line_id": request.line_id, "liff_id": liff_id})
+        return render(
+            request,
+            "line/cart.html",
+            {
+                "cart": cart,
+                "items": items,
+                "totals": cart.totals() if items else EMPTY_CART_TOTALS,
+                "shop_id": shop_id,
+                "line_id": request.line_id,
+                "liff_id": liff_id,
+            },
+        )
 
     def post(self, request):
         action = request.POST.get("action")
+        is_ajax = request.headers.get("x-requested-with") == "XMLHttpRequest"
         
         if action == "add_to_cart":
             product_id = request.POST.get("product_id")
@@ -221,6 +437,13 @@ class CartView(LineLoginRequiredMixin, View):
                 product = Product.objects.get(id=product_id, is_available=True)
                 cart, created = Cart.objects.get_or_create(customer=request.customer)
                 
+                # カートには1つのショップの商品のみ入れられる
+                if not cart.assign_shop(product.shop_id):
+                    if is_ajax:
+                        return JsonResponse({"ok": False, "message": SHOP_MISMATCH_MESSAGE}, status=409)
+                    messages.error(request, SHOP_MISMATCH_MESSAGE)
+                    return redirect(build_url_with_line_id("line:cart", request.line_id))
+                
                 # 既存のカートアイテムを確認
                 cart_item, created = CartItem.objects.get_or_create(
                     cart=cart, product=product, defaults={"quantity": quantity}
@@ -230,53 +453,79 @@ class CartView(LineLoginRequiredMixin, View):
                     cart_item.quantity += quantity
                     cart_item.save()
                 
-                messages.success(request, f"{product.name}をカートに追加しました")
-                
-                # AJAX要求ならJSONを返す
-                if request.headers.get("x-requested-with") == "XMLHttpRequest":
+                # AJAX要求ならJSONを返す（フラッシュメッセージは使わない）
+                if is_ajax:
+                    totals = cart.totals()
                     return JsonResponse({
                         "ok": True,
-                        "cart_count": cart.item_count,
+                        "cart_count": totals["item_count"],
+                        "cart": totals,
                         "message": f"{product.name}をカートに追加しました",
                     })
                 
+                messages.success(request, f"{product.name}をカートに追加しました")
+                
                 # 通常はリダイレクト
                 return redirect(build_url_with_line_id("line:product", request.line_id, shop_id=product.shop.id))
                 
             except Product.DoesNotExist:
-                messages.error(request, "商品が見つかりません")
-                if request.headers.get("x-requested-with") == "XMLHttpRequest":
+                if is_ajax:
                     return JsonResponse({"ok": False, "message": "商品が見つかりません"}, status=404)
+                messages.error(request, "商品が見つかりません")
                 return redirect(build_url_with_line_id("line:index", request.line_id))
         
-        elif action == "update_quantity":
-            item_id = request.POST.get("item_id")
-            quantity = int(request.POST.get("quantity", 1))
-            
+        elif action == "add_items":
+            # 複数商品をまとめて追加（商品の検証1クエリ + 一括upsert）
             try:
-                cart_item = CartItem.objects.get(id=item_id, cart__customer=request.customer)
-                if quantity > 0:
-                    cart_item.quantity = quantity
-                    cart_item.save()
-                    messages.success(request, "数量を更新しました")
-                else:
-                    cart_item.delete()
-                    messages.success(request, "商品を削除しました")
-            except CartItem.DoesNotExist:
-                messages.error(request, "カートアイテムが見つかりません")
+                quantities = parse_cart_items(request.POST.get("items"))
+            except (ValueError, KeyError, TypeError):
+                return JsonResponse({"ok": False, "message": "商品の指定が正しくありません"}, status=400)
+            
+            cart, created = Cart.objects.get_or_create(customer=request.customer)
+            products = cart.add_items(quantities)
+            
+            # カートには1つのショップの商品のみ入れられる（add_to_cart と同じ応答）
+            if products is None:
+                if is_ajax:
+                    return JsonResponse({"ok": False, "message": SHOP_MISMATCH_MESSAGE}, status=409)
+                messages.error(request, SHOP_MISMATCH_MESSAGE)
+                return redirect(build_url_with_line_id("line:cart", request.line_id))
             
+            if is_ajax:
+                return add_items_response(quantities, products, cart.totals())
+            
+            if products:
+                messages.success(request, f"{len(products)}件の商品をカートに追加しました")
+            else:
+                messages.error(request, "追加できる商品がありません")
             return redirect(build_url_with_line_id("line:cart", request.line_id))
         
-        elif action == "remove_item":
+        elif action in ("update_quantity", "remove_item"):
             item_id = request.POST.get("item_id")
+            quantity = int(request.POST.get("quantity", 1)) if action == "update_quantity" else 0
             
             try:
-                cart_item = CartItem.objects.get(id=item_id, cart__customer=request.customer)
-                cart_item.delete()
-                messages.success(request, "商品を削除しました")
+                cart_item = CartItem.objects.select_related("cart", "product").get(
+                    id=item_id, cart__customer=request.customer
+                )
             except CartItem.DoesNotExist:
+                if is_ajax:
+                    return JsonResponse({"ok": False, "message": "カートアイテムが見つかりません"}, status=404)
                 messages.error(request, "カートアイテムが見つかりません")
+                return redirect(build_url_with_line_id("line:cart", request.line_id))
             
+            if quantity > 0:
+                cart_item.quantity = quantity
+                cart_item.save(update_fields=["quantity"])
+                message = "数量を更新しました"
+            else:
+                cart_item.delete()
+                message = "商品を削除しました"
+            
+            if is_ajax:
+                return cart_item_response(cart_item, item_id, quantity, cart_item.cart.totals(), message)
+            
+            messages.success(request, message)
             return redirect(build_url_with_line_id("line:cart", request.line_id))
         
         return redirect(build_url_with_line_id("line:cart", request.line_id))
@@ -286,46 +535,42 @@ class CartView(LineLoginRequiredMixin, View):
 class OrderConfirmView(LineLoginRequiredMixin, View):
     def get(self, request):
         try:
-            cart = Cart.objects.get(customer=request.customer)
-            if not cart.items.exists():
+            cart = Cart.objects.select_related("shop").get(customer=request.customer)
+            first_item = cart.items.select_related("product__shop").first()
+            if first_item is None:
                 messages.error(request, "カートが空です")
                 return redirect(build_url_with_line_id("line:cart", request.line_id))
             
-            return render(request, "line/order_confirm.html", {"cart": cart, "line_id": request.line_id})
+            # 受け取り枠の空き状況（キャッシュ）
+            pickup_dates, pickup_availability = availability(cart.shop or first_item.product.shop)
+            
+            return render(
+                request,
+                "line/order_confirm.html",
+                {
+                    "cart": cart,
+                    "line_id": request.line_id,
+                    "pickup_dates": pickup_dates,
+                    "pickup_availability": pickup_availability,
+                    "open_now": is_open(cart.shop or first_item.product.shop),
+                },
+            )
         except Cart.DoesNotExist:
             messages.error(request, "カートが見つかりません")
             return redirect(build_url_with_line_id("line:index", request.line_id))
 
     def post(self, request):
         try:
-            cart = Cart.objects.get(customer=request.customer)
-            if not cart.items.exists():
+            order = place_order(
+                request.customer, request.POST.get("note", ""), request.POST.get("pickup_time")
+            )
+            if order is None:
                 messages.error(request, "カートが空です")
                 return redirect(build_url_with_line_id("line:cart", request.line_id))
             
-            # 注文を作成
-            order = Order.objects.create(
-                customer=request.customer,
-                shop=cart.items.first().product.shop,
-                total_amount=cart.total_price,
-                note=request.POST.get("note", ""),
-            )
-            
-            # 注文アイテムを作成
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price,
-                )
-            
-            # カートをクリア
-            cart.items.all().delete()
-            
             # LINEメッセージを送信
             order_message = create_order_message(order)
-            send_line_message(request.line_id, order_message)
+            notify(order, "order_confirmed", request.line_id, order_message)
             
             messages.success(request, "注文が完了しました")
             return redirect(build_url_with_line_id("line:order_complete", request.line_id, order_id=order.id))
@@ -333,14 +578,21 @@ class OrderConfirmView(LineLoginRequiredMixin, View):
         except Cart.DoesNotExist:
             messages.error(request, "カートが見つかりません")
             return redirect(build_url_with_line_id("line:index", request.line_id))
+        except (SlotUnavailable, ShopClosed) as e:
+            messages.error(request, str(e))
+            return redirect(build_url_with_line_id("line:order_confirm", request.line_id))
 
 
 # 注文完了（LINE用）
 class OrderCompleteView(LineLoginRequiredMixin, View):
     def get(self, request, order_id):
         try:
-            order = Order.objects.get(id=order_id, customer=request.customer)
-            return render(request, "line/order_complete.html", {"order": order, "line_id": request.line_id})
+            order = Order.objects.select_related("shop__queue").get(id=order_id, customer=request.customer)
+            return render(
+                request,
+                "line/order_complete.html",
+                {"order": order, "ready_at": order_eta(order), "line_id": request.line_id},
+            )
         except Order.DoesNotExist:
             messages.error(request, "注文が見つかりません")
             return redirect(build_url_with_line_id("line:index", request.line_id))
@@ -349,29 +601,54 @@ class OrderCompleteView(LineLoginRequiredMixin, View):
 # 注文履歴（LINE用）
 class OrderHistoryView(LineLoginRequiredMixin, View):
     def get(self, request):
-        orders = Order.objects.filter(customer=request.customer).order_by("-created_at")
+        orders = (
+            Order.objects.filter(customer=request.customer)
+            .select_related("shop")
+            .prefetch_related("items")
+            .order_by("-created_at")
+        )
         return render(request, "line/order_history.html", {"orders": orders, "line_id": request.line_id})
 
+    def post(self, request):
+        # 再注文: 過去の注文の商品をまとめてカートに追加
+        order = get_object_or_404(Order, id=request.POST.get("order_id"), customer=request.customer)
+        result = reorder(request.customer, order)
+        if result is None:
+            if request.headers.get("x-requested-with") == "XMLHttpRequest":
+                return JsonResponse({"ok": False, "message": SHOP_MISMATCH_MESSAGE}, status=409)
+            messages.error(request, SHOP_MISMATCH_MESSAGE)
+            return redirect(build_url_with_line_id("line:cart", request.line_id))
+        
+        products, skipped, price_changes = result
+        results = create_reorder_messages(products, skipped, price_changes)
+        
+        if request.headers.get("x-requested-with") == "XMLHttpRequest":
+            return JsonResponse({
+                "ok": bool(products),
+                "messages": [message for level, message in results],
+                "skipped": skipped,
+                "price_changes": [
+                    {"name": name, "old_price": old_price, "new_price": new_price}
+                    for name, old_price, new_price in price_changes
+                ],
+            })
+        
+        for level, message in results:
+            messages.add_message(request, level, message)
+        if not products:
+            messages.error(request, "カートに追加できる商品がありません")
+            return redirect(build_url_with_line_id("line:order_history", request.line_id))
+        return redirect(build_url_with_line_id("line:cart", request.line_id))
+
 
 # 注文キャンセル（LINE用）
 class OrderCancelView(LineLoginRequiredMixin, View):
     def post(self, request, order_id):
         try:
             order = Order.objects.get(id=order_id, customer=request.customer)
-            if order.status in ["pending", "preparing"]:
-                order.status = "cancelled"
-                order.save()
-                
+            if cancel_order(order):
                 # キャンセル通知をLINEに送信
-                cancel_message = f"""🚫 注文がキャンセルされました
-
-ショップ: {order.shop.name}
-注文番号: #{order.id}
-金額: ¥{order.total_amount}
-
-注文のキャンセルが完了しました。"""
-                
-                send_line_message(request.line_id, cancel_message)
+                notify(order, "order_cancelled", request.line_id, create_cancel_message(order))
                 messages.success(request, "注文をキャンセルしました")
             else:
                 messages.error(request, "この注文はキャンセルできません")
@@ -385,7 +662,7 @@ class OrderCancelView(LineLoginRequiredMixin, View):
 
 
 
-line_bot_api = LineBotApi(settings.CHANNEL_ACCESS_TOKEN)
+line_bot_api = LineBotApi(settings.CHANNEL_ACCESS_TOKEN, endpoint=settings.LINE_API_ENDPOINT)
 handler = WebhookHandler(settings.CHANNEL_SECRET)
 # LINE API コールバック
 # LINEコールバック
@@ -413,14 +690,19 @@ class CallbackView(View):
 
     # 友達追加
     @handler.add(FollowEvent)
+    @once_per_event
     def handle_follow(event):
         line_id = event.source.user_id
 
+        # 友達解除後に再度追加されたユーザーは有効に戻す
+        if Customer.objects.filter(line_id=line_id, is_active=False).update(is_active=True, unfollowed_at=None):
+            print("友達解除されていたユーザーを有効にしました: ", line_id)
         # 既存のユーザーをチェック
-        if not Customer.objects.filter(line_id=line_id).exists():
+        elif not Customer.objects.filter(line_id=line_id).exists():
             try:
                 # LINEユーザー情報を取得
-                profile = line_bot_api.get_profile(line_id)
+                with track_line_api():
+                    profile = line_bot_api.get_profile(line_id)
                 # LINEユーザー名
                 name = profile.display_name
 
@@ -434,24 +716,38 @@ class CallbackView(View):
 
     # 友達解除
     @handler.add(UnfollowEvent)
+    @once_per_event
     def handle_unfollow(event):
         line_id = event.source.user_id
-        # 対応する顧客を見つけて削除
-        try:
-            user = Customer.objects.get(line_id=line_id)
-            user.delete()
-            print("友達解除されたユーザーを削除しました: ", line_id)
-        except Customer.DoesNotExist:
-            print("削除するユーザーが見つかりませんでした。", line_id)
+        # 無効にするだけで削除しない（注文履歴などの削除・匿名化は purge_customers で行う）
+        updated = Customer.objects.filter(line_id=line_id, is_active=True).update(
+            is_active=False, unfollowed_at=timezone.now()
+        )
+        if updated:
+            print("友達解除されたユーザーを無効にしました: ", line_id)
+        else:
+            print("無効にするユーザーが見つかりませんでした。", line_id)
 
     # テキストメッセージ
     @handler.add(MessageEvent, message=TextMessage)
+    @once_per_event
     def text_message(event):
-        print(event.message.text)
+        line_id = event.source.user_id
+        messages = command_reply(line_id, event.message.text.strip())
+        reply_message(event.reply_token, messages, line_id=line_id)
 
     # ポストバック
     @handler.add(PostbackEvent)
+    @once_per_event
     def on_postback(event):
-        pass
+        line_id = event.source.user_id
+        params = parse_qs(event.postback.data)
+        action = params.get("action", [""])[0]
+        order_id = params.get("order_id", [""])[0]
+        if order_id.isdigit():
+            messages = order_action_reply(line_id, action, int(order_id))
+        else:
+            messages = command_reply(line_id, action)
+        reply_message(event.reply_token, messages, line_id=line_id)
 
 
@@ -0,0 +1,67 @@
+"""
+Webhookイベントの重複排除
+
+LINEは応答が遅い・失敗した場合などに同じイベントを再送する（deliveryContext.isRedelivery が true）。
+イベントごとの webhookEventId を処理前に登録し、登録済みのイベントはハンドラーを実行しない。
+
+登録はまずキャッシュ（cache.add）で行い、重複配信の多くはキャッシュの参照1回で捨てる。
+キャッシュは期限切れ・プロセスごとの保持で取りこぼすため、WebhookEvent の一意制約を最終的な判定に使う。
+"""
+import functools
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from app.models import WebhookEvent
+
+# LINEの再送期間より長く保持する
+EVENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def event_cache_key(event_id):
+    return f"line:webhook:{event_id}"
+
+
+def claim_event(event):
+    """未処理のイベントであれば処理済みとして登録して True、処理済みなら False を返す"""
+    event_id = event.webhook_event_id
+    if not event_id:
+        return True
+    if not cache.add(event_cache_key(event_id), True, EVENT_CACHE_TIMEOUT):
+        return False
+
+    is_redelivery = bool(event.delivery_context and event.delivery_context.is_redelivery)
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(event_id=event_id, event_type=event.type, is_redelivery=is_redelivery)
+    except IntegrityError:
+        # キャッシュから消えた後の再送
+        return False
+    return True
+
+
+def release_event(event):
+    """ハンドラーが失敗したイベントの登録を取り消し、再送時に処理し直せるようにする"""
+    event_id = event.webhook_event_id
+    if not event_id:
+        return
+    WebhookEvent.objects.filter(event_id=event_id).delete()
+    cache.delete(event_cache_key(event_id))
+
+
+def once_per_event(func):
+    """同じイベントに対してハンドラーを1回だけ実行する"""
+
+    # WebhookHandler は引数の数で呼び出し方を変えるため、引数は event のみとする
+    @functools.wraps(func)
+    def wrapper(event):
+        if not claim_event(event):
+            print("処理済みのイベントのためスキップしました: ", event.webhook_event_id)
+            return
+        try:
+            func(event)
+        except Exception:
+            release_event(event)
+            raise
+
+    return wrapper
@@ -0,0 +1,239 @@
+"""
+リクエスト単位のパフォーマンス計測
+
+URL名ごとに以下をプロセス内ヒストグラムへ集計し、Prometheusのテキスト形式で公開する。
+
+- リクエスト全体の処理時間
+- DBクエリ数・クエリ時間（connection.execute_wrapper）
+- テンプレート描画時間
+- LINE API呼び出し時間（track_line_api）
+
+集計はワーカープロセスごとに保持されるため、gunicornで複数ワーカーを起動している場合は
+スクレイプしたワーカーの値のみが返る。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+# 処理時間（秒）用のバケット
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# クエリ数用のバケット
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    "request_duration_seconds": ("リクエスト処理時間", DURATION_BUCKETS),
+    "db_queries": ("リクエストあたりのDBクエリ数", COUNT_BUCKETS),
+    "db_query_duration_seconds": ("リクエストあたりのDBクエリ時間", DURATION_BUCKETS),
+    "template_render_seconds": ("リクエストあたりのテンプレート描画時間", DURATION_BUCKETS),
+    "line_api_duration_seconds": ("リクエストあたりのLINE API呼び出し時間", DURATION_BUCKETS),
+}
+
+METRIC_PREFIX = "coffee_"
+
+# 処理中リクエストの計測値
+_current = ContextVar("request_metrics", default=None)
+
+
+class Histogram:
+    """累積バケット方式のヒストグラム"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """(メトリクス名, URL名) ごとのヒストグラムを保持する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, view_name, values):
+        with self._lock:
+            for name, value in values.items():
+                key = (name, view_name)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(METRICS[name][1])
+                histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """Prometheusのテキスト形式に変換する"""
+        with self._lock:
+            snapshot = {
+                key: (list(h.cumulative()), h.sum, h.count)
+                for key, h in self._histograms.items()
+            }
+
+        lines = []
+        for name, (help_text, _) in METRICS.items():
+            metric = METRIC_PREFIX + name
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for (key_name, view_name), (buckets, total, count) in sorted(snapshot.items()):
+                if key_name != name:
+                    continue
+                label = f'view="{_escape(view_name)}"'
+                for bound, value in buckets:
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {value}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f"{metric}_sum{{{label}}} {total}")
+                lines.append(f"{metric}_count{{{label}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+
+def _add(key, value):
+    state = _current.get()
+    if state is not None:
+        state[key] += value
+
+
+@contextmanager
+def track_line_api():
+    """LINE API呼び出しの所要時間を現在のリクエストに加算する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add("line_api_duration_seconds", time.perf_counter() - start)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        state = _current.get()
+        if state is not None:
+            state["db_queries"] += 1
+            state["db_query_duration_seconds"] += time.perf_counter() - start
+
+
+_template_patched = False
+
+
+def _patch_template_render():
+    """テンプレートバックエンドのrenderをラップし、描画時間を計測する"""
+    global _template_patched
+    if _template_patched:
+        return
+
+    from django.template.backends.django import Template
+
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        state = _current.get()
+        if state is None:
+            return original_render(self, context, request)
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            state["template_render_seconds"] += time.perf_counter() - start
+
+    Template.render = render
+    _template_patched = True
+
+
+def _install_db_wrapper(sender=None, connection=None, **kwargs):
+    """
+    DB接続にクエリ計測用のラッパーを登録する。
+    非同期ビューではORMが別スレッドで実行されるため、リクエストごとではなく
+    接続ごとに登録し、計測値はContextVar経由で受け渡す
+    """
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+        _patch_template_render()
+        connection_created.connect(_install_db_wrapper, dispatch_uid="request_metrics")
+        for connection in connections.all(initialized_only=True):
+            _install_db_wrapper(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self._finish(request, state, token, start)
+        return response
+
+    async def __acall__(self, request):
+        state, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._finish(request, state, token, start)
+        return response
+
+    def _start(self):
+        state = dict.fromkeys(METRICS, 0)
+        return state, _current.set(state), time.perf_counter()
+
+    def _finish(self, request, state, token, start):
+        state["request_duration_seconds"] = time.perf_counter() - start
+        _current.reset(token)
+
+        match = getattr(request, "resolver_match", None)
+        view_name = match.view_name if match and match.view_name else "<unresolved>"
+        registry.observe(view_name, state)
+
+
+# メトリクス出力（管理者のみ）
+def metrics_view(request):
+    if not request.user.is_superuser:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
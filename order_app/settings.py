@@ -42,9 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "order_app.metrics.RequestMetricsMiddleware",
     "allauth.account.middleware.AccountMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "order_app.middleware.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -53,6 +54,9 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# リクエスト計測（/metrics/ で公開）
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+
 ROOT_URLCONF = "order_app.urls"
 
 TEMPLATES = [
@@ -79,6 +83,19 @@ DATABASES = {
     "default": config("DATABASE_URL", default=default_dburl, cast=dburl),
 }
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # 複数ワーカーからの同時書き込みで "database is locked" にならないよう、
+    # トランザクション開始時に書き込みロックを取り、WALで読み込みと並行させる
+    DATABASES["default"].setdefault("OPTIONS", {}).update(
+        {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL",
+        }
+    )
+    # テストDBもファイルにする（インメモリDBはスレッド間でテーブルロックになり、同時注文のテストができない）
+    DATABASES["default"].setdefault("TEST", {}).setdefault("NAME", str(BASE_DIR / "test_db.sqlite3"))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -140,6 +157,20 @@ else:
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# キャッシュ（既定はプロセス内メモリ。gunicorn を複数ワーカーで起動するには CACHE_URL=redis://... が必要で、未指定なら1ワーカーで起動する）
+CACHES = {"default": env.cache_url("CACHE_URL", default="locmemcache://")}
+
+# セッションは署名付きCookieに保存し、LINEからのアクセスでDBに書き込まない
+SESSION_ENGINE = config("SESSION_ENGINE", default="django.contrib.sessions.backends.signed_cookies")
+# フラッシュメッセージもCookieに保存する
+MESSAGE_STORAGE = "django.contrib.messages.storage.cookie.CookieStorage"
+
+# この日数以上操作されていないカートは purge_carts で削除する
+CART_EXPIRE_DAYS = config("CART_EXPIRE_DAYS", default=14, cast=int)
+
+# 友達解除からこの日数が経過した顧客は purge_customers で匿名化する
+CUSTOMER_RETENTION_DAYS = config("CUSTOMER_RETENTION_DAYS", default=30, cast=int)
+
 SITE_ID = 1
 LOGIN_REDIRECT_URL = "/"
 ACCOUNT_LOGOUT_REDIRECT_URL = "/"
@@ -152,4 +183,8 @@ ACCOUNT_USERNAME_REQUIRED = False
 
 CHANNEL_ACCESS_TOKEN = env("CHANNEL_ACCESS_TOKEN")
 CHANNEL_SECRET = env("CHANNEL_SECRET")
-LIFF_ID = env("LIFF_ID")
\ No newline at end of file
+LIFF_ID = env("LIFF_ID")
+# LINE Messaging APIのエンドポイント（ベンチマーク時はスタブサーバーを指定）
+LINE_API_ENDPOINT = config("LINE_API_ENDPOINT", default="https://api.line.me")
+# LINE向けビューを非同期版（line.async_views）に切り替える。ASGIワーカーで起動する場合に有効化
+LINE_ASYNC_VIEWS = config("LINE_ASYNC_VIEWS", default=False, cast=bool)
\ No newline at end of file
@@ -0,0 +1,57 @@
+import re
+
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import UserAccount
+from order_app.metrics import registry, track_line_api
+
+
+def sample(text, metric, view, suffix):
+    """Prometheusのテキストから1つの値を取り出す"""
+    match = re.search(rf'^coffee_{metric}_{suffix}{{view="{re.escape(view)}"}} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+        self.superuser = UserAccount.objects.create_superuser("admin@example.com", "password", name="管理者")
+
+    def test_middleware_records_request_db_and_template_timings(self):
+        self.client.get(reverse("line:index"))
+
+        text = registry.render()
+        for metric in ("request_duration_seconds", "db_query_duration_seconds", "template_render_seconds"):
+            with self.subTest(metric=metric):
+                self.assertEqual(sample(text, metric, "line:index", "count"), 1)
+                self.assertGreater(sample(text, metric, "line:index", "sum"), 0)
+        self.assertGreaterEqual(sample(text, "db_queries", "line:index", "sum"), 1)
+        # LINE APIを呼んでいないリクエストは0として記録する
+        self.assertEqual(sample(text, "line_api_duration_seconds", "line:index", "sum"), 0)
+
+    def test_line_api_time_outside_request_is_ignored(self):
+        with track_line_api():
+            pass
+
+        self.assertNotIn("view=", registry.render())
+
+    def test_metrics_is_forbidden_for_non_superusers(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+        user = UserAccount.objects.create_user("shop@example.com", "password", name="ショップ")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+    def test_superuser_gets_histogram_text(self):
+        self.client.get(reverse("line:index"))
+        self.client.force_login(self.superuser)
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn("# TYPE coffee_request_duration_seconds histogram", text)
+        self.assertIn('coffee_request_duration_seconds_bucket{view="line:index",le="+Inf"} 1', text)
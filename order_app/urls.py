@@ -20,12 +20,15 @@ from django.contrib import admin
 from django.urls import include, path
 from django.http import HttpResponse
 
+from order_app.metrics import metrics_view
+
 def health_check(request):
     return HttpResponse("OK", status=200)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("health/", health_check, name="health_check"),
+    path("metrics/", metrics_view, name="metrics"),
     # トップページ
     path("", include("app.urls")),
     # アカウント認証